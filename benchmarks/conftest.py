@@ -0,0 +1,73 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import platform
+import tracemalloc
+
+import pytest
+
+# pytest-benchmark only gates on timings, peak memory has its own per-machine baseline
+MEMORY_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'memory-baseline.json')
+PEAKS = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmark')
+    group.addoption('--memory-save', action='store_true',
+                    help='Store the peak memory of every benchmark as the baseline of this machine')
+    group.addoption('--memory-compare-fail', type=float, default=None, metavar='PERCENT',
+                    help='Fail when a benchmark uses more than PERCENT more memory than the baseline')
+
+
+def _load_baseline():
+    if not os.path.isfile(MEMORY_BASELINE):
+        return {}
+    with open(MEMORY_BASELINE) as file:
+        return json.load(file)['results']
+
+
+@pytest.fixture
+def peak_memory(request, benchmark):
+    """
+    Peak memory of a single call, traced outside of the timed rounds since tracemalloc slows down the code.
+    """
+    def measure(function, *args):
+        tracemalloc.start()
+        try:
+            function(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        name = request.node.name
+        PEAKS[name] = peak
+        benchmark.extra_info['peak_memory'] = peak
+        threshold = request.config.getoption('memory_compare_fail')
+        previous = _load_baseline().get(name)
+        if threshold is not None and previous and peak > previous * (1 + threshold / 100):
+            pytest.fail(f'{name} peak memory: {peak / 1024:.1f}KiB vs baseline {previous / 1024:.1f}KiB '
+                        f'(+{int((peak / previous - 1) * 100)}%)')
+        return peak
+    return measure
+
+
+def pytest_sessionfinish(session):
+    if not session.config.getoption('memory_save', default=False) or not PEAKS:
+        return
+    results = _load_baseline()
+    results.update(PEAKS)
+    with open(MEMORY_BASELINE, 'w') as file:
+        json.dump({'machine': platform.node(), 'python': platform.python_version(), 'results': results},
+                  file, indent=2, sort_keys=True)
@@ -0,0 +1,105 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import socket
+import threading
+
+PROMPT = 'admin@PA-VM> '
+MORE = '\n--(more)--'
+TRANSCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transcripts')
+
+
+def transcript(name):
+    with open(os.path.join(TRANSCRIPTS, name)) as file:
+        return file.read().replace('\n', '\r\n')
+
+
+def synthetic_output(lines, width=100):
+    """
+    CLI output of the given number of lines, similar to "show jobs all" or "show system files".
+    """
+    row = '{:>6}  2021/01/01 00:00:00  FIN  OK  Content  ' + 'x' * max(width - 48, 0)
+    return '\r\n'.join(row.format(number) for number in range(lines))
+
+
+class FakeDevice(object):
+    def __init__(self, responses, page_lines=0):
+        """
+        PAN-OS CLI stand-in answering commands with canned responses.
+        :param dict responses: Command (or command prefix) to response text
+        :param int page_lines: Split responses in "--(more)--" pages of this many lines, 0 for no paging
+        """
+        self.responses = responses
+        self.page_lines = page_lines
+        self.pages = []
+
+    def _response(self, command):
+        if command in self.responses:
+            return self.responses[command]
+        for prefix, response in self.responses.items():
+            if command.startswith(prefix):
+                return response
+        return ''
+
+    def reply(self, data):
+        """
+        :param str data: Line sent by the client
+        :return: Text the device prints back, including the echo and the prompt or page marker.
+        """
+        command = data.rstrip('\r\n')
+        if not command and self.pages:
+            page = self.pages.pop(0)
+            return page + (MORE if self.pages else '\r\n' + PROMPT)
+        lines = self._response(command).split('\r\n')
+        if self.page_lines and len(lines) > self.page_lines:
+            self.pages = ['\r\n'.join(lines[start:start + self.page_lines])
+                          for start in range(0, len(lines), self.page_lines)]
+            return f'{command}\r\n{self.pages.pop(0)}{MORE}'
+        if not self._response(command):
+            return f'{command}\r\n{PROMPT}'
+        return f'{command}\r\n{self._response(command)}\r\n{PROMPT}'
+
+
+class FakeChannel(object):
+    def __init__(self, responses, page_lines=0, chunk=4096):
+        """
+        Paramiko channel stand-in replaying PAN-OS CLI responses over a socketpair, so select() works.
+        :param dict responses: Command to response text
+        :param int page_lines: Split responses in "--(more)--" pages of this many lines, 0 for no paging
+        :param int chunk: Bytes per write, to mimic SSH packets
+        """
+        self.device = FakeDevice(responses, page_lines)
+        self.chunk = chunk
+        self.local, self.remote = socket.socketpair()
+
+    def fileno(self):
+        return self.local.fileno()
+
+    def _write(self, text):
+        data = text.encode('utf-8')
+        for start in range(0, len(data), self.chunk):
+            self.remote.sendall(data[start:start + self.chunk])
+
+    def send(self, data):
+        # Written from a thread, a large response does not fit in the socket buffer
+        threading.Thread(target=self._write, args=(self.device.reply(data),), daemon=True).start()
+        return len(data)
+
+    def recv(self, size):
+        return self.local.recv(size)
+
+    def close(self):
+        self.local.close()
+        self.remote.close()
@@ -0,0 +1,346 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local fake of the Compute Engine v1 API, and concurrent CloudGcp instance and image lifecycles against it:
+    python -m benchmarks.fake_compute --builds 20
+    python -m benchmarks.fake_compute --serve --port 8085
+Operations complete after --operation-seconds. Launches of the --exhausted machine types fail with
+ZONE_RESOURCE_POOL_EXHAUSTED, and every --throttle-every request is answered with a 429.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import paramiko
+
+PROJECT = 'fake-project'
+ZONE = 'us-central1-a'
+MACHINE_TYPES = {'n1-standard-4': 4, 'n1-standard-8': 8, 'n2-standard-4': 4, 'n2-standard-8': 8}
+# Seconds a "wait" call holds the connection when the operation is not done, 2 minutes on Compute Engine
+WAIT_TIMEOUT = 30
+SERIAL_LOG = 'Booting Linux on physical CPU 0x0\r\nLinux version 4.18.0\r\n\r\nPA-VM login: \r\n'
+
+
+class ComputeServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeCompute(object):
+    def __init__(self, operation_seconds=1.0, exhausted=(), throttle_every=0):
+        self.operation_seconds = operation_seconds
+        self.exhausted = set(exhausted)
+        self.throttle_every = throttle_every
+        # Routes run under the lock and create operations
+        self.lock = threading.RLock()
+        self.instances = {}
+        self.images = {}
+        # Instance templates by name, global
+        self.templates = {}
+        self.operations = {}
+        self.done = {}
+        self.calls = Counter()
+        self.requests = 0
+        self.base = ''
+
+    def _operation(self, scope, kind, target, finish, error=None):
+        with self.lock:
+            name = f'operation-{len(self.operations) + 1}'
+            operation = {'kind': 'compute#operation', 'name': name, 'status': 'RUNNING', 'operationType': kind,
+                         'targetLink': f'{self.base}/projects/{PROJECT}/{target}',
+                         'selfLink': f'{self.base}/projects/{PROJECT}/{scope}/operations/{name}'}
+            self.operations[name] = operation
+            self.done[name] = threading.Event()
+
+        def complete():
+            with self.lock:
+                if error:
+                    operation['error'] = {'errors': [{'code': error[0], 'message': error[1]}]}
+                else:
+                    finish()
+                operation['status'] = 'DONE'
+            self.done[name].set()
+        timer = threading.Timer(self.operation_seconds, complete)
+        timer.daemon = True
+        timer.start()
+        return dict(operation)
+
+    def _wait(self, name):
+        if name not in self.done:
+            return 404, _error(404, f'Operation {name} not found.', 'notFound')
+        self.done[name].wait(WAIT_TIMEOUT)
+        with self.lock:
+            return 200, dict(self.operations[name])
+
+    def _insert_instance(self, zone, body):
+        name = body['name']
+        machine_type = body['machineType'].rsplit('/', 1)[-1]
+        if (zone, name) in self.instances:
+            return 409, _error(409, f'The resource {name} already exists', 'alreadyExists')
+        if machine_type not in MACHINE_TYPES:
+            return 400, _error(400, f'Invalid machine type {machine_type}.', 'invalid')
+        error = None
+        if machine_type in self.exhausted:
+            error = ('ZONE_RESOURCE_POOL_EXHAUSTED', f'The zone {zone} does not have enough resources available '
+                                                     f'to fulfill the request. Try a different zone.')
+
+        def finish():
+            address = f'203.0.113.{len(self.instances) % 250 + 1}'
+            interfaces = [dict(interface, networkIP=f'10.0.{index}.10') for index, interface in
+                          enumerate(body['networkInterfaces'])]
+            interfaces[0]['accessConfigs'] = [dict(interfaces[0]['accessConfigs'][0], natIP=address)]
+            self.instances[(zone, name)] = {
+                'name': name, 'zone': zone, 'status': 'RUNNING', 'machineType': body['machineType'],
+                'networkInterfaces': interfaces, 'labels': body.get('labels', {}),
+                'sourceImage': body['disks'][0]['initializeParams']['sourceImage'],
+            }
+        return 200, self._operation(f'zones/{zone}', 'insert', f'zones/{zone}/instances/{name}', finish, error)
+
+    def _instance_operation(self, zone, name, kind):
+        if (zone, name) not in self.instances:
+            return 404, _error(404, f'The resource instances/{name} was not found', 'notFound')
+
+        def finish():
+            if kind == 'delete':
+                self.instances.pop((zone, name), None)
+            else:
+                self.instances[(zone, name)]['status'] = 'TERMINATED'
+        return 200, self._operation(f'zones/{zone}', kind, f'zones/{zone}/instances/{name}', finish)
+
+    def _insert_image(self, body):
+        name = body['name']
+        zone, disk = re.match(r'zones/([^/]+)/disks/([^/]+)', body['sourceDisk']).groups()
+        if (zone, disk) not in self.instances:
+            return 404, _error(404, f'The resource disks/{disk} was not found', 'notFound')
+        if name in self.images:
+            return 409, _error(409, f'The resource {name} already exists', 'alreadyExists')
+
+        def finish():
+            self.images[name] = dict(body, status='READY', diskSizeGb='60',
+                                     selfLink=f'{self.base}/projects/{PROJECT}/global/images/{name}')
+        return 200, self._operation('global', 'insert', f'global/images/{name}', finish)
+
+    def _delete_image(self, name):
+        if name not in self.images:
+            return 404, _error(404, f'The resource images/{name} was not found', 'notFound')
+        return 200, self._operation('global', 'delete', f'global/images/{name}', lambda: self.images.pop(name, None))
+
+    def _disks(self):
+        disks = {}
+        for (zone, name), instance in self.instances.items():
+            disks.setdefault(f'zones/{zone}', {'disks': []})['disks'].append(
+                {'name': name, 'sourceImage': instance['sourceImage'], 'users': [name]})
+        return disks
+
+    def _aggregated(self, items, query):
+        """
+        Aggregated list answered one zone or region per page, as Compute Engine may.
+        """
+        scopes = sorted(items)
+        index = int(query.get('pageToken', ['0'])[0])
+        page = {'items': {scope: items[scope] for scope in scopes[index:index + 1]}}
+        if index + 1 < len(scopes):
+            page['nextPageToken'] = str(index + 1)
+        return 200, page
+
+    def handle(self, method, path, query, body):
+        """
+        :return: (HTTP status, JSON answer)
+        """
+        with self.lock:
+            self.requests += 1
+            throttled = self.throttle_every and self.requests % self.throttle_every == 0
+        match = re.match(r'^/compute/v1/projects/([^/]+)/(.*)$', path)
+        if not match:
+            return 404, _error(404, f'Not found: {path}', 'notFound')
+        project, path = match.groups()
+        # Calls on resources of the same kind are counted together
+        kind = re.sub(r'(instances|images|operations)/[^/]+', r'\1/*', path)
+        with self.lock:
+            self.calls[f'{method} {kind}'] += 1
+        if throttled:
+            return 429, _error(429, 'Rate Limit Exceeded', 'rateLimitExceeded')
+        if project != PROJECT:
+            # Public images of other projects
+            if method == 'GET' and re.match(r'^global/images/[^/]+$', path):
+                return 200, {'name': path.rsplit('/', 1)[-1], 'status': 'READY'}
+            return 403, _error(403, f'Required permission on project {project}.', 'forbidden')
+        routes = [
+            ('POST', r'^(?:zones|regions)/[^/]+/operations/([^/]+)/wait$', lambda name: self._wait(name)),
+            ('POST', r'^global/operations/([^/]+)/wait$', lambda name: self._wait(name)),
+            ('POST', r'^zones/([^/]+)/instances$', lambda zone: self._insert_instance(zone, body)),
+            ('POST', r'^zones/([^/]+)/instances/([^/]+)/stop$',
+             lambda zone, name: self._instance_operation(zone, name, 'stop')),
+            ('DELETE', r'^zones/([^/]+)/instances/([^/]+)$',
+             lambda zone, name: self._instance_operation(zone, name, 'delete')),
+            ('GET', r'^zones/([^/]+)/instances/([^/]+)/serialPort$',
+             lambda zone, name: (200, {'contents': SERIAL_LOG})),
+            ('GET', r'^zones/([^/]+)/instances/([^/]+)$', lambda zone, name: _found(self.instances.get((zone, name)))),
+            ('GET', r'^zones/([^/]+)/machineTypes$', lambda zone: (200, {'items': [
+                {'name': name, 'guestCpus': cpus} for name, cpus in MACHINE_TYPES.items()]})),
+            ('GET', r'^zones/([^/]+)/machineTypes/([^/]+)$', lambda zone, name: _found(
+                {'name': name, 'guestCpus': MACHINE_TYPES[name]} if name in MACHINE_TYPES else None)),
+            ('GET', r'^regions/([^/]+)/subnetworks/([^/]+)$', lambda region, name: (200, {'name': name})),
+            ('GET', r'^regions/([^/]+)$', lambda region: (200, {'name': region, 'quotas': [
+                {'metric': 'CPUS', 'limit': 100000.0, 'usage': 8.0 * len(self.instances)}]})),
+            ('POST', r'^global/images$', lambda: self._insert_image(body)),
+            ('GET', r'^global/images$', lambda: (200, {'items': [
+                image for image in self.images.values()
+                if 'labels.custom-imaging=true' not in query.get('filter', [''])[0] or
+                image.get('labels', {}).get('custom-imaging') == 'true']})),
+            ('GET', r'^global/images/([^/]+)$', lambda name: _found(self.images.get(name))),
+            ('DELETE', r'^global/images/([^/]+)$', lambda name: self._delete_image(name)),
+            ('GET', r'^aggregated/disks$', lambda: self._aggregated(self._disks(), query)),
+            ('GET', r'^aggregated/instanceTemplates$', lambda: self._aggregated(
+                {'global': {'instanceTemplates': list(self.templates.values())}} if self.templates else {}, query)),
+        ]
+        for route_method, pattern, action in routes:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                if 'wait' in pattern:
+                    return action(*match.groups())
+                with self.lock:
+                    return action(*match.groups())
+        return 404, _error(404, f'Not found: {method} {path}', 'notFound')
+
+
+def _error(code, message, reason):
+    return {'error': {'code': code, 'message': message, 'errors': [{'message': message, 'reason': reason}]}}
+
+
+def _found(resource):
+    return (200, dict(resource)) if resource is not None else (404, _error(404, 'The resource was not found',
+                                                                           'notFound'))
+
+
+def serve(fake, port=0):
+    """
+    :return: Running HTTPServer, in a daemon thread
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _answer(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            status, answer = fake.handle(self.command, url.path, parse_qs(url.query), body)
+            data = json.dumps(answer).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_DELETE = _answer
+
+        def log_message(self, *args):
+            pass
+
+    server = ComputeServer(('127.0.0.1', port), Handler)
+    fake.base = f'http://127.0.0.1:{server.server_address[1]}/compute/v1'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def lifecycle(config, logger):
+    from cloudclient.gcp_client import CloudGcp
+
+    client = CloudGcp(logger, config)
+    started = time.time()
+    try:
+        client.create_instance()
+        client.wait_for_boot(60)
+        if not client.stop_instance() or not client.create_image('PanOS-10.0.3-CustomImage'):
+            raise Exception(f'Build {config["build_id"]} failed.')
+    finally:
+        client.terminate_instance()
+    return {'seconds': time.time() - started, 'attempts': len(client.launches)}
+
+
+def run(args):
+    from cloudclient.throttle import THROTTLE
+
+    fake = FakeCompute(args.operation_seconds, args.exhausted, args.throttle_every)
+    server = serve(fake)
+    logger = logging.getLogger('fake_compute')
+    # Capacity fallbacks are logged as warnings
+    logger.setLevel(logging.ERROR)
+    directory = tempfile.mkdtemp()
+    pkey = os.path.join(directory, 'private_key.pem')
+    paramiko.RSAKey.generate(2048).write_private_key_file(pkey)
+    configs = [{
+        'project': PROJECT, 'zone': ZONE, 'gcp_endpoint': fake.base, 'build_id': f'bench-{number}',
+        'source_image': 'projects/paloaltonetworksgcp-public/global/images/vmseries-flex-byol-1003',
+        'subnetworks': ['mgmt', 'untrust', 'trust'], 'machine_type': args.machine_type,
+        'fallback_sizes': ['n2-standard-8'], 'fallback_placements': ['us-central1-b'],
+        'image_family': 'vmseries-custom', 'pkey': pkey, 'version': '10.0.3', 'image_sku': 'byol',
+        'runtime_size': 'n1-standard-4', 'api_rate_limit': args.rate,
+    } for number in range(args.builds)]
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.builds) as executor:
+        results = list(executor.map(lambda config: lifecycle(config, logger), configs))
+    wall = time.time() - started
+    server.shutdown()
+    seconds = sorted(result['seconds'] for result in results)
+    print(f'{args.builds} builds in {wall:.1f}s, median build {seconds[len(seconds) // 2]:.1f}s, '
+          f'{sum(result["attempts"] for result in results)} launch attempts, {len(fake.images)} images')
+    print(f'{"CALLS":>6}  METHOD')
+    for name, count in fake.calls.most_common():
+        print(f'{count:>6}  {name}')
+    for name, values in THROTTLE.stats.items():
+        print(f'{name}: {values["calls"]} calls, {values["throttled"]} throttled, {values["errors"]} errors, '
+              f'{values["waited"]:.1f}s waited')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake Compute Engine API and concurrent GCP builds')
+    parser.add_argument('--builds', type=int, default=10)
+    parser.add_argument('--operation-seconds', type=float, default=1.0, help='Time every operation takes')
+    parser.add_argument('--machine-type', default='n1-standard-8')
+    parser.add_argument('--exhausted', nargs='*', default=['n1-standard-8'], help='Machine types without capacity')
+    parser.add_argument('--throttle-every', type=int, default=50, help='Answer every Nth request with a 429')
+    parser.add_argument('--rate', type=float, default=0, help='api-rate-limit, 0 for the GCP default')
+    parser.add_argument('--serve', action='store_true', help='Only run the fake')
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        fake = FakeCompute(args.operation_seconds, args.exhausted, args.throttle_every)
+        server = serve(fake, args.port)
+        print(fake.base, flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
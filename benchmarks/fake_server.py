@@ -0,0 +1,126 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local SSH server emulating PAN-OS firewalls, one emulated firewall per connection:
+    python -m benchmarks.fake_server --port 2222
+Any user name and password is accepted.
+"""
+
+import argparse
+import logging
+import socket
+import sys
+import threading
+
+import paramiko
+
+from benchmarks.fake_channel import FakeDevice, PROMPT, synthetic_output, transcript
+
+BANNER = 'Last login: Fri Jan  1 00:00:00 2021 from 10.0.0.1\r\n\r\n'
+
+
+def responses():
+    return {
+        'show system info': transcript('show-system-info.txt'),
+        'show jobs id': transcript('show-jobs-id.txt'),
+        'request content upgrade download latest': transcript('request-content-download.txt'),
+        'show jobs all': synthetic_output(200),
+    }
+
+
+class FakeFirewall(paramiko.ServerInterface):
+    def __init__(self):
+        self.shell = threading.Event()
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password,publickey'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_REQUEST
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell.set()
+        return True
+
+
+def serve_connection(client, host_key):
+    transport = paramiko.Transport(client)
+    transport.add_server_key(host_key)
+    server = FakeFirewall()
+    try:
+        transport.start_server(server=server)
+        channel = transport.accept(30)
+        if channel is None or not server.shell.wait(30):
+            return
+        device = FakeDevice(responses())
+        channel.sendall(BANNER + PROMPT)
+        line = ''
+        while True:
+            data = channel.recv(1024)
+            if not data:
+                break
+            line += data.decode('utf-8')
+            while '\n' in line:
+                command, line = line.split('\n', 1)
+                channel.sendall(device.reply(command).encode('utf-8'))
+    except (EOFError, OSError, paramiko.SSHException):
+        pass
+    finally:
+        transport.close()
+
+
+def serve(host='127.0.0.1', port=0, ready=None):
+    """
+    Accept connections forever.
+    :param ready: Callable(port) called once listening
+    """
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(512)
+    if ready:
+        ready(listener.getsockname()[1])
+    while True:
+        client, _ = listener.accept()
+        threading.Thread(target=serve_connection, args=(client, host_key), daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake PAN-OS SSH server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+    args = parser.parse_args(argv)
+    # Clients closing their session are reported as connection resets
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+    def ready(port):
+        print(port, flush=True)
+    serve(args.host, args.port, ready)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
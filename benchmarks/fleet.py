@@ -0,0 +1,137 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Drive many emulated firewalls at once with the threaded PanosDevice and the asyncio AsyncPanosDevice:
+    python -m benchmarks.fleet --devices 50 --commands 10
+Each driver runs in its own process against benchmarks.fake_server.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.async_device import AsyncPanosDevice, connect_all
+from lib.pandevice import PanosDevice
+
+DRIVERS = ('threaded', 'async')
+COMMANDS = ['show system info', 'show jobs id 4', 'show jobs all']
+
+
+def _logger():
+    logger = logging.getLogger('fleet')
+    logger.propagate = False
+    logger.setLevel(logging.WARNING)
+    # Sessions left open by PanosDevice.close() are reset when the process exits
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    return logger
+
+
+def _rss():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ThreadCounter(object):
+    def __init__(self):
+        self.peak = threading.active_count()
+        self.running = True
+        threading.Thread(target=self._sample, daemon=True).start()
+
+    def _sample(self):
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.05)
+
+
+def run_threaded(port, devices, commands):
+    logger = _logger()
+
+    def drive(_):
+        device = PanosDevice(logger, host='127.0.0.1', port=port, user='admin', password='admin')
+        for number in range(commands):
+            device.exec(COMMANDS[number % len(COMMANDS)])
+        device.close()
+    with ThreadPoolExecutor(max_workers=devices) as executor:
+        list(executor.map(drive, range(devices)))
+
+
+def run_async(port, devices, commands):
+    logger = _logger()
+
+    async def drive(device):
+        for number in range(commands):
+            await device.exec(COMMANDS[number % len(COMMANDS)])
+        await device.close()
+
+    async def fleet():
+        sessions = [AsyncPanosDevice(logger, host='127.0.0.1', port=port, user='admin', password='admin')
+                    for _ in range(devices)]
+        for result in await connect_all(sessions):
+            if isinstance(result, Exception):
+                raise result
+        await asyncio.gather(*[drive(device) for device in sessions])
+    asyncio.get_event_loop().run_until_complete(fleet())
+
+
+def measure(driver, port, devices, commands):
+    rss = _rss()
+    threads = ThreadCounter()
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    (run_async if driver == 'async' else run_threaded)(port, devices, commands)
+    threads.running = False
+    return {'driver': driver, 'devices': devices, 'commands': commands,
+            'wall': time.perf_counter() - started, 'cpu': time.process_time() - started_cpu,
+            'rss_per_device_kb': (_rss() - rss) / devices, 'peak_threads': threads.peak}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Threaded vs asyncio device driver benchmark')
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--commands', type=int, default=10, help='Commands per device')
+    parser.add_argument('--driver', choices=DRIVERS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.driver:
+        print(json.dumps(measure(args.driver, args.port, args.devices, args.commands)))
+        return 0
+
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_server'], stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    try:
+        port = int(server.stdout.readline())
+        print(f'{"DRIVER":<10} {"DEVICES":>8} {"WALL":>9} {"CPU":>9} {"RSS/DEVICE":>12} {"THREADS":>8}')
+        for driver in DRIVERS:
+            output = subprocess.check_output([sys.executable, '-m', 'benchmarks.fleet', '--driver', driver,
+                                              '--port', str(port), '--devices', str(args.devices),
+                                              '--commands', str(args.commands)], universal_newlines=True)
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f'{driver:<10} {result["devices"]:>8} {result["wall"]:>8.1f}s {result["cpu"]:>8.1f}s '
+                  f'{result["rss_per_device_kb"]:>9.0f}KiB {result["peak_threads"]:>8}')
+    finally:
+        server.terminate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
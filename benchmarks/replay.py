@@ -0,0 +1,88 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replay a CLI transcript recorded with record-transcripts through PanosDevice, without a firewall:
+    python -m benchmarks.replay transcripts/<build id>.jsonl.gz [--speed 1] [--show]
+Every recorded command is sent again and its output parsed. A command whose output does not parse any more
+times out, a client sending something else than the recorded session fails with "Replay diverged".
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from lib.pandevice import PanosDevice
+from lib.transcript import Replay
+
+# Patterns of the commands rebooting the device, see PanosDevice.restart_system()
+REBOOT_PATTERNS = ['NOW!', 'Broadcast message from root']
+
+
+def _logger(verbose):
+    logger = logging.getLogger('replay')
+    logger.propagate = False
+    logger.setLevel(logging.INFO if verbose else logging.WARNING)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    return logger
+
+
+def replay(path, speed=None, timeout=10, logger=None):
+    """
+    :param float speed: 1 for the recorded speed, None for as fast as possible
+    :param int timeout: Seconds to wait for the expected prompt
+    :return: List of (session, command, seconds, parsed response or None on timeout)
+    """
+    logger = logger or _logger(False)
+    transcript = Replay(path, speed)
+    results = []
+    session = 0
+    while transcript.sessions:
+        # Connecting replays the banner and the CLI setup commands of the session
+        device = PanosDevice(logger, host='replay', user='admin', password='replay', replay=transcript)
+        device.min_timeout = timeout
+        for command in device.handle.client.commands():
+            started = time.perf_counter()
+            found = device.execute(command=command, pattern=[device.prompt] + REBOOT_PATTERNS, timeout=timeout)
+            results.append((session, command, time.perf_counter() - started, device.response if found != -1 else None))
+        device.close()
+        session += 1
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a CLI transcript through PanosDevice')
+    parser.add_argument('transcript', help='Transcript file recorded with record-transcripts')
+    parser.add_argument('--speed', type=float, help='1 for the recorded speed, default: as fast as possible')
+    parser.add_argument('--timeout', type=int, default=10, help='Seconds to wait for the expected prompt')
+    parser.add_argument('--show', action='store_true', help='Print the parsed output of every command')
+    args = parser.parse_args(argv)
+
+    results = replay(args.transcript, args.speed, args.timeout, _logger(False))
+    failed = 0
+    print(f'{"SESSION":>7} {"TIME":>9}  COMMAND')
+    for session, command, seconds, response in results:
+        failed += response is None
+        print(f'{session:>7} {seconds * 1000:>7.1f}ms  {command}{"  (TIMEOUT)" if response is None else ""}')
+        if args.show and response is not None:
+            print(response)
+    print(f'{len(results)} command(s) replayed, {failed} timed out.')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cold start cost of the command line and of the build library, each run in a fresh interpreter:
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import runpy
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _start_help():
+    sys.argv = ['start.py', '--help']
+    with redirect_stdout(io.StringIO()):
+        try:
+            runpy.run_path(os.path.join(ROOT, 'start.py'), run_name='__main__')
+        except SystemExit:
+            pass
+
+
+def _import_library():
+    import lib.utils  # noqa: F401
+
+
+def _provider(name):
+    def resolve():
+        from cloudclient.cloud_client import provider_class
+        provider_class(name)
+    return resolve
+
+
+SCENARIOS = {
+    'start.py --help': _start_help,
+    'import lib.utils': _import_library,
+    'resolve aws': _provider('aws'),
+    'resolve azure': _provider('azure'),
+}
+
+
+def child(scenario):
+    baseline = len(sys.modules)
+    started = time.perf_counter()
+    error = None
+    try:
+        SCENARIOS[scenario]()
+    except ImportError as e:
+        error = str(e)
+    print(json.dumps({'seconds': time.perf_counter() - started, 'modules': len(sys.modules) - baseline,
+                      'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'error': error}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold start benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child)
+        return 0
+
+    print(f'{"SCENARIO":<20} {"PROCESS":>9} {"IMPORTS":>9} {"MODULES":>8} {"MAX RSS":>10}')
+    for scenario in SCENARIOS:
+        runs = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            output = subprocess.check_output([sys.executable, '-m', 'benchmarks.startup', '--child', scenario],
+                                             cwd=ROOT, universal_newlines=True)
+            result = json.loads(output.strip().splitlines()[-1])
+            result['process'] = time.perf_counter() - started
+            runs.append(result)
+        if runs[0]['error']:
+            print(f'{scenario:<20} unavailable: {runs[0]["error"]}')
+            continue
+        print(f'{scenario:<20} {statistics.median(run["process"] for run in runs) * 1000:>7.0f}ms '
+              f'{statistics.median(run["seconds"] for run in runs) * 1000:>7.0f}ms '
+              f'{runs[0]["modules"]:>8} {max(run["rss_kb"] for run in runs) / 1024:>8.1f}MiB')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
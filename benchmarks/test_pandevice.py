@@ -0,0 +1,111 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+import types
+
+import pytest
+import yaml
+
+from benchmarks.fake_channel import FakeChannel, PROMPT, synthetic_output, transcript
+from cloudclient.boot_signals import boot_complete
+from lib import pandevice
+from lib.pandevice import Handle, Output
+
+SIZES = {'small': 10, 'medium': 1000, 'large': 10000}
+PAGE_LINES = 500
+# Handle.expect_output sleeps 0.5s before reading, which is not CPU work
+NO_SLEEP = types.SimpleNamespace(time=time.time, sleep=lambda seconds: None)
+
+
+class Device(object):
+    host = 'benchmark'
+    shelltype = 'sh'
+    response = ''
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    """
+    :return: Callable(responses, page_lines) returning a Handle talking to a fake firewall.
+    """
+    monkeypatch.setattr(pandevice, 'time', NO_SLEEP)
+    logger = logging.getLogger('benchmark')
+    logger.propagate = False
+    logger.setLevel(logging.WARNING)
+    channels = []
+
+    def handle(responses, page_lines=0):
+        handle = Handle.__new__(Handle)
+        handle.logger = logger
+        handle.client = FakeChannel(responses, page_lines=page_lines)
+        channels.append(handle.client)
+        return handle
+    yield handle
+    for channel in channels:
+        channel.close()
+
+
+def _execute(handle, command):
+    device = Device()
+    found = handle.execute_command(cmd=command, pattern=PROMPT.strip(), device=device, timeout=60)
+    if found == -1:
+        raise Exception(f'Benchmark command "{command}" did not return the prompt.')
+    return device.response
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_execute_command(benchmark, peak_memory, connect, size):
+    handle = connect({'show jobs all': synthetic_output(SIZES[size])})
+    benchmark(_execute, handle, 'show jobs all')
+    peak_memory(_execute, handle, 'show jobs all')
+
+
+@pytest.mark.parametrize('size', [size for size, lines in SIZES.items() if lines > PAGE_LINES])
+def test_execute_command_paged(benchmark, peak_memory, connect, size):
+    handle = connect({'show jobs all': synthetic_output(SIZES[size])}, page_lines=PAGE_LINES)
+    benchmark(_execute, handle, 'show jobs all')
+    peak_memory(_execute, handle, 'show jobs all')
+
+
+def test_show_system_info(benchmark, peak_memory, connect):
+    handle = connect({'show system info': transcript('show-system-info.txt')})
+    benchmark(_execute, handle, 'show system info')
+    peak_memory(_execute, handle, 'show system info')
+
+
+def test_show_jobs_id(benchmark, peak_memory, connect):
+    handle = connect({'show jobs id 4': transcript('show-jobs-id.txt')})
+    assert 'FIN' in benchmark(_execute, handle, 'show jobs id 4')
+    peak_memory(_execute, handle, 'show jobs id 4')
+
+
+def test_job_id(benchmark, peak_memory):
+    output = Output(response=transcript('request-content-download.txt'), status=True)
+    benchmark(output.job_id)
+    peak_memory(output.job_id)
+
+
+def test_system_info_yaml(benchmark, peak_memory):
+    text = transcript('show-system-info.txt')
+    benchmark(yaml.safe_load, text)
+    peak_memory(yaml.safe_load, text)
+
+
+def test_boot_complete(benchmark, peak_memory):
+    log = '\n'.join(['[    1.000000] kernel: message'] * 2000) + '\nPA-VM login: '
+    baseline = '\n'.join(['[    0.500000] kernel: message'] * 1000)
+    benchmark(boot_complete, log, baseline, reboot=False)
+    peak_memory(boot_complete, log, baseline, False)
@@ -13,9 +13,31 @@
 # limitations under the License.
 
 import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-import boto3
+from cloudclient.boot_signals import boot_complete, POLL
+from cloudclient.bootstrap import user_data
+from cloudclient.client_pool import aws_client
+from cloudclient.cloud_client import report_resource
+from cloudclient.images import IMAGE_PREFIX, image_group, image_tags
+from cloudclient.launcher import Launcher, aws_capacity_error, launch_plan
+from cloudclient.storage import build_block_devices, image_block_devices
+
+STANDARD_FAMILIES = ('a', 'c', 'd', 'h', 'i', 'm', 'r', 't', 'z')
+STANDARD_VCPU_QUOTA = 'L-1216C47A'
+# Enabling Fast Snapshot Restore takes about an hour per TiB of snapshot
+FAST_RESTORE_TIMEOUT = 3600
+FAST_RESTORE_POLL = 30
+# AWS Marketplace product codes of the VM-Series SKUs, and names of their AMIs, e.g. "PA-VM-AWS-10.0.3-<uuid>"
+PRODUCT_CODES = {
+    'byol': '6njl1pau431dv1qxipg63mvah',
+    'bundle1': 'e9yfvyj3uag5uo5j2hjikv74n',
+    'bundle2': 'hd44w1chf26uv4p52cdynb2o',
+}
+MARKETPLACE_NAME = re.compile(r'^PA-VM-AWS-(?P<version>\d+\.\d+\.\d+(-h\d+)?)')
 
 
 class CloudAws(object):
@@ -26,77 +48,237 @@ class CloudAws(object):
         self.config = config
         logger.info('Connecting to AWS...')
         try:
-            self.client = boto3.client(
-                'ec2',
-                aws_access_key_id=config["aws_access_key_id"],
-                aws_secret_access_key=config["aws_secret_access_key"],
-                region_name=config["region"])
-            self.resource = boto3.resource(
-                'ec2',
-                aws_access_key_id=config["aws_access_key_id"],
-                aws_secret_access_key=config["aws_secret_access_key"],
-                region_name=config["region"])
-            self.id = os.getpid()
+            self.client = aws_client('ec2', config)
+            self.id = config.get('build_id', os.getpid())
             logger.info('Connection Successful.')
         except Exception as e:
             logger.error(f'Unable to connect to AWS: {str(e)}')
         self.config["username"] = "admin"
         self.config["pkey"] = config["pkey"]
         self.instance_id = ""
+        # Persistent spot request of a spot build instance
+        self.spot_request_id = ""
         self.public_ip = ""
+        self.image_id = ""
+        self.image_name = ""
+        self.images = {}
+        self.fast_restore = {}
+        # Launch attempts of the last create_instance
+        self.launches = []
 
     def _get_public_ip(self):
         response = self.client.describe_instances(InstanceIds=[self.instance_id])
         public_ip = response['Reservations'][0]['Instances'][0]['PublicIpAddress']
         return public_ip
 
+    def _subnet(self):
+        response = self.client.describe_subnets(SubnetIds=[self.config["mgmt_subnet_id"]])
+        return response['Subnets'][0]
+
+    def _check_image(self):
+        response = self.client.describe_images(ImageIds=[self.config["ami_id"]])
+        if not response['Images']:
+            raise Exception(f'AMI {self.config["ami_id"]} not found in region {self.region}.')
+        state = response['Images'][0]['State']
+        if state != 'available':
+            raise Exception(f'AMI {self.config["ami_id"]} is in state "{state}".')
+
+    def marketplace_images(self, sku):
+        """
+        VM-Series AMIs of the SKU published in the region.
+        :return: List of {'id', 'version', 'name', 'created'}
+        """
+        if sku not in PRODUCT_CODES:
+            raise Exception(f'Unknown VM-Series SKU "{sku}", expected one of {", ".join(PRODUCT_CODES)}.')
+        response = self.client.describe_images(Owners=['aws-marketplace'], Filters=[
+            {'Name': 'product-code', 'Values': [PRODUCT_CODES[sku]]},
+            {'Name': 'state', 'Values': ['available']}])
+        images = []
+        for image in response['Images']:
+            match = MARKETPLACE_NAME.match(image.get('Name', ''))
+            if match:
+                images.append({'id': image['ImageId'], 'version': match.group('version'), 'name': image['Name'],
+                               'created': image.get('CreationDate', '')})
+        return images
+
+    def _check_subnet(self):
+        subnet = self._subnet()
+        if subnet['State'] != 'available':
+            raise Exception(f'Subnet {subnet["SubnetId"]} is in state "{subnet["State"]}".')
+        if subnet['AvailableIpAddressCount'] < 1:
+            raise Exception(f'Subnet {subnet["SubnetId"]} has no free IP addresses.')
+
+    def _check_security_group(self):
+        response = self.client.describe_security_groups(GroupIds=[self.config["sg_id"]])
+        group = response['SecurityGroups'][0]
+        subnet = self._subnet()
+        if group['VpcId'] != subnet['VpcId']:
+            raise Exception(f'Security group {group["GroupId"]} is in {group["VpcId"]}, '
+                            f'subnet {subnet["SubnetId"]} is in {subnet["VpcId"]}.')
+        for permission in group['IpPermissions']:
+            if permission['IpProtocol'] == '-1':
+                return
+            if permission['IpProtocol'] == 'tcp' and permission['FromPort'] <= 22 <= permission['ToPort']:
+                return
+        raise Exception(f'Security group {group["GroupId"]} does not allow inbound TCP port 22.')
+
+    def _check_key_pair(self):
+        self.client.describe_key_pairs(KeyNames=[self.config["key_pair_name"]])
+
+    def _check_instance_type(self):
+        instance_type = self.config.get("instance_type", 'm5.xlarge')
+        zone = self._subnet()['AvailabilityZone']
+        response = self.client.describe_instance_type_offerings(
+            LocationType='availability-zone',
+            Filters=[{'Name': 'instance-type', 'Values': [instance_type]},
+                     {'Name': 'location', 'Values': [zone]}])
+        if not response['InstanceTypeOfferings']:
+            raise Exception(f'Instance type {instance_type} is not offered in {zone}.')
+
+    def available_sizes(self, candidates):
+        """
+        :return: Instance types of candidates offered in the availability zone of the subnet, in the same order.
+        """
+        zone = self._subnet()['AvailabilityZone']
+        response = self.client.describe_instance_type_offerings(
+            LocationType='availability-zone',
+            Filters=[{'Name': 'instance-type', 'Values': list(candidates)},
+                     {'Name': 'location', 'Values': [zone]}])
+        offered = set(offering['InstanceType'] for offering in response['InstanceTypeOfferings'])
+        return [size for size in candidates if size in offered]
+
+    def _check_quota(self):
+        instance_type = self.config.get("instance_type", 'm5.xlarge')
+        if not instance_type.startswith(STANDARD_FAMILIES):
+            return
+        quotas = aws_client('service-quotas', self.config)
+        limit = quotas.get_service_quota(ServiceCode='ec2', QuotaCode=STANDARD_VCPU_QUOTA)['Quota']['Value']
+        response = self.client.describe_instance_types(InstanceTypes=[instance_type])
+        needed = response['InstanceTypes'][0]['VCpuInfo']['DefaultVCpus']
+        used = 0
+        paginator = self.client.get_paginator('describe_instances')
+        for page in paginator.paginate(Filters=[{'Name': 'instance-state-name', 'Values': ['pending', 'running']}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    if instance['InstanceType'].startswith(STANDARD_FAMILIES):
+                        cpu = instance['CpuOptions']
+                        used += cpu['CoreCount'] * cpu['ThreadsPerCore']
+        if used + needed > limit:
+            raise Exception(f'Not enough vCPU quota: {used} of {int(limit)} in use, {instance_type} needs {needed}.')
+
+    def preflight_checks(self):
+        return {
+            'aws image': self._check_image,
+            'aws subnet': self._check_subnet,
+            'aws security group': self._check_security_group,
+            'aws key pair': self._check_key_pair,
+            'aws instance type': self._check_instance_type,
+            'aws vcpu quota': self._check_quota,
+        }
+
     def create_instance(self):
-        ami_id = self.config.get("ami_id")
-        mgmt_subnet_id = self.config.get("mgmt_subnet_id")
-        sg_id = self.config.get("sg_id")
-        key_pair_name = self.config.get("key_pair_name")
         instance_type = self.config.get("instance_type", 'm5.xlarge')
+        # Other subnets of the VPC are other availability zones
+        plan = launch_plan([instance_type] + self.config.get('fallback_sizes', []),
+                           [self.config.get("mgmt_subnet_id")] + self.config.get('fallback_placements', []),
+                           self.config.get('spot'))
+        # First boot licensing and content through a VM-Series bootstrap init-cfg
+        bootstrap = {}
+        if user_data(self.config):
+            self.logger.info('Bootstrapping the instance with user data.')
+            bootstrap['UserData'] = user_data(self.config)
+            if self.config.get('bootstrap_instance_profile'):
+                bootstrap['IamInstanceProfile'] = {'Name': self.config['bootstrap_instance_profile']}
 
-        waiter = self.client.get_waiter('instance_running')
+        launcher = Launcher(self.logger, plan, aws_capacity_error)
         self.logger.info(f'*** Creating Instance ***')
         try:
-            instance_request = self.resource.create_instances(
-                BlockDeviceMappings=[
-                    {
-                        'DeviceName': '/dev/xvda',
-                        'Ebs': {
-                            'DeleteOnTermination': True,
-                        }
-                    }
-                ],
-                ImageId=ami_id,
-                MinCount=1,
-                MaxCount=1,
-                KeyName=key_pair_name,
-                InstanceType=instance_type,
-                NetworkInterfaces=[
-                    {
-                        'DeviceIndex': 0,
-                        'AssociatePublicIpAddress': True,
-                        'SubnetId': mgmt_subnet_id,
-                        'Groups': [sg_id, ],
-                    }
-                ]
-            )
-            time.sleep(30)
-            instance_id = instance_request[0].id
-            waiter.wait(InstanceIds=[instance_id])
+            attempt, _ = launcher.run(lambda attempt: self._launch(attempt, dict(bootstrap)))
             self.logger.info('*** Instance Creation Successful ***')
-            self.resource.create_tags(Resources=[instance_id], Tags=[{
-                'Key': 'Name', 'Value': f'CI_Generator_{self.id}'}
-            ])
         except Exception as e:
             self.logger.error(f'ERROR: Unable to deploy the instance: {str(e)}')
-        self.instance_id = instance_id
+            raise
+        finally:
+            self.launches = launcher.attempts
+        self.config["instance_type"] = attempt['size']
         self.public_ip = self._get_public_ip()
-        return {'instance_id': instance_id, 'ip': self.public_ip, 'user': 'admin'}
+        return {'instance_id': self.instance_id, 'ip': self.public_ip, 'user': 'admin'}
+
+    def _launch(self, attempt, bootstrap):
+        if attempt['spot']:
+            # EC2 does not stop one-time spot instances, the image and fork stages stop the instance
+            bootstrap['InstanceMarketOptions'] = {'MarketType': 'spot',
+                                                  'SpotOptions': {'SpotInstanceType': 'persistent',
+                                                                  'InstanceInterruptionBehavior': 'stop'}}
+
+        waiter = self.client.get_waiter('instance_running')
+        instance_request = self.client.run_instances(
+            **bootstrap,
+            BlockDeviceMappings=build_block_devices(self.config),
+            ImageId=self.config.get("ami_id"),
+            MinCount=1,
+            MaxCount=1,
+            KeyName=self.config.get("key_pair_name"),
+            InstanceType=attempt['size'],
+            NetworkInterfaces=[
+                {
+                    'DeviceIndex': 0,
+                    'AssociatePublicIpAddress': True,
+                    'SubnetId': attempt['placement'],
+                    'Groups': [self.config.get("sg_id"), ],
+                }
+            ],
+            # Tagged at launch, a CreateTags call right after RunInstances may not find the instance yet
+            TagSpecifications=[{'ResourceType': 'instance',
+                                'Tags': [{'Key': 'Name', 'Value': f'CI_Generator_{self.id}'}]}]
+        )
+        # Set before waiting, so that the instance is terminated if it never gets to running
+        self.instance_id = instance_request['Instances'][0]['InstanceId']
+        self.spot_request_id = instance_request['Instances'][0].get('SpotInstanceRequestId', '')
+        report_resource(self, 'instance', region=self.region, instance_id=self.instance_id,
+                        spot_request_id=self.spot_request_id)
+        waiter.wait(InstanceIds=[self.instance_id])
+
+    def _console_log(self):
+        try:
+            response = self.client.get_console_output(InstanceId=self.instance_id, Latest=True)
+        except Exception:
+            # "Latest" is only supported on Nitro instance types
+            response = self.client.get_console_output(InstanceId=self.instance_id)
+        return response.get('Output') or ''
+
+    def wait_for_boot(self, timeout, reboot=False):
+        """
+        Watch the instance console output for the PAN-OS boot-complete markers.
+        :param int timeout: Seconds to wait
+        :param bool reboot: Wait for a boot that started after this call
+        :return: True when the boot completed, False on timeout, None if the console output is unavailable.
+        """
+        started = time.time()
+        try:
+            baseline = self._console_log()
+        except Exception as e:
+            self.logger.info(f'Console output unavailable: {str(e)}')
+            return None
+        self.logger.info(f'Watching the console of {self.instance_id} for the end of the boot...')
+        while time.time() - started < timeout:
+            try:
+                if boot_complete(self._console_log(), baseline, reboot):
+                    self.logger.info(f'Boot complete after {int(time.time() - started)}s.')
+                    return True
+            except Exception as e:
+                self.logger.debug(f'Unable to read console output: {str(e)}')
+            time.sleep(POLL)
+        self.logger.info('Boot-complete marker not seen on the console.')
+        return False
 
     def terminate_instance(self):
+        if self.spot_request_id:
+            # Cancelled first, a persistent request would launch the instance again
+            try:
+                self.client.cancel_spot_instance_requests(SpotInstanceRequestIds=[self.spot_request_id])
+            except Exception as e:
+                self.logger.error(f'Unable to cancel spot request {self.spot_request_id}: {str(e)}')
         waiter = self.client.get_waiter('instance_terminated')
         self.client.terminate_instances(InstanceIds=[self.instance_id])
         self.logger.info('Waiting for completion...')
@@ -122,17 +304,224 @@ class CloudAws(object):
 
     def create_image(self, name):
         waiter = self.client.get_waiter('image_available')
+        # The image keeps the runtime volume type, whatever the build volume was
         create_request = self.client.create_image(InstanceId=self.instance_id,
                                                   NoReboot=False,
                                                   Name=f'{name}-{self.id}',
+                                                  BlockDeviceMappings=image_block_devices(self.config),
                                                   Description='Custom Image created by Palo Alto Networks')
         ami_id = create_request["ImageId"]
         self.logger.info(f'Waiting for the custom AMI {ami_id} to be available.')
         try:
             waiter.wait(ImageIds=[ami_id])
+            self._tag_image(self.client, ami_id)
             result = True
+            self.image_id = ami_id
+            self.image_name = f'{name}-{self.id}'
+            self.images[self.region] = ami_id
             self.logger.info(f'Custom AMI: {ami_id} has been created in region: {self.region}.')
         except BaseException:
             self.logger.error('Unable to check availability of the new AMI.')
             result = False
         return result
+
+    def create_fork_image(self, name):
+        """
+        AMI of the stopped base instance, neither reset nor generalized, to launch the variants of a build matrix.
+        :return: Configuration of the variant builds
+        """
+        ami_id = self.client.create_image(InstanceId=self.instance_id, NoReboot=True, Name=name,
+                                          Description='Fork point of a Custom Image build matrix')["ImageId"]
+        report_resource(self, 'fork', region=self.region, fork={'ami_id': ami_id})
+        self.logger.info(f'Waiting for the fork AMI {ami_id} to be available.')
+        self.client.get_waiter('image_available').wait(ImageIds=[ami_id],
+                                                       WaiterConfig={'Delay': 15, 'MaxAttempts': 240})
+        return {'ami_id': ami_id}
+
+    def delete_fork_image(self, fork):
+        snapshots = self._snapshots(self.client, fork['ami_id'])
+        self.delete_custom_image({'region': self.region, 'id': fork['ami_id'], 'snapshots': snapshots})
+
+    def _copy_image(self, region):
+        client = aws_client('ec2', self.config, region)
+        copy_request = client.copy_image(SourceImageId=self.image_id,
+                                         SourceRegion=self.region,
+                                         Name=self.image_name,
+                                         Description='Custom Image created by Palo Alto Networks')
+        ami_id = copy_request["ImageId"]
+        self.logger.info(f'Waiting for the custom AMI copy {ami_id} to be available in region: {region}.')
+        client.get_waiter('image_available').wait(ImageIds=[ami_id],
+                                                  WaiterConfig={'Delay': 30, 'MaxAttempts': 120})
+        self._tag_image(client, ami_id)
+        self.logger.info(f'Custom AMI: {ami_id} has been copied to region: {region}.')
+        return ami_id
+
+    def _tag_image(self, client, ami_id):
+        # Tagged after creation, CreateImage/CopyImage do not take tags in the supported boto3 release
+        try:
+            snapshots = self._snapshots(client, ami_id)
+            tags = image_tags(self.config, self.id)
+            client.create_tags(Resources=[ami_id] + snapshots,
+                               Tags=[{'Key': key, 'Value': value} for key, value in tags.items()])
+        except Exception as e:
+            self.logger.warning(f'Unable to tag custom AMI {ami_id}: {e}')
+
+    def custom_images(self, region):
+        """
+        Custom AMIs of this account in a region, for the image garbage collection.
+        """
+        client = aws_client('ec2', self.config, region)
+        in_use = set()
+        paginator = client.get_paginator('describe_instances')
+        for page in paginator.paginate(Filters=[{'Name': 'instance-state-name',
+                                                 'Values': ['pending', 'running', 'stopping', 'stopped']}]):
+            for reservation in page['Reservations']:
+                in_use.update(instance['ImageId'] for instance in reservation['Instances'])
+        in_use.update(self._launch_images(client, region))
+        response = client.describe_images(Owners=['self'], Filters=[{'Name': 'name', 'Values': [f'{IMAGE_PREFIX}*']}])
+        images = []
+        for image in response['Images']:
+            tags = {tag['Key']: tag['Value'] for tag in image.get('Tags', [])}
+            group = image_group(image['Name'], tags)
+            if group is None:
+                continue
+            mappings = [mapping['Ebs'] for mapping in image.get('BlockDeviceMappings', []) if 'Ebs' in mapping]
+            created = datetime.strptime(image['CreationDate'], '%Y-%m-%dT%H:%M:%S.%fZ')
+            images.append({
+                'kind': 'image',
+                'id': image['ImageId'],
+                'name': image['Name'],
+                'region': region,
+                'group': group,
+                'created': created.replace(tzinfo=timezone.utc).timestamp(),
+                'size_gb': sum(ebs.get('VolumeSize', 0) for ebs in mappings),
+                'snapshots': [ebs['SnapshotId'] for ebs in mappings if ebs.get('SnapshotId')],
+                'in_use': image['ImageId'] in in_use,
+            })
+        return images
+
+    def _launch_images(self, client, region):
+        """
+        AMIs instances may still be launched from: every version of the launch templates and the launch
+        configurations, which auto scaling groups launch from.
+        """
+        images = set()
+        for page in client.get_paginator('describe_launch_templates').paginate():
+            for template in page['LaunchTemplates']:
+                versions = client.get_paginator('describe_launch_template_versions')
+                for versions_page in versions.paginate(LaunchTemplateId=template['LaunchTemplateId']):
+                    images.update(version['LaunchTemplateData'].get('ImageId')
+                                  for version in versions_page['LaunchTemplateVersions'])
+        autoscaling = aws_client('autoscaling', self.config, region)
+        for page in autoscaling.get_paginator('describe_launch_configurations').paginate():
+            images.update(configuration['ImageId'] for configuration in page['LaunchConfigurations'])
+        images.discard(None)
+        return images
+
+    def delete_custom_image(self, image):
+        client = aws_client('ec2', self.config, image['region'])
+        client.deregister_image(ImageId=image['id'])
+        if image['snapshots']:
+            self.disable_fast_restore(client, image['snapshots'])
+        for snapshot in image['snapshots']:
+            client.delete_snapshot(SnapshotId=snapshot)
+
+    def _snapshots(self, client, ami_id):
+        image = client.describe_images(ImageIds=[ami_id])['Images'][0]
+        return [mapping['Ebs']['SnapshotId'] for mapping in image.get('BlockDeviceMappings', [])
+                if mapping.get('Ebs', {}).get('SnapshotId')]
+
+    def _fast_restore_states(self, client, snapshots):
+        """
+        :return: {(snapshot id, zone): state}
+        """
+        states = {}
+        paginator = client.get_paginator('describe_fast_snapshot_restores')
+        for page in paginator.paginate(Filters=[{'Name': 'snapshot-id', 'Values': snapshots}]):
+            for entry in page['FastSnapshotRestores']:
+                states[(entry['SnapshotId'], entry['AvailabilityZone'])] = entry['State']
+        return states
+
+    def _enable_fast_restore(self, region, zones):
+        client = aws_client('ec2', self.config, region)
+        if isinstance(zones, int):
+            # First zones of the region
+            response = client.describe_availability_zones(Filters=[{'Name': 'state', 'Values': ['available']}])
+            zones = sorted(zone['ZoneName'] for zone in response['AvailabilityZones'])[:zones]
+        ami_id = self.images[region]
+        snapshots = self._snapshots(client, ami_id)
+        self.logger.info(f'Enabling Fast Snapshot Restore for {ami_id} in {", ".join(zones)}.')
+        response = client.enable_fast_snapshot_restores(AvailabilityZones=zones, SourceSnapshotIds=snapshots)
+        if response.get('Unsuccessful'):
+            errors = [error['Message'] for entry in response['Unsuccessful']
+                      for error in entry['FastSnapshotRestoreStateErrors']]
+            raise Exception(f'Unable to enable Fast Snapshot Restore in {region}: {"; ".join(errors)}')
+        started = time.time()
+        while True:
+            states = self._fast_restore_states(client, snapshots)
+            pending = [f'{snapshot}/{zone}' for snapshot in snapshots for zone in zones
+                       if states.get((snapshot, zone)) != 'enabled']
+            if not pending:
+                break
+            if time.time() - started > FAST_RESTORE_TIMEOUT:
+                raise Exception(f'Fast Snapshot Restore not enabled after {FAST_RESTORE_TIMEOUT}s: '
+                                f'{", ".join(pending)}')
+            time.sleep(FAST_RESTORE_POLL)
+        self.logger.info(f'Fast Snapshot Restore enabled for {ami_id} in {", ".join(zones)} '
+                         f'after {int(time.time() - started)}s.')
+        return zones
+
+    def enable_fast_restore(self, zones_by_region):
+        """
+        Enable EBS Fast Snapshot Restore on the snapshots of the custom AMIs, so that instances launched
+        from them do not lazy-load their volume on first boot.
+        :param dict zones_by_region: {region: list of availability zones, or number of zones}
+        :return: {region: enabled zones}
+        """
+        regions = [region for region in self.images if zones_by_region.get(region)]
+        with ThreadPoolExecutor(max_workers=max(len(regions), 1)) as executor:
+            futures = {region: executor.submit(self._enable_fast_restore, region, zones_by_region[region])
+                       for region in regions}
+        enabled = {}
+        failed = []
+        for region, future in futures.items():
+            if future.exception():
+                self.logger.error(f'{future.exception()}')
+                failed.append(region)
+            else:
+                enabled[region] = future.result()
+        self.fast_restore = enabled
+        if failed:
+            raise Exception(f'Fast Snapshot Restore failed for {", ".join(failed)}.')
+        return enabled
+
+    def disable_fast_restore(self, client, snapshots):
+        """
+        Disable Fast Snapshot Restore of retired snapshots, it is billed per zone and hour.
+        :return: Zones it was disabled in.
+        """
+        zones = {}
+        for (snapshot, zone), state in self._fast_restore_states(client, snapshots).items():
+            if state in ('enabling', 'optimizing', 'enabled'):
+                zones.setdefault(zone, []).append(snapshot)
+        for zone, zone_snapshots in zones.items():
+            client.disable_fast_snapshot_restores(AvailabilityZones=[zone], SourceSnapshotIds=zone_snapshots)
+        if zones:
+            self.logger.info(f'Fast Snapshot Restore disabled for {", ".join(sorted(set(snapshots)))} '
+                             f'in {", ".join(sorted(zones))}.')
+        return sorted(zones)
+
+    def replicate_image(self, regions):
+        regions = [region for region in regions if region != self.region]
+        with ThreadPoolExecutor(max_workers=max(len(regions), 1)) as executor:
+            futures = {region: executor.submit(self._copy_image, region) for region in regions}
+        failed = []
+        for region, future in futures.items():
+            if future.exception():
+                self.logger.error(f'Unable to copy the custom AMI to region {region}: {future.exception()}')
+                failed.append(region)
+            else:
+                self.images[region] = future.result()
+        if failed:
+            raise Exception(f'Custom AMI replication failed for {", ".join(failed)}.')
+        return self.images
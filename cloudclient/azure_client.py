@@ -13,12 +13,26 @@
 # limitations under the License.
 
 import os
+import re
 import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
-from azure.identity import ClientSecretCredential
 from azure.mgmt.network import NetworkManagementClient
 from azure.mgmt.compute import ComputeManagementClient
 
+from cloudclient.boot_signals import boot_complete, POLL
+from cloudclient.bootstrap import custom_data
+from cloudclient.azure_throttle import azure_client_options
+from cloudclient.client_pool import azure_client
+from cloudclient.cloud_client import report_resource
+from cloudclient.images import image_group, image_tags
+from cloudclient.launcher import Launcher, azure_capacity_error, launch_plan
+
+GENERALIZE_TIMEOUT = 120
+# Disks and network of a build, e.g. "PANW-CI-q12-nic" or "PANW-CI-q12_OsDisk_1_<hash>"
+BUILD_RESOURCE = re.compile(r'^PANW-CI-(?P<build_id>.+?)(-nic|-pip|-osdisk|_OsDisk.*)?$')
+
 
 class CloudAzure(object):
     def __init__(self, logger, config):
@@ -28,16 +42,9 @@ class CloudAzure(object):
         self.config = config
         logger.info('Connecting to Azure...')
         try:
-            credentials = ClientSecretCredential(
-                client_id=config["client_id"],
-                client_secret=config["client_secret"],
-                tenant_id=config["tenant_id"]
-            )
-            self.compute_client = ComputeManagementClient(credential=credentials,
-                                                          subscription_id=config["subscription_id"])
-            self.network_client = NetworkManagementClient(credential=credentials,
-                                                          subscription_id=config["subscription_id"])
-            self.id = os.getpid()
+            self.compute_client = azure_client(ComputeManagementClient, config, **azure_client_options(config))
+            self.network_client = azure_client(NetworkManagementClient, config, **azure_client_options(config))
+            self.id = config.get('build_id', os.getpid())
             logger.info('Connection Successful.')
         except Exception as e:
             logger.error(f'Unable to connect to Azure: {str(e)}')
@@ -45,6 +52,14 @@ class CloudAzure(object):
         self.config["password"] = "P@nwCust0m!m@ge"
         self.instance_name = ""
         self.public_ip = ""
+        self.image_id = ""
+        self.image_name = ""
+        self.images = {}
+        # Network interface of the configuration file, or created for this build in subnet-id
+        self.nic_id = self.config.get('nic_id', '')
+        self.network = {}
+        # Launch attempts of the last create_instance
+        self.launches = []
 
     def _get_public_ip(self):
         # instance = self.compute_client.virtual_machines.get(resource_group_name=self.config['rg_name'],
@@ -52,7 +67,7 @@ class CloudAzure(object):
         # interfaces = instance.network_profile.network_interfaces
         # ni_reference = interfaces[0]
         # ni_reference = ni_reference.id.split('/')
-        ni_reference = self.config['nic_id'].split('/')
+        ni_reference = self.nic_id.split('/')
         ni_group = ni_reference[4]
         ni_name = ni_reference[8]
         net_interface = self.network_client.network_interfaces.get(ni_group, ni_name)
@@ -64,75 +79,340 @@ class CloudAzure(object):
         public_ip = public_ip.ip_address
         return public_ip
 
+    def _check_nic(self):
+        ni_reference = self.config['nic_id'].split('/')
+        net_interface = self.network_client.network_interfaces.get(ni_reference[4], ni_reference[8])
+        if net_interface.virtual_machine:
+            raise Exception(f'Network interface {ni_reference[8]} is already attached to '
+                            f'{net_interface.virtual_machine.id.split("/")[-1]}.')
+        if net_interface.location != self.location:
+            raise Exception(f'Network interface {ni_reference[8]} is in {net_interface.location}, '
+                            f'not {self.location}.')
+
+    def _check_public_ip(self):
+        ni_reference = self.config['nic_id'].split('/')
+        net_interface = self.network_client.network_interfaces.get(ni_reference[4], ni_reference[8])
+        ip_reference = net_interface.ip_configurations[0].public_ip_address
+        if not ip_reference:
+            raise Exception(f'Network interface {ni_reference[8]} has no public IP address associated.')
+        ip_reference = ip_reference.id.split('/')
+        public_ip = self.network_client.public_ip_addresses.get(ip_reference[4], ip_reference[8])
+        if public_ip.public_ip_allocation_method != 'Static':
+            raise Exception(f'Public IP {ip_reference[8]} must use a static allocation.')
+
+    def _check_subnet(self):
+        reference = self.config['subnet_id'].split('/')
+        vnet = self.network_client.virtual_networks.get(reference[4], reference[8])
+        if vnet.location != self.location:
+            raise Exception(f'Virtual network {reference[8]} is in {vnet.location}, not {self.location}.')
+        subnet = next((subnet for subnet in vnet.subnets or [] if subnet.name == reference[10]), None)
+        if subnet is None:
+            raise Exception(f'Subnet {reference[10]} not found in virtual network {reference[8]}.')
+        if not self.config.get('nsg_id') and not subnet.network_security_group:
+            # Standard public IPs block inbound traffic without a network security group allowing it
+            raise Exception(f'Subnet {reference[10]} has no network security group, set nsg-id to one allowing SSH.')
+        if self.config.get('nsg_id'):
+            reference = self.config['nsg_id'].split('/')
+            nsg = self.network_client.network_security_groups.get(reference[4], reference[8])
+            if nsg.location != self.location:
+                raise Exception(f'Network security group {reference[8]} is in {nsg.location}, not {self.location}.')
+
+    def _check_image(self):
+        self.compute_client.virtual_machine_images.get(self.location, 'paloaltonetworks', 'vmseries-flex',
+                                                       self.config['image_sku'], self.config['image_version'])
+
+    def marketplace_images(self, sku):
+        """
+        VM-Series image versions of the SKU published in the location.
+        :return: List of {'id', 'version', 'name', 'created'}, the id is the image version
+        """
+        images = self.compute_client.virtual_machine_images.list(self.location, 'paloaltonetworks', 'vmseries-flex',
+                                                                 sku)
+        return [{'id': image.name, 'version': image.name, 'name': f'vmseries-flex/{sku}/{image.name}', 'created': ''}
+                for image in images]
+
+    def _vm_size(self):
+        for size in self.compute_client.virtual_machine_sizes.list(self.location):
+            if size.name == self.config['vm_size']:
+                return size
+        raise Exception(f'VM size {self.config["vm_size"]} is not available in {self.location}.')
+
+    def _check_vm_size(self):
+        self._vm_size()
+
+    def available_sizes(self, candidates):
+        """
+        :return: VM sizes of candidates available in the location, in the same order.
+        """
+        offered = set(size.name for size in self.compute_client.virtual_machine_sizes.list(self.location))
+        return [size for size in candidates if size in offered]
+
+    def _check_quota(self):
+        needed = self._vm_size().number_of_cores
+        for usage in self.compute_client.usage.list(self.location):
+            if usage.name.value == 'cores' and usage.current_value + needed > usage.limit:
+                raise Exception(f'Not enough regional vCPU quota: {usage.current_value} of {usage.limit} in use, '
+                                f'{self.config["vm_size"]} needs {needed}.')
+
+    def preflight_checks(self):
+        if self.config.get('subnet_id'):
+            network = {'azure subnet': self._check_subnet}
+        else:
+            network = {'azure network interface': self._check_nic, 'azure public ip': self._check_public_ip}
+        return dict(network, **{
+            'azure image': self._check_image,
+            'azure vm size': self._check_vm_size,
+            'azure vcpu quota': self._check_quota,
+        })
+
+    def create_network(self):
+        """
+        Static public IP address and network interface of this build in subnet-id, named after the VM, so that
+        builds in the same resource group run at the same time.
+        :return: Network interface ID
+        """
+        rg_name = self.config['rg_name']
+        self.network = self._network_names()
+        # Network resources have no creation time, the image garbage collection leaves recent ones alone
+        tags = {'build-id': str(self.id), 'created': str(int(time.time()))}
+        self.logger.info(f'Creating network interface {self.network["nic"]} ...')
+        try:
+            public_ip = self.network_client.public_ip_addresses.begin_create_or_update(
+                rg_name, self.network['public_ip'], {
+                    "location": self.location,
+                    "tags": tags,
+                    "sku": {"name": "Standard"},
+                    "public_ip_allocation_method": "Static"
+                }).result()
+            nic = {
+                "location": self.location,
+                "tags": tags,
+                "ip_configurations": [{
+                    "name": "primary",
+                    "subnet": {"id": self.config['subnet_id']},
+                    "public_ip_address": {"id": public_ip.id}
+                }]
+            }
+            if self.config.get('nsg_id'):
+                nic["network_security_group"] = {"id": self.config['nsg_id']}
+            self.nic_id = self.network_client.network_interfaces.begin_create_or_update(rg_name, self.network['nic'],
+                                                                                        nic).result().id
+        except Exception:
+            self.delete_network()
+            raise
+        self.public_ip = public_ip.ip_address
+        return self.nic_id
+
+    def _network_names(self):
+        return {'nic': f'PANW-CI-{self.id}-nic', 'public_ip': f'PANW-CI-{self.id}-pip'}
+
+    def delete_network(self):
+        """
+        Delete the network interface and public IP address created for this build, once the VM is deleted.
+        """
+        if not self.network:
+            return
+        rg_name = self.config['rg_name']
+        # The public IP address cannot be deleted while associated with the network interface
+        self.network_client.network_interfaces.begin_delete(rg_name, self.network['nic']).result()
+        self.network_client.public_ip_addresses.begin_delete(rg_name, self.network['public_ip']).result()
+        self.logger.info(f'Network interface {self.network["nic"]} deleted.')
+        self.network = {}
+
     def create_instance(self):
         self.logger.info(f'Creating VM "PANW-CI-{self.id}" ...')
+        if self.config.get('image_id'):
+            # Custom image produced by an earlier build
+            image_reference = {"id": self.config['image_id']}
+        else:
+            image_reference = {
+                "publisher": "paloaltonetworks",
+                "offer": "vmseries-flex",
+                "sku": self.config["image_sku"],
+                "version": self.config["image_version"]
+            }
+        os_profile = {
+            "computer_name": f'PANW-CI-{self.id}',
+            "admin_username": self.config["username"],
+            "admin_password": self.config["password"]
+        }
+        storage_profile = {"image_reference": image_reference}
+        if self.config.get('build_volume_type'):
+            # e.g. Premium SSD during the build, the image keeps the runtime disk type
+            storage_profile["os_disk"] = {
+                "create_option": "FromImage",
+                "managed_disk": {"storage_account_type": self.config['build_volume_type']}
+            }
+        # First boot licensing and content through a VM-Series bootstrap init-cfg
+        if custom_data(self.config):
+            self.logger.info('Bootstrapping the instance with custom data.')
+            os_profile["custom_data"] = custom_data(self.config)
+        # Named before the request, so that the build network is deleted with the VM whatever fails next
+        self.instance_name = f'PANW-CI-{self.id}'
+        report_resource(self, 'instance', instance_name=self.instance_name,
+                        network=self._network_names() if self.config.get('subnet_id') else {})
+        # The network of the build and the disk of a variant are created at the same time, before the VM
+        executor = ThreadPoolExecutor(max_workers=2)
+        network = executor.submit(self.create_network) if self.config.get('subnet_id') else None
+        fork_disk = executor.submit(self._fork_disk) if self.config.get('fork_snapshot_id') else None
+        executor.shutdown(wait=True)
+        if fork_disk:
+            # Variant of a build matrix: copy of the OS disk of the base instance, already provisioned
+            storage_profile = {"os_disk": {"os_type": "Linux", "create_option": "Attach",
+                                           "managed_disk": {"id": fork_disk.result()}}}
+            os_profile = None
+        if network:
+            network.result()
+        parameters = {
+            "location": self.config['location'],
+            "storage_profile": storage_profile,
+            "plan": {
+                "name": self.config["image_sku"],
+                "product": "vmseries-flex",
+                "publisher": "paloaltonetworks"
+            },
+            "diagnostics_profile": {
+                "boot_diagnostics": {
+                    "enabled": True
+                }
+            },
+            "os_profile": os_profile,
+            "network_profile": {
+                "network_interfaces": [{
+                    "id": self.nic_id,
+                    "properties": {
+                        "primary": True
+                    }
+                }]
+            }
+        }
+        # Availability zones after the regional placement. The disk of a variant is regional, it cannot be
+        # attached to a zonal VM.
+        zones = [] if fork_disk else [str(zone) for zone in self.config.get('fallback_placements', [])]
+        plan = launch_plan([self.config['vm_size']] + self.config.get('fallback_sizes', []), [None] + zones,
+                           self.config.get('spot'))
+        launcher = Launcher(self.logger, plan, azure_capacity_error)
         try:
-            poller = self.compute_client.virtual_machines.begin_create_or_update(self.config['rg_name'],
-                                                                                 f'PANW-CI-{self.id}',
-                                                                                 {
-                                                                                "location": self.config['location'],
-                                                                                "storage_profile": {
-                                                                                    "image_reference": {
-                                                                                        "publisher": "paloaltonetworks",
-                                                                                        "offer": "vmseries-flex",
-                                                                                        "sku": self.config["image_sku"],
-                                                                                        "version":
-                                                                                            self.config["image_version"]
-                                                                                    }
-                                                                                },
-                                                                                "plan": {
-                                                                                    "name": self.config["image_sku"],
-                                                                                    "product": "vmseries-flex",
-                                                                                    "publisher": "paloaltonetworks"
-                                                                                },
-                                                                                "hardware_profile": {
-                                                                                    "vm_size": self.config['vm_size']
-                                                                                },
-                                                                                "os_profile": {
-                                                                                    "computer_name":
-                                                                                        f'PANW-CI-{self.id}',
-                                                                                    "admin_username":
-                                                                                        self.config["username"],
-                                                                                    "admin_password":
-                                                                                        self.config["password"]
-                                                                                },
-                                                                                "network_profile": {
-                                                                                    "network_interfaces": [{
-                                                                                        "id": self.config['nic_id'],
-                                                                                        "properties": {
-                                                                                            "primary": True
-                                                                                        }
-                                                                                    }]
-                                                                                }
-                                                                            }
-                                                                                 )
-
-            vm_result = poller.result()
+            attempt, vm_result = launcher.run(lambda attempt: self._launch(attempt, parameters))
             self.logger.debug(f'vm_result: {str(vm_result.__dict__)}')
             self.instance_name = vm_result.name
-            self.public_ip = self._get_public_ip()
+            self.public_ip = self.public_ip or self._get_public_ip()
             self.logger.info('*** Instance Creation Successful ***')
         except Exception as e:
             self.logger.error(f'ERROR: Unable to deploy the instance: {str(e)}')
-            exit(0)
+            raise
+        finally:
+            self.launches = launcher.attempts
+        self.config['vm_size'] = attempt['size']
         return {'instance_name': self.instance_name, 'ip': self.public_ip, 'user': 'admin'}
 
+    def _launch(self, attempt, parameters):
+        parameters = dict(parameters, hardware_profile={"vm_size": attempt['size']})
+        if attempt['placement']:
+            parameters["zones"] = [attempt['placement']]
+        if attempt['spot']:
+            # Deallocated when evicted, at most the on-demand price
+            parameters.update({"priority": "Spot", "eviction_policy": "Deallocate",
+                               "billing_profile": {"max_price": -1}})
+        poller = self.compute_client.virtual_machines.begin_create_or_update(self.config['rg_name'],
+                                                                             self.instance_name, parameters)
+        try:
+            return poller.result()
+        except Exception:
+            # A VM that failed to allocate keeps its size and zone, it is deleted before the next attempt
+            try:
+                self.compute_client.virtual_machines.begin_delete(self.config['rg_name'], self.instance_name).result()
+            except Exception as e:
+                self.logger.warning(f'Unable to delete the failed VM {self.instance_name}: {str(e)}')
+            raise
+
+    def _fork_disk(self):
+        disk = {
+            "location": self.location,
+            "creation_data": {"create_option": "Copy", "source_resource_id": self.config['fork_snapshot_id']}
+        }
+        if self.config.get('build_volume_type'):
+            disk["sku"] = {"name": self.config['build_volume_type']}
+        # Named after the VM, so that it is deleted with it
+        poller = self.compute_client.disks.begin_create_or_update(self.config['rg_name'], f'PANW-CI-{self.id}-osdisk',
+                                                                  disk)
+        return poller.result().id
+
+    def create_fork_image(self, name):
+        """
+        Snapshot of the OS disk of the deallocated base instance, neither reset nor generalized, to launch the
+        variants of a build matrix. Managed images need a generalized VM.
+        :return: Configuration of the variant builds
+        """
+        instance = self.compute_client.virtual_machines.get(resource_group_name=self.config['rg_name'],
+                                                            vm_name=self.instance_name)
+        report_resource(self, 'fork', fork={'fork_snapshot_id': name})
+        poller = self.compute_client.snapshots.begin_create_or_update(self.config['rg_name'], name, {
+            "location": self.location,
+            "creation_data": {"create_option": "Copy",
+                              "source_resource_id": instance.storage_profile.os_disk.managed_disk.id}
+        })
+        return {'fork_snapshot_id': poller.result().id}
+
+    def delete_fork_image(self, fork):
+        name = fork['fork_snapshot_id'].split('/')[-1]
+        self.compute_client.snapshots.begin_delete(self.config['rg_name'], name).result()
+
+    def _statuses(self):
+        view = self.compute_client.virtual_machines.instance_view(self.config['rg_name'], self.instance_name)
+        return [status.code for status in view.statuses]
+
+    def _serial_log(self):
+        diagnostics = self.compute_client.virtual_machines.retrieve_boot_diagnostics_data(
+            self.config['rg_name'], self.instance_name, sas_uri_expiration_time_in_minutes=10)
+        with urllib.request.urlopen(diagnostics.serial_console_log_blob_uri) as response:
+            return response.read().decode('utf-8', 'replace')
+
+    def wait_for_boot(self, timeout, reboot=False):
+        """
+        Watch the instance view and the boot diagnostics serial log for the PAN-OS boot-complete markers.
+        :param int timeout: Seconds to wait
+        :param bool reboot: Wait for a boot that started after this call
+        :return: True when the boot completed, False on timeout, None if boot diagnostics are unavailable.
+        """
+        started = time.time()
+        try:
+            baseline = self._serial_log()
+        except Exception as e:
+            self.logger.info(f'Boot diagnostics unavailable: {str(e)}')
+            return None
+        self.logger.info(f'Watching the serial log of {self.instance_name} for the end of the boot...')
+        while time.time() - started < timeout:
+            try:
+                if 'PowerState/running' in self._statuses() and boot_complete(self._serial_log(), baseline, reboot):
+                    self.logger.info(f'Boot complete after {int(time.time() - started)}s.')
+                    return True
+            except Exception as e:
+                self.logger.debug(f'Unable to read boot diagnostics: {str(e)}')
+            time.sleep(POLL)
+        self.logger.info('Boot-complete marker not seen in the serial log.')
+        return False
+
     def terminate_instance(self):
         try:
+            # Read before the VM is deleted: names of other builds and variants, e.g. "PANW-CI-q12" or
+            # "PANW-CI-q1-ha", contain this one
+            instance = self.compute_client.virtual_machines.get(self.config['rg_name'], self.instance_name)
+            os_disk = instance.storage_profile.os_disk.managed_disk.id.rsplit('/', 1)[-1]
             poller = self.compute_client.virtual_machines.begin_delete(self.config['rg_name'], self.instance_name)
             self.logger.info('Waiting for completion...')
             time.sleep(20)
             poller.result()
 
-            disk_list = self.compute_client.disks.list_by_resource_group(self.config['rg_name'])
-            for disk in disk_list:
-                if self.instance_name in disk.name:
-                    async_disk_delete = self.compute_client.disks.begin_delete(self.config['rg_name'], disk.name)
-                    async_disk_delete.result()
-                    break
+            async_disk_delete = self.compute_client.disks.begin_delete(self.config['rg_name'], os_disk)
+            async_disk_delete.result()
 
         except Exception as e:
             self.logger.error(f'Unable to terminate instance: {str(e)}')
+        try:
+            self.delete_network()
+        except Exception as e:
+            self.logger.error(f'Unable to delete the network interface: {str(e)}')
         return
 
     def stop_instance(self):
@@ -151,7 +431,11 @@ class CloudAzure(object):
         try:
             self.compute_client.virtual_machines.generalize(self.config['rg_name'], self.instance_name)
             self.logger.info(f'Generalizing VM instance {self.instance_name} ...')
-            time.sleep(20)
+            started = time.time()
+            while 'OSState/generalized' not in self._statuses():
+                if time.time() - started > GENERALIZE_TIMEOUT:
+                    raise Exception('VM instance is not reported as generalized.')
+                time.sleep(2)
         except Exception as e:
             self.logger.error(f'Unable to generalize VM instance: {str(e)}')
             return False
@@ -159,12 +443,26 @@ class CloudAzure(object):
 
         instance = self.compute_client.virtual_machines.get(resource_group_name=self.config['rg_name'],
                                                             vm_name=self.instance_name)
+        name = f'{name}-{self.id}'
         image_parameters = {
             "location": self.config['location'],
             "source_virtual_machine": {
                 "id": instance.id
-            }
+            },
+            "tags": image_tags(self.config, self.id)
         }
+        runtime_type = self.config.get('runtime_volume_type')
+        if runtime_type and runtime_type != self.config.get('build_volume_type'):
+            # Built from the OS disk to set the disk type of the image
+            del image_parameters["source_virtual_machine"]
+            image_parameters["storage_profile"] = {
+                "os_disk": {
+                    "os_type": "Linux",
+                    "os_state": "Generalized",
+                    "managed_disk": {"id": instance.storage_profile.os_disk.managed_disk.id},
+                    "storage_account_type": runtime_type
+                }
+            }
 
         try:
             poller = self.compute_client.images.begin_create_or_update(self.config['rg_name'], name, image_parameters)
@@ -174,6 +472,87 @@ class CloudAzure(object):
         except Exception as e:
             self.logger.error(f'Unable to create Image from VM instance: {str(e)}')
             return False
+        self.image_id = image_id
+        self.image_name = name
+        self.images[self.location] = image_id
         self.logger.info('Custom Image creation complete.')
         self.logger.info(f'Custom Image ID: {image_id}')
         return True
+
+    def custom_images(self, region):
+        """
+        Custom images and leftover base instance disks of the resource group, for the image garbage collection.
+        """
+        rg_name = self.config['rg_name']
+        in_use = set()
+        for vm in self.compute_client.virtual_machines.list(rg_name):
+            reference = vm.storage_profile.image_reference if vm.storage_profile else None
+            if reference is not None and reference.id:
+                in_use.add(reference.id.lower())
+        # Scale sets create instances from the image of their model
+        for scale_set in self.compute_client.virtual_machine_scale_sets.list(rg_name):
+            profile = scale_set.virtual_machine_profile
+            reference = profile.storage_profile.image_reference if profile and profile.storage_profile else None
+            if reference is not None and reference.id:
+                in_use.add(reference.id.lower())
+        images = []
+        for image in self.compute_client.images.list_by_resource_group(rg_name):
+            tags = image.tags or {}
+            group = image_group(image.name, tags)
+            if group is None:
+                continue
+            os_disk = image.storage_profile.os_disk if image.storage_profile else None
+            images.append({
+                'kind': 'image',
+                'id': image.id,
+                'name': image.name,
+                'region': image.location,
+                'group': group,
+                # Images created before tagging have no known creation time
+                'created': float(tags['created']) if tags.get('created') else None,
+                'size_gb': (os_disk.disk_size_gb or 0) if os_disk else 0,
+                'in_use': image.id.lower() in in_use,
+            })
+        for disk in self.compute_client.disks.list_by_resource_group(rg_name):
+            if disk.name.startswith('PANW-CI-') and not disk.managed_by:
+                images.append({
+                    'kind': 'disk',
+                    'id': disk.id,
+                    'name': disk.name,
+                    'region': disk.location,
+                    'group': 'leftover disk',
+                    'created': disk.time_created.timestamp() if disk.time_created else None,
+                    'size_gb': disk.disk_size_gb or 0,
+                    'in_use': False,
+                    'build_id': BUILD_RESOURCE.match(disk.name).group('build_id'),
+                })
+        # Network of builds that stopped before their teardown, untagged if created before tagging
+        for nic in self.network_client.network_interfaces.list(rg_name):
+            if nic.name.startswith('PANW-CI-') and nic.name.endswith('-nic') and not nic.virtual_machine:
+                images.append(self._leftover_network('nic', nic, in_use=False))
+        for public_ip in self.network_client.public_ip_addresses.list(rg_name):
+            if public_ip.name.startswith('PANW-CI-') and public_ip.name.endswith('-pip'):
+                images.append(self._leftover_network('public ip', public_ip,
+                                                     in_use=public_ip.ip_configuration is not None))
+        return images
+
+    def _leftover_network(self, kind, resource, in_use):
+        tags = resource.tags or {}
+        return {'kind': kind, 'id': resource.id, 'name': resource.name, 'region': resource.location,
+                'group': 'leftover network', 'created': float(tags['created']) if tags.get('created') else None,
+                'size_gb': 0, 'in_use': in_use,
+                'build_id': tags.get('build-id') or BUILD_RESOURCE.match(resource.name).group('build_id')}
+
+    def delete_custom_image(self, image):
+        if image['kind'] == 'disk':
+            self.compute_client.disks.begin_delete(self.config['rg_name'], image['name']).result()
+        elif image['kind'] == 'nic':
+            self.network_client.network_interfaces.begin_delete(self.config['rg_name'], image['name']).result()
+        elif image['kind'] == 'public ip':
+            self.network_client.public_ip_addresses.begin_delete(self.config['rg_name'], image['name']).result()
+        else:
+            self.compute_client.images.begin_delete(self.config['rg_name'], image['name']).result()
+
+    def replicate_image(self, regions):
+        self.logger.warning('Managed images cannot be copied to other locations. Skipping replication.')
+        return self.images
@@ -0,0 +1,59 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+from azure.core.pipeline.policies import RetryPolicy, SansIOHTTPPolicy
+
+from cloudclient.throttle import AZURE_RATE, MAX_ATTEMPTS, THROTTLE, account_name
+
+
+class ThrottlePolicy(SansIOHTTPPolicy):
+    def __init__(self, name):
+        """
+        Send every request, including retries and long running operation polls, through a token bucket.
+        :param str name: Token bucket of the subscription
+        """
+        super(ThrottlePolicy, self).__init__()
+        self.name = name
+
+    def on_request(self, request):
+        THROTTLE.acquire(self.name)
+
+    def on_response(self, request, response):
+        status = response.http_response.status_code
+        if status == 429:
+            THROTTLE.throttled(self.name)
+        elif status >= 500:
+            THROTTLE.count(self.name, 'errors')
+        else:
+            THROTTLE.buckets[self.name].succeeded()
+
+
+class JitterRetryPolicy(RetryPolicy):
+    """
+    Exponential backoff with full jitter, so that concurrent builds throttled together do not retry together.
+    A Retry-After header sent by ARM still takes precedence.
+    """
+    def get_backoff_time(self, settings):
+        return random.uniform(0, super(JitterRetryPolicy, self).get_backoff_time(settings))
+
+
+def azure_client_options(config):
+    """
+    Management client options: ARM limits requests per subscription, shared by all clients of the subscription.
+    """
+    name = account_name('azure', config['subscription_id'])
+    THROTTLE.bucket(name, config.get('api_rate_limit') or AZURE_RATE)
+    return {'per_retry_policies': [ThrottlePolicy(name)], 'retry_policy': JitterRetryPolicy(retry_total=MAX_ATTEMPTS)}
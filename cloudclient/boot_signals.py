@@ -0,0 +1,67 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+# Printed on the serial console when the kernel starts, including after "request restart system"
+# and "request system private-data-reset".
+BOOT_START = re.compile(r'Linux version|Booting |reboot: Restarting system|Restarting system')
+# PAN-OS prints the login prompt once the management plane finished booting.
+BOOT_COMPLETE = re.compile(r'^[\w.-]+ login:\s*$', re.MULTILINE)
+OVERLAP = 512
+POLL = 15
+
+
+def new_output(baseline, log):
+    """
+    Part of a console log written after the baseline was captured. Cloud providers only return the tail of
+    the console, so the beginning of the log is aligned with the end of the baseline. The end of the baseline
+    is not searched for in the log: every boot prints the same messages and login prompt.
+    :return: New output, None when the log rotated past the baseline
+    """
+    if not baseline:
+        return log
+    if log.startswith(baseline):
+        return log[len(baseline):]
+    if log in baseline:
+        # Stale read, nothing new
+        return ''
+    head = log[:OVERLAP]
+    position = baseline.find(head)
+    while position != -1:
+        overlap = len(baseline) - position
+        if log[:overlap] == baseline[position:]:
+            return log[overlap:]
+        position = baseline.find(head, position + 1)
+    return None
+
+
+def boot_complete(log, baseline=None, reboot=False):
+    """
+    Whether a console log shows a finished PAN-OS boot.
+    :param str log: Current console log
+    :param str baseline: Console log captured before the reboot was requested
+    :param bool reboot: Require a boot that started after the baseline
+    """
+    rotated = False
+    if reboot:
+        output = new_output(baseline or '', log)
+        # Rotated past the baseline, the whole log is new even without the start of the boot
+        rotated = output is None
+        log = log if rotated else output
+    starts = list(BOOT_START.finditer(log))
+    if reboot and not starts and not rotated:
+        return False
+    last_start = starts[-1].end() if starts else 0
+    return BOOT_COMPLETE.search(log, last_start) is not None
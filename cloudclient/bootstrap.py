@@ -0,0 +1,56 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+
+# Keys of the bootstrap storage mapping in config.yaml for Azure file share bootstrapping
+AZURE_STORAGE_KEYS = ('storage-account', 'access-key', 'file-share', 'share-directory')
+
+
+def init_cfg(config):
+    """
+    VM-Series bootstrap parameters passed as user data (AWS) or custom data (Azure).
+    With a bootstrap package (S3 bucket or Azure file share) the license and content packages are
+    read from the package, otherwise only the auth-code is passed inline.
+    :param dict config: Build configuration
+    :return: List of "key=value" init-cfg parameters. Empty when bootstrapping is disabled.
+    """
+    if not config.get('bootstrap'):
+        return []
+    params = []
+    if config['cloud_provider'] == 'aws' and config.get('bootstrap_bucket'):
+        params.append(f'vmseries-bootstrap-aws-s3bucket={config["bootstrap_bucket"]}')
+    elif config['cloud_provider'] == 'azure' and config.get('bootstrap_storage'):
+        storage = config['bootstrap_storage']
+        params.extend(f'{key}={storage[key]}' for key in AZURE_STORAGE_KEYS if storage.get(key))
+    elif config.get('auth_code'):
+        params.append(f'authcodes={config["auth_code"]}')
+    return params
+
+
+def user_data(config):
+    """
+    AWS user data, one parameter per line.
+    """
+    return '\n'.join(init_cfg(config))
+
+
+def custom_data(config):
+    """
+    Azure custom data, base64 encoded and separated by semicolons.
+    """
+    params = init_cfg(config)
+    if not params:
+        return None
+    return base64.b64encode(';'.join(params).encode('utf-8')).decode('utf-8')
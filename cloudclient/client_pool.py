@@ -0,0 +1,188 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import threading
+import time
+
+from cloudclient.throttle import aws_retry_config, throttle_aws_client
+
+# HTTP connections per pooled client, shared by the concurrent builds of an account and region
+MAX_POOL_CONNECTIONS = 50
+# Tokens are refreshed this many seconds before they expire
+REFRESH_MARGIN = 300
+GCP_SCOPE = 'https://www.googleapis.com/auth/compute'
+
+
+def secret_digest(secret):
+    return hashlib.sha256(str(secret).encode('utf-8')).hexdigest()[:16]
+
+
+class ClientPool(object):
+    def __init__(self):
+        """
+        Process-wide pool of cloud SDK clients and credentials, keyed by account, service and region.
+        Pooled objects must be thread-safe: boto3 clients, Azure management clients and requests sessions are,
+        boto3 resources are not.
+        """
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.stats = {}
+
+    def get(self, kind, key, factory):
+        """
+        :param str kind: Statistics bucket, e.g. "aws client"
+        :param tuple key: Account, service and region the object is for
+        :param factory: Callable creating the object on a miss
+        """
+        with self.lock:
+            stats = self.stats.setdefault(kind, {'created': 0, 'reused': 0})
+            if (kind, key) in self.clients:
+                stats['reused'] += 1
+                return self.clients[(kind, key)]
+            # Created under the lock: boto3 sessions are not thread-safe
+            client = factory()
+            self.clients[(kind, key)] = client
+            stats['created'] += 1
+            return client
+
+    def count(self, kind, name):
+        with self.lock:
+            stats = self.stats.setdefault(kind, {'created': 0, 'reused': 0})
+            stats[name] = stats.get(name, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.clients = {}
+
+    def report(self, logger):
+        """
+        Log how often pooled clients and tokens were reused. Every reuse is a client construction, TLS
+        handshake or token request saved.
+        """
+        with self.lock:
+            stats = {kind: dict(values) for kind, values in self.stats.items()}
+        saved = 0
+        for kind, values in sorted(stats.items()):
+            total = sum(values.values())
+            reused = values.get('reused', 0)
+            saved += reused
+            rate = int(reused * 100 / total) if total else 0
+            details = ', '.join(f'{name} {value}' for name, value in sorted(values.items()))
+            logger.info(f'Client pool {kind}: {details} ({rate}% reused)')
+        logger.info(f'Client pool: {saved} client constructions, handshakes or token requests saved.')
+        return stats
+
+
+POOL = ClientPool()
+
+
+def aws_client(service, config, region=None):
+    """
+    Shared boto3 client for the account of config and a region.
+    """
+    import boto3
+    from botocore.config import Config
+
+    region = region or config['region']
+    key = (config['aws_access_key_id'], secret_digest(config['aws_secret_access_key']), service, region)
+
+    def create():
+        client = boto3.session.Session().client(
+            service,
+            aws_access_key_id=config['aws_access_key_id'],
+            aws_secret_access_key=config['aws_secret_access_key'],
+            region_name=region,
+            config=Config(max_pool_connections=MAX_POOL_CONNECTIONS, retries=aws_retry_config()))
+        return throttle_aws_client(client, config, region)
+    return POOL.get('aws client', key, create)
+
+
+class RefreshingCredential(object):
+    def __init__(self, credential, margin=REFRESH_MARGIN):
+        """
+        Azure credential wrapper sharing tokens between clients and refreshing them before they expire.
+        :param credential: azure-identity credential
+        :param int margin: Seconds before expiry a token is refreshed
+        """
+        self.credential = credential
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.tokens = {}
+
+    def get_token(self, *scopes, **kwargs):
+        with self.lock:
+            token = self.tokens.get(scopes)
+            if token is not None and token.expires_on - time.time() > self.margin:
+                POOL.count('azure token', 'reused')
+                return token
+            POOL.count('azure token', 'refreshed' if token is not None else 'created')
+            token = self.credential.get_token(*scopes, **kwargs)
+            self.tokens[scopes] = token
+            return token
+
+    def close(self):
+        if hasattr(self.credential, 'close'):
+            self.credential.close()
+
+
+def azure_credential(config):
+    from azure.identity import ClientSecretCredential
+
+    key = (config['tenant_id'], config['client_id'], secret_digest(config['client_secret']))
+    return POOL.get('azure credential', key, lambda: RefreshingCredential(ClientSecretCredential(
+        client_id=config['client_id'],
+        client_secret=config['client_secret'],
+        tenant_id=config['tenant_id'])))
+
+
+def azure_client(client_class, config, **kwargs):
+    """
+    Shared Azure management client, e.g. ComputeManagementClient, for the service principal and subscription.
+    :param kwargs: Client options, e.g. pipeline policies, used when the client is created
+    """
+    credential = azure_credential(config)
+    key = (client_class.__name__, config['tenant_id'], config['client_id'], secret_digest(config['client_secret']),
+           config['subscription_id'])
+    return POOL.get('azure client', key, lambda: client_class(credential=credential,
+                                                             subscription_id=config['subscription_id'], **kwargs))
+
+
+def gcp_session(config):
+    """
+    Shared authorized HTTP session for the service account of config. Without a key file, the application
+    default credentials are used, or none at all for a local emulator endpoint.
+    """
+    import google.auth
+    from google.auth.credentials import AnonymousCredentials
+    from google.auth.transport.requests import AuthorizedSession
+    from google.oauth2 import service_account
+    from requests.adapters import HTTPAdapter
+
+    key = (config.get('gcp_credentials') or 'default', config.get('gcp_endpoint') or '')
+
+    def create():
+        if config.get('gcp_credentials'):
+            credentials = service_account.Credentials.from_service_account_file(config['gcp_credentials'],
+                                                                                scopes=[GCP_SCOPE])
+        elif config.get('gcp_endpoint'):
+            credentials = AnonymousCredentials()
+        else:
+            credentials, _ = google.auth.default(scopes=[GCP_SCOPE])
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=MAX_POOL_CONNECTIONS, pool_maxsize=MAX_POOL_CONNECTIONS)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    return POOL.get('gcp session', key, create)
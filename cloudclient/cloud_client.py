@@ -12,22 +12,110 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from cloudclient.aws_client import CloudAws
-from cloudclient.gcp_client import CloudGcp
-from cloudclient.azure_client import CloudAzure
+import importlib
+
+# Third-party providers register a class under this entry point group, e.g. in setup.py:
+#   entry_points={'custom_imaging.cloud_providers': ['oci = my_package.oci_client:CloudOci']}
+ENTRY_POINT_GROUP = 'custom_imaging.cloud_providers'
+
+# Built-in providers. The modules, and the cloud SDKs they import, are only loaded when the provider is used.
+PROVIDERS = {
+    'aws': 'cloudclient.aws_client:CloudAws',
+    'gcp': 'cloudclient.gcp_client:CloudGcp',
+    'azure': 'cloudclient.azure_client:CloudAzure',
+}
+
+ALIASES = {
+    'aws': 'aws', 'amazon': 'aws', 'amazon aws': 'aws',
+    'gcp': 'gcp', 'google': 'gcp', 'google cloud': 'gcp', 'google cloud platform': 'gcp',
+    'azure': 'azure', 'msazure': 'azure', 'azure cloud': 'azure', 'microsoft azure': 'azure',
+}
+
+_plugins = None
+_loaded = {}
+
+
+def register(name, target, aliases=()):
+    """
+    Register a provider.
+    :param str name: Provider name used in config.yaml "cloud-provider"
+    :param target: Client class, or "module:Class" imported on first use
+    :param aliases: Other names resolving to this provider
+    """
+    PROVIDERS[name] = target
+    _loaded.pop(name, None)
+    for alias in (name,) + tuple(aliases):
+        ALIASES[alias.lower()] = name
+
+
+def _entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # Python < 3.8
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+    found = entry_points()
+    if hasattr(found, 'select'):
+        return list(found.select(group=ENTRY_POINT_GROUP))
+    return list(found.get(ENTRY_POINT_GROUP, []))
+
+
+def plugin_providers():
+    """
+    Providers registered through entry points. Only scanned once, and only when a name is not built in.
+    """
+    global _plugins
+    if _plugins is None:
+        _plugins = {}
+        for entry_point in _entry_points():
+            _plugins[entry_point.name.lower()] = entry_point
+    return _plugins
+
+
+def provider_name(alias):
+    """
+    :return: Provider name for an alias such as "amazon" or "msazure", None if unknown.
+    """
+    alias = str(alias or '').lower()
+    if alias in ALIASES:
+        return ALIASES[alias]
+    if alias in plugin_providers():
+        return alias
+    return None
+
+
+def provider_class(alias):
+    name = provider_name(alias)
+    if name is None:
+        return None
+    if name not in _loaded:
+        if name in PROVIDERS:
+            target = PROVIDERS[name]
+            if isinstance(target, str):
+                module, _, attribute = target.partition(':')
+                target = getattr(importlib.import_module(module), attribute)
+        else:
+            target = plugin_providers()[name].load()
+        _loaded[name] = target
+    return _loaded[name]
+
+
+def report_resource(client, kind, **state):
+    """
+    Report a billed resource as soon as it exists, through the on_resource callback of the client when set, so
+    that the resources of an interrupted build can be deleted later.
+    :param str kind: "instance", with the client attributes terminate_instance() needs, or "fork"
+    """
+    callback = getattr(client, 'on_resource', None)
+    if callback:
+        callback(dict(state, kind=kind))
 
 
 class CloudProvider(object):
     def __new__(cls, logger, provider_name, config):
-        if provider_name.lower() in ('aws', 'amazon', 'amazon aws'):
-            return CloudAws(logger, config)
-        elif provider_name.lower() in ('gcp', 'google', 'google cloud',
-                                       'google cloud platform'):
-            return CloudGcp(logger, config)
-        elif provider_name.lower() in ('azure', 'msazure', 'azure cloud',
-                                       'microsoft azure'):
-            return CloudAzure(logger, config)
-        else:
+        provider = provider_class(provider_name)
+        if provider is None:
             logger.error(
                 "Public Cloud Platform '" +
                 provider_name +
@@ -36,3 +124,4 @@ class CloudProvider(object):
                 "Public Cloud Platform '" +
                 provider_name +
                 "' is not supported.")
+        return provider(logger, config)
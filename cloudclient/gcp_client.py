@@ -12,6 +12,390 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import random
+import re
+import time
+
+import paramiko
+import requests
+
+from cloudclient.boot_signals import boot_complete, POLL
+from cloudclient.client_pool import gcp_session
+from cloudclient.cloud_client import report_resource
+from cloudclient.images import image_tags
+from cloudclient.launcher import Launcher, gcp_capacity_error, launch_plan
+from cloudclient.throttle import GCP_RATE, MAX_ATTEMPTS, THROTTLE, account_name
+
+ENDPOINT = 'https://compute.googleapis.com/compute/v1'
+# Every "wait" call returns within 2 minutes, done or not
+OPERATION_TIMEOUT = 1800
+REQUEST_TIMEOUT = 180
+# Exponential backoff with full jitter of throttled and transient errors
+BACKOFF_BASE = 1
+BACKOFF_MAX = 32
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Compute Engine resource names and labels: lowercase letters, digits and dashes, 63 characters at most
+NAME_LENGTH = 63
+
+
+def resource_name(text):
+    name = re.sub(r'[^a-z0-9-]+', '-', str(text).lower()).strip('-')
+    if not name or not name[0].isalpha():
+        name = f'panw-{name}'
+    return name[:NAME_LENGTH].rstrip('-')
+
+
+def labels(tags):
+    """
+    Image tags as Compute Engine labels.
+    """
+    return {resource_name(key): re.sub(r'[^a-z0-9_-]+', '-', str(value).lower())[:NAME_LENGTH]
+            for key, value in tags.items()}
+
+
 class CloudGcp(object):
     def __init__(self, logger, config):
-        logger.error("GCP is not supported yet.")
+        self.name = 'gcp'
+        self.project = config['project']
+        self.zone = config['zone']
+        # Region of the zone, e.g. "us-central1" for "us-central1-a"
+        self.region = self.zone.rsplit('-', 1)[0]
+        self.logger = logger
+        self.config = config
+        self.endpoint = (config.get('gcp_endpoint') or ENDPOINT).rstrip('/')
+        self.account = account_name('gcp', self.project)
+        logger.info('Connecting to GCP...')
+        try:
+            self.session = gcp_session(config)
+            THROTTLE.bucket(self.account, config.get('api_rate_limit') or GCP_RATE)
+            self.id = config.get('build_id', os.getpid())
+            logger.info('Connection Successful.')
+        except Exception as e:
+            logger.error(f'Unable to connect to GCP: {str(e)}')
+        self.config["username"] = "admin"
+        self.instance_name = ""
+        self.public_ip = ""
+        self.image_id = ""
+        self.image_name = ""
+        self.images = {}
+        # Launch attempts of the last create_instance
+        self.launches = []
+
+    def _url(self, path):
+        if path.startswith('http'):
+            return path
+        if path.startswith('projects/'):
+            return f'{self.endpoint}/{path}'
+        return f'{self.endpoint}/projects/{self.project}/{path}'
+
+    def _request(self, method, path, missing_ok=False, **kwargs):
+        """
+        Compute Engine API call through the token bucket of the project, retrying throttled and transient errors.
+        :param bool missing_ok: Return None instead of raising when the resource does not exist
+        """
+        url = self._url(path)
+        response = None
+        for attempt in range(MAX_ATTEMPTS):
+            THROTTLE.acquire(self.account)
+            try:
+                response = self.session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+            except requests.RequestException as e:
+                THROTTLE.count(self.account, 'errors')
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise Exception(f'{method} {url}: {str(e)}')
+            else:
+                if response.status_code == 429 or \
+                        (response.status_code == 403 and 'rateLimitExceeded' in response.text):
+                    THROTTLE.throttled(self.account)
+                elif response.status_code in RETRY_STATUS:
+                    THROTTLE.count(self.account, 'errors')
+                else:
+                    break
+            time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+        if response.status_code == 404 and missing_ok:
+            return None
+        if response.status_code >= 400:
+            try:
+                error = response.json()['error']
+                message = error.get('message', '')
+                reason = (error.get('errors') or [{}])[0].get('reason', '')
+            except (ValueError, KeyError, TypeError):
+                message, reason = response.text[:200], ''
+            raise Exception(f'({response.status_code} {reason}) {method} {url}: {message}')
+        THROTTLE.buckets[self.account].succeeded()
+        return response.json() if response.content else {}
+
+    def _list(self, path, **params):
+        """
+        Every page of a list. Aggregated lists, e.g. "aggregated/disks", are flattened over their zones and regions.
+        """
+        kind = path.split('/')[1] if path.startswith('aggregated/') else None
+        items = []
+        while True:
+            page = self._request('GET', path, params=params)
+            if kind:
+                for scope in page.get('items', {}).values():
+                    items += scope.get(kind, [])
+            else:
+                items += page.get('items', [])
+            if not page.get('nextPageToken'):
+                return items
+            params['pageToken'] = page['nextPageToken']
+
+    def wait_operation(self, operation, timeout=OPERATION_TIMEOUT):
+        """
+        Wait for a zone, region or global operation with the "wait" method, which returns as soon as the
+        operation is done, instead of sleeping between polls.
+        :return: Finished operation
+        """
+        started = time.time()
+        while operation.get('status') != 'DONE':
+            if time.time() - started > timeout:
+                raise Exception(f'Operation {operation.get("name")} not done after {timeout}s.')
+            operation = self._request('POST', f'{operation["selfLink"]}/wait')
+        if operation.get('error'):
+            errors = operation['error'].get('errors') or [{}]
+            raise Exception('; '.join(f'({error.get("code")}) {error.get("message")}' for error in errors))
+        return operation
+
+    def _instance(self):
+        return self._request('GET', f'zones/{self.zone}/instances/{self.instance_name}')
+
+    def _get_public_ip(self, instance=None):
+        instance = instance or self._instance()
+        return instance['networkInterfaces'][0]['accessConfigs'][0]['natIP']
+
+    def _check_image(self):
+        if not (self.config.get('image_id') or self.config.get('fork_image_id')):
+            self._request('GET', self.config['source_image'])
+
+    def _machine_type(self):
+        return self._request('GET', f'zones/{self.zone}/machineTypes/{self.config["machine_type"]}')
+
+    def _check_machine_type(self):
+        self._machine_type()
+
+    def _check_subnetworks(self):
+        for subnetwork in self.config['subnetworks']:
+            self._request('GET', self._subnetwork(subnetwork))
+
+    def _check_quota(self):
+        needed = self._machine_type()['guestCpus']
+        for quota in self._request('GET', f'regions/{self.region}').get('quotas', []):
+            if quota['metric'] == 'CPUS' and quota['usage'] + needed > quota['limit']:
+                raise Exception(f'Not enough regional CPU quota: {int(quota["usage"])} of {int(quota["limit"])} '
+                                f'in use, {self.config["machine_type"]} needs {needed}.')
+
+    def preflight_checks(self):
+        return {
+            'gcp image': self._check_image,
+            'gcp machine type': self._check_machine_type,
+            'gcp subnetworks': self._check_subnetworks,
+            'gcp cpu quota': self._check_quota,
+        }
+
+    def available_sizes(self, candidates):
+        """
+        :return: Machine types of candidates available in the zone, in the same order.
+        """
+        offered = set(machine_type['name'] for machine_type in self._list(f'zones/{self.zone}/machineTypes'))
+        return [size for size in candidates if size in offered]
+
+    def _subnetwork(self, subnetwork):
+        # Subnetwork name in the region of the zone, or its path
+        return subnetwork if '/' in subnetwork else f'regions/{self.region}/subnetworks/{subnetwork}'
+
+    def _public_key(self):
+        for key_class in (paramiko.RSAKey, paramiko.ECDSAKey, paramiko.Ed25519Key):
+            try:
+                key = key_class.from_private_key_file(self.config['pkey'])
+                return f'{key.get_name()} {key.get_base64()}'
+            except paramiko.SSHException:
+                continue
+        raise Exception(f'Unable to read the private key {self.config["pkey"]}.')
+
+    def _instance_body(self, attempt):
+        image = self.config.get('image_id') or self.config.get('fork_image_id') or self.config['source_image']
+        disk = {'boot': True, 'autoDelete': True, 'initializeParams': {'sourceImage': image}}
+        if self.config.get('build_volume_type'):
+            disk['initializeParams']['diskType'] = f'zones/{self.zone}/diskTypes/{self.config["build_volume_type"]}'
+        interfaces = []
+        for index, subnetwork in enumerate(self.config['subnetworks']):
+            interface = {'subnetwork': self._subnetwork(subnetwork)}
+            if index == 0:
+                # Management interface
+                interface['accessConfigs'] = [{'name': 'External NAT', 'type': 'ONE_TO_ONE_NAT'}]
+            interfaces.append(interface)
+        body = {
+            'name': self.instance_name,
+            'machineType': f'zones/{self.zone}/machineTypes/{attempt["size"]}',
+            'canIpForward': True,
+            'disks': [disk],
+            'networkInterfaces': interfaces,
+            'metadata': {'items': [{'key': 'serial-port-enable', 'value': 'true'},
+                                   {'key': 'ssh-keys', 'value': f'admin:{self._public_key()}'}]},
+            'labels': {'custom-imaging': 'true', 'build-id': resource_name(self.id)},
+        }
+        if attempt['spot']:
+            body['scheduling'] = {'preemptible': True, 'automaticRestart': False, 'onHostMaintenance': 'TERMINATE'}
+        return body
+
+    def _launch(self, attempt):
+        # Zones of the region of the subnetworks
+        self.zone = attempt['placement']
+        report_resource(self, 'instance', instance_name=self.instance_name, zone=self.zone)
+        operation = self._request('POST', f'zones/{self.zone}/instances', json=self._instance_body(attempt))
+        self.wait_operation(operation)
+        return self._instance()
+
+    def create_instance(self):
+        # Named before the request, so that the instance is deleted whatever fails next
+        self.instance_name = resource_name(f'panw-ci-{self.id}')
+        self.logger.info(f'Creating instance "{self.instance_name}" ...')
+        plan = launch_plan([self.config['machine_type']] + self.config.get('fallback_sizes', []),
+                           [self.zone] + self.config.get('fallback_placements', []), self.config.get('spot'))
+        launcher = Launcher(self.logger, plan, gcp_capacity_error)
+        try:
+            attempt, instance = launcher.run(self._launch)
+            self.public_ip = self._get_public_ip(instance)
+            self.logger.info('*** Instance Creation Successful ***')
+        except Exception as e:
+            self.logger.error(f'ERROR: Unable to deploy the instance: {str(e)}')
+            raise
+        finally:
+            self.launches = launcher.attempts
+        self.config['machine_type'] = attempt['size']
+        return {'instance_name': self.instance_name, 'ip': self.public_ip, 'user': 'admin'}
+
+    def _serial_log(self):
+        return self._request('GET', f'zones/{self.zone}/instances/{self.instance_name}/serialPort',
+                             params={'port': 1}).get('contents', '')
+
+    def wait_for_boot(self, timeout, reboot=False):
+        """
+        Watch the serial port output for the PAN-OS boot-complete markers.
+        :param int timeout: Seconds to wait
+        :param bool reboot: Wait for a boot that started after this call
+        :return: True when the boot completed, False on timeout, None if the serial port output is unavailable.
+        """
+        started = time.time()
+        try:
+            baseline = self._serial_log()
+        except Exception as e:
+            self.logger.info(f'Serial port output unavailable: {str(e)}')
+            return None
+        self.logger.info(f'Watching the serial port of {self.instance_name} for the end of the boot...')
+        while time.time() - started < timeout:
+            try:
+                if self._instance()['status'] == 'RUNNING' and boot_complete(self._serial_log(), baseline, reboot):
+                    self.logger.info(f'Boot complete after {int(time.time() - started)}s.')
+                    return True
+            except Exception as e:
+                self.logger.debug(f'Unable to read the serial port output: {str(e)}')
+            time.sleep(POLL)
+        self.logger.info('Boot-complete marker not seen in the serial port output.')
+        return False
+
+    def terminate_instance(self):
+        try:
+            operation = self._request('DELETE', f'zones/{self.zone}/instances/{self.instance_name}', missing_ok=True)
+            if operation:
+                self.logger.info('Waiting for completion...')
+                # The boot disk is deleted with the instance
+                self.wait_operation(operation)
+        except Exception as e:
+            self.logger.error(f'Unable to terminate instance: {str(e)}')
+        return
+
+    def stop_instance(self):
+        try:
+            self.logger.info(f'Stopping instance {self.instance_name} ...')
+            self.wait_operation(self._request('POST', f'zones/{self.zone}/instances/{self.instance_name}/stop'))
+            stop_result = True
+        except Exception as e:
+            self.logger.error(f'Unable to stop instance: {str(e)}')
+            stop_result = False
+        self.logger.info('Instance stopped.')
+        return stop_result
+
+    def _create_image(self, name, image_labels=None):
+        body = {
+            'name': resource_name(name),
+            'description': name,
+            # The boot disk is named after the instance
+            'sourceDisk': f'zones/{self.zone}/disks/{self.instance_name}',
+            'storageLocations': [self.region],
+            'labels': image_labels or {},
+        }
+        if image_labels and self.config.get('image_family'):
+            body['family'] = self.config['image_family']
+        self.wait_operation(self._request('POST', 'global/images', json=body))
+        return f'projects/{self.project}/global/images/{body["name"]}'
+
+    def create_image(self, name):
+        name = f'{name}-{self.id}'
+        try:
+            self.logger.info(f'Creating Image from instance {self.instance_name} ...')
+            image_id = self._create_image(name, labels(image_tags(self.config, self.id)))
+        except Exception as e:
+            self.logger.error(f'Unable to create Image from instance: {str(e)}')
+            return False
+        self.image_id = image_id
+        self.image_name = resource_name(name)
+        self.images[self.region] = image_id
+        self.logger.info('Custom Image creation complete.')
+        self.logger.info(f'Custom Image ID: {image_id}')
+        return True
+
+    def create_fork_image(self, name):
+        """
+        Image of the boot disk of the stopped base instance, neither reset nor licensed, to launch the variants
+        of a build matrix. Not labelled, the image garbage collection leaves it alone.
+        :return: Configuration of the variant builds
+        """
+        fork = {'fork_image_id': f'projects/{self.project}/global/images/{resource_name(name)}'}
+        report_resource(self, 'fork', fork=fork)
+        self._create_image(name)
+        return fork
+
+    def delete_fork_image(self, fork):
+        self.wait_operation(self._request('DELETE', fork['fork_image_id']))
+
+    def custom_images(self, region):
+        """
+        Custom images of the project, for the image garbage collection. Images are global.
+        """
+        in_use = set()
+        for disk in self._list('aggregated/disks'):
+            if disk.get('sourceImage') and disk.get('users'):
+                in_use.add(disk['sourceImage'].rsplit('/', 1)[-1])
+        # Managed instance groups create instances from their template
+        for template in self._list('aggregated/instanceTemplates'):
+            for disk in template.get('properties', {}).get('disks', []):
+                source_image = disk.get('initializeParams', {}).get('sourceImage')
+                if source_image:
+                    in_use.add(source_image.rsplit('/', 1)[-1])
+        images = []
+        for image in self._list('global/images', filter='labels.custom-imaging=true'):
+            image_labels = image.get('labels', {})
+            sku = image_labels.get('image-sku')
+            version = image_labels.get('panos-version', image['name'])
+            images.append({
+                'kind': 'image',
+                'id': image['selfLink'],
+                'name': image['name'],
+                'region': 'global',
+                'group': f'{version}/{sku}' if sku else version,
+                'created': float(image_labels['created']) if image_labels.get('created') else None,
+                'size_gb': int(image.get('diskSizeGb') or 0),
+                'in_use': image['name'] in in_use,
+            })
+        return images
+
+    def delete_custom_image(self, image):
+        self.wait_operation(self._request('DELETE', f'global/images/{image["name"]}'))
+
+    def replicate_image(self, regions):
+        self.logger.warning('Compute Engine images are global and can be used in any region. Skipping replication.')
+        return self.images
@@ -0,0 +1,53 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import time
+
+IMAGE_PREFIX = 'PanOS-'
+# "PanOS-<version>-CustomImage-<build id>", images of older releases have no build id
+IMAGE_NAME = re.compile(r'^PanOS-(?P<version>.+?)-CustomImage(-(?P<build>.+))?$')
+MARKER_TAG = 'custom-imaging'
+
+
+def image_name(version):
+    return f'{IMAGE_PREFIX}{version}-CustomImage'
+
+
+def image_tags(config, build_id):
+    """
+    Tags set on custom images and their snapshots, used by the image garbage collection.
+    """
+    return {
+        MARKER_TAG: 'true',
+        'panos-version': str(config['version']),
+        'image-sku': str(config.get('image_sku') or ''),
+        'plugin': str(config.get('plugin') or ''),
+        'runtime-size': str(config.get('runtime_size') or ''),
+        'build-id': str(build_id),
+        'created': str(int(time.time())),
+    }
+
+
+def image_group(name, tags):
+    """
+    Retention group of an image: PanOS version, and SKU when known.
+    :return: Group name or None if the image was not created by this tool.
+    """
+    match = IMAGE_NAME.match(name or '')
+    if not match:
+        return None
+    version = tags.get('panos-version') or match.group('version')
+    sku = tags.get('image-sku')
+    return f'{version}/{sku}' if sku else version
@@ -0,0 +1,106 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+# Rounds over the whole launch plan, capacity comes back within minutes
+ROUNDS = 3
+ROUND_DELAY = 15
+# Errors worth trying another size, placement or market for
+AWS_CAPACITY_CODES = ('InsufficientInstanceCapacity', 'InsufficientCapacity', 'InsufficientHostCapacity',
+                      'InsufficientReservedInstanceCapacity', 'Unsupported', 'SpotMaxPriceTooLow',
+                      'MaxSpotInstanceCountExceeded')
+AZURE_CAPACITY_CODES = ('AllocationFailed', 'ZonalAllocationFailed', 'OverconstrainedAllocationRequest',
+                        'OverconstrainedZonalAllocationRequest', 'SkuNotAvailable', 'SpotAllocationFailed')
+GCP_CAPACITY_CODES = ('ZONE_RESOURCE_POOL_EXHAUSTED', 'ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS',
+                      'RESOURCE_POOL_EXHAUSTED', 'UNSUPPORTED_OPERATION')
+
+
+def aws_capacity_error(error):
+    response = getattr(error, 'response', None)
+    return isinstance(response, dict) and response.get('Error', {}).get('Code') in AWS_CAPACITY_CODES
+
+
+def azure_capacity_error(error):
+    code = getattr(getattr(error, 'error', None), 'code', None)
+    if code:
+        return code in AZURE_CAPACITY_CODES
+    # Long-running operation failures only carry the code in their message
+    message = str(error)
+    return any(f'({name})' in message or f"'{name}'" in message for name in AZURE_CAPACITY_CODES)
+
+
+def gcp_capacity_error(error):
+    # Operation errors are raised as "(CODE) message"
+    return any(f'({name})' in str(error) for name in GCP_CAPACITY_CODES)
+
+
+def launch_plan(sizes, placements, spot=False):
+    """
+    Launch attempts in order: every placement of a size before the next size, and with spot, every spot
+    attempt before falling back to on-demand.
+    :param list sizes: Instance sizes, the build size first
+    :param list placements: AWS subnet ids, Azure or GCP zones, None for the default placement
+    :return: List of {'size', 'placement', 'spot'}
+    """
+    sizes = list(dict.fromkeys(size for size in sizes if size))
+    placements = list(dict.fromkeys(placements)) or [None]
+    markets = [True, False] if spot else [False]
+    return [{'size': size, 'placement': placement, 'spot': market}
+            for market in markets for size in sizes for placement in placements]
+
+
+class Launcher(object):
+    def __init__(self, logger, plan, capacity_error, rounds=ROUNDS, delay=ROUND_DELAY):
+        """
+        Launch an instance with the first attempt of the plan that has capacity.
+        :param list plan: Attempts from launch_plan()
+        :param capacity_error: Callable(exception) telling whether another attempt may succeed
+        """
+        self.logger = logger
+        self.plan = plan
+        self.capacity_error = capacity_error
+        self.rounds = rounds
+        self.delay = delay
+        # Every attempt with its latency and error, recorded in the timing history by the build
+        self.attempts = []
+
+    def run(self, launch):
+        """
+        :param launch: Callable(attempt) creating the instance, raising on failure
+        :return: (attempt that succeeded, value returned by launch)
+        """
+        for round_number in range(1, self.rounds + 1):
+            for attempt in self.plan:
+                name = f'{attempt["size"]}{" spot" if attempt["spot"] else ""}' + \
+                       (f' in {attempt["placement"]}' if attempt['placement'] else '')
+                self.logger.info(f'Launching {name} ...')
+                started = time.time()
+                try:
+                    result = launch(attempt)
+                except Exception as e:
+                    self.attempts.append(dict(attempt, started=started, seconds=time.time() - started, error=str(e)))
+                    if not self.capacity_error(e):
+                        raise
+                    self.logger.warning(f'No capacity for {name}: {str(e)}')
+                    continue
+                self.attempts.append(dict(attempt, started=started, seconds=time.time() - started, error=None))
+                self.logger.info(f'Launched {name} in {int(time.time() - started)}s, '
+                                 f'attempt {len(self.attempts)}.')
+                return attempt, result
+            if round_number < self.rounds:
+                self.logger.warning(f'No capacity in round {round_number} of {self.rounds}, '
+                                    f'retrying in {self.delay}s.')
+                time.sleep(self.delay)
+        raise Exception(f'No capacity to launch the instance after {len(self.attempts)} attempt(s).')
@@ -0,0 +1,72 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Root device of the VM-Series AMIs
+ROOT_DEVICE = '/dev/xvda'
+# EBS volume types taking provisioned IOPS, and throughput in MiB/s
+IOPS_VOLUME_TYPES = ('gp3', 'io1', 'io2')
+THROUGHPUT_VOLUME_TYPES = ('gp3',)
+# gp3 baseline, included in its price. Custom AMIs are reset to it, the provisioned IOPS and throughput of the
+# build volume would otherwise be billed on every instance launched from the image.
+BASELINE_IOPS = 3000
+BASELINE_THROUGHPUT = 125
+AZURE_DISK_TYPES = ('Standard_LRS', 'StandardSSD_LRS', 'Premium_LRS')
+GCP_DISK_TYPES = ('pd-standard', 'pd-balanced', 'pd-ssd', 'pd-extreme')
+
+
+def storage_profile(config):
+    """
+    Name of the build volume settings, recorded with the stage durations.
+    :return: e.g. "gp3/6000/500", "Premium_LRS", or "" for the image default.
+    """
+    volume_type = config.get('build_volume_type')
+    if not volume_type:
+        return ''
+    return '/'.join(str(value) for value in (volume_type, config.get('build_volume_iops'),
+                                             config.get('build_volume_throughput')) if value)
+
+
+def ebs_settings(volume_type, iops=None, throughput=None):
+    """
+    "Ebs" part of an EC2 block device mapping.
+    """
+    settings = {'DeleteOnTermination': True}
+    if volume_type:
+        settings['VolumeType'] = volume_type
+        if iops and volume_type in IOPS_VOLUME_TYPES:
+            settings['Iops'] = int(iops)
+        if throughput and volume_type in THROUGHPUT_VOLUME_TYPES:
+            settings['Throughput'] = int(throughput)
+    return settings
+
+
+def build_block_devices(config):
+    """
+    Block device mappings of the AWS build instance.
+    """
+    return [{'DeviceName': ROOT_DEVICE,
+             'Ebs': ebs_settings(config.get('build_volume_type'), config.get('build_volume_iops'),
+                                 config.get('build_volume_throughput'))}]
+
+
+def image_block_devices(config):
+    """
+    Block device mappings of the custom AMI, when the runtime volume type differs from the build one or the
+    build volume has provisioned IOPS or throughput, which are reset to the baseline.
+    """
+    volume_type = config.get('runtime_volume_type') or config.get('build_volume_type')
+    provisioned = config.get('build_volume_iops') or config.get('build_volume_throughput')
+    if not volume_type or (volume_type == config.get('build_volume_type') and not provisioned):
+        return []
+    return [{'DeviceName': ROOT_DEVICE, 'Ebs': ebs_settings(volume_type, BASELINE_IOPS, BASELINE_THROUGHPUT)}]
@@ -0,0 +1,169 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import threading
+import time
+
+# Default API calls per second per account and region, below the EC2 and ARM refill rates
+AWS_RATE = 20
+AZURE_RATE = 10
+# Per project, Compute Engine read and write limits are per minute and project
+GCP_RATE = 20
+# Attempts of a throttled or transient API call, with exponential backoff and full jitter
+MAX_ATTEMPTS = 10
+# The rate is halved on every throttle event, down to a tenth of the configured rate,
+# and recovers by a twentieth of it on every successful call
+BACKOFF = 0.5
+MIN_RATE_RATIO = 0.1
+RECOVERY = 0.05
+AWS_THROTTLE_CODES = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                      'RequestThrottled', 'RequestThrottledException', 'SlowDown', 'EC2ThrottledException')
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        """
+        Client-side rate limiter shared by threads. Callers reserve a token and sleep until it is due,
+        so they are served in order.
+        :param float rate: Calls per second, 0 for no limit
+        :param int burst: Calls allowed at once after an idle period, default one second worth of calls
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        :return: Seconds waited
+        """
+        if not self.max_rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.max_rate * MIN_RATE_RATIO, self.rate * BACKOFF)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY)
+
+
+class Throttle(object):
+    def __init__(self):
+        """
+        Process-wide token buckets per account and region, shared by the concurrent builds, and statistics
+        of the throttle events.
+        """
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.stats = {}
+
+    def bucket(self, name, rate):
+        """
+        :param str name: Account and region, e.g. "aws/<access key id>/us-west-1"
+        :param float rate: Calls per second, used when the bucket is created
+        """
+        with self.lock:
+            if name not in self.buckets:
+                self.buckets[name] = TokenBucket(rate)
+            return self.buckets[name]
+
+    def count(self, name, event, value=1):
+        with self.lock:
+            stats = self.stats.setdefault(name, {'calls': 0, 'throttled': 0, 'errors': 0, 'waited': 0})
+            stats[event] = stats.get(event, 0) + value
+
+    def acquire(self, name):
+        waited = self.buckets[name].acquire()
+        self.count(name, 'calls')
+        if waited:
+            self.count(name, 'waited', waited)
+
+    def throttled(self, name):
+        self.buckets[name].throttled()
+        self.count(name, 'throttled')
+
+    def report(self, logger):
+        with self.lock:
+            stats = {name: dict(values) for name, values in self.stats.items()}
+            rates = {name: bucket.rate for name, bucket in self.buckets.items()}
+        for name, values in sorted(stats.items()):
+            logger.info(f'API throttle {name}: {values["calls"]} calls, {values["throttled"]} throttled, '
+                        f'{values["errors"]} other errors, {values["waited"]:.1f}s waited, '
+                        f'rate now {rates.get(name, 0):.1f}/s')
+        return stats
+
+
+THROTTLE = Throttle()
+
+
+def account_name(provider, account, region=None):
+    """
+    Token bucket name of an account, e.g. "aws/AKIAIOSF-3f2a9c1d/us-west-1". The name is logged, so only the
+    first characters of the account are kept, followed by a digest of the whole account: accounts sharing a
+    prefix get their own bucket.
+    """
+    account = str(account)
+    name = f'{provider}/{account[:8]}-{hashlib.sha256(account.encode("utf-8")).hexdigest()[:8]}'
+    return f'{name}/{region}' if region else name
+
+
+def aws_retry_config():
+    """
+    botocore "retries" settings: standard mode retries throttling and transient errors with exponential
+    backoff and full jitter.
+    """
+    return {'mode': 'standard', 'max_attempts': MAX_ATTEMPTS}
+
+
+def throttle_aws_client(client, config, region):
+    """
+    Send every request of a boto3 client, including retries and waiter polls, through the token bucket
+    of its account and region.
+    """
+    name = account_name('aws', config['aws_access_key_id'], region)
+    THROTTLE.bucket(name, config.get('api_rate_limit') or AWS_RATE)
+
+    def before_send(**kwargs):
+        THROTTLE.acquire(name)
+
+    def needs_retry(response=None, caught_exception=None, attempts=None, **kwargs):
+        code = response[1].get('Error', {}).get('Code') if response else None
+        if code in AWS_THROTTLE_CODES:
+            THROTTLE.throttled(name)
+        elif code or caught_exception is not None:
+            # Retried by botocore when transient, e.g. a 5xx or a connection error
+            THROTTLE.count(name, 'errors')
+
+    def after_call(http_response=None, **kwargs):
+        if http_response is not None and http_response.status_code < 400:
+            THROTTLE.buckets[name].succeeded()
+
+    client.meta.events.register('before-send', before_send)
+    client.meta.events.register('needs-retry', needs_retry)
+    client.meta.events.register('after-call', after_call)
+    return client
@@ -0,0 +1,281 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import codecs
+import re
+import time
+
+import paramiko
+
+from lib.pandevice import Output, parse_output, RESTART, RETRY, JOB_RETRY, JOB_INTERVAL, MIN_TIMEOUT, \
+    SIGNAL_RETRY
+
+# Output kept per session before a command fails, so a runaway command cannot exhaust memory
+MAX_OUTPUT = 8 * 1024 * 1024
+# Expected patterns are only searched for at the end of the output
+SEARCH_WINDOW = 4096
+RECV_SIZE = 32768
+BANNER_TIMEOUT = 60
+CONNECT_CONCURRENCY = 10
+MORE = '--(more)--'
+
+
+class AsyncPanosDevice(object):
+    def __init__(self, logger, **kwargs):
+        """
+        PanosDevice driven by an asyncio event loop. Paramiko channels are watched with loop.add_reader(),
+        so waiting for output does not need a thread per device. Takes the same arguments as PanosDevice.
+        Call "await device.connect()" before use.
+        """
+        self._kwargs = kwargs
+        self.host = kwargs.get('host')
+        self.logger = logger
+        self.connected = 0
+        self.timings = kwargs.get('timings', None)
+        self.boot_signal = kwargs.get('boot_signal', None)
+        self.min_timeout = MIN_TIMEOUT
+        if self.timings:
+            self.min_timeout = self.timings.timeout('command', 'cli', MIN_TIMEOUT, pct=99, margin=3, floor=30)
+        self.prompt = "> "
+        self.response = ''
+        self.client = None
+        self.channel = None
+        self._reset_buffer()
+        self._data = None
+        self._eof = False
+
+    def _reset_buffer(self):
+        self._chunks = []
+        self._size = 0
+        self._tail = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def _open(self):
+        # Blocking handshake, run in the default executor
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        if self._kwargs.get('ssh_key_file'):
+            client.connect(hostname=self.host, port=self._kwargs.get('port', 22), username=self._kwargs['user'],
+                           key_filename=self._kwargs['ssh_key_file'])
+        else:
+            client.connect(hostname=self.host, port=self._kwargs.get('port', 22), username=self._kwargs['user'],
+                           password=self._kwargs.get('password'))
+        channel = client.invoke_shell(width=160)
+        return client, channel
+
+    async def connect(self):
+        loop = asyncio.get_event_loop()
+        self.logger.info(f'*** Connecting to device {self.host} ***')
+        try:
+            self.client, self.channel = await loop.run_in_executor(None, self._open)
+        except Exception as error:
+            raise Exception(f'Cannot create a SSH connection to Device {self.host}: {error}: '
+                            f'username={self._kwargs.get("user")}')
+        self._reset_buffer()
+        self._eof = False
+        self._data = asyncio.Event()
+        loop.add_reader(self.channel.fileno(), self._on_readable)
+        found, _ = await self._expect(r'(\$|>|#|%)', BANNER_TIMEOUT)
+        if not found:
+            await self.close()
+            raise Exception(f'Cannot create a SSH connection to Device {self.host}: no prompt')
+        self.connected = 1
+        self.logger.info("*** Connection successful ***")
+        self.prompt = "> "
+        await self._setup()
+        return self
+
+    def _on_readable(self):
+        while self.channel.recv_ready():
+            text = self._decoder.decode(self.channel.recv(RECV_SIZE))
+            self._chunks.append(text)
+            self._size += len(text)
+            self._tail = (self._tail + text)[-SEARCH_WINDOW:]
+        if self.channel.eof_received or self.channel.closed:
+            self._eof = True
+            asyncio.get_event_loop().remove_reader(self.channel.fileno())
+        self._data.set()
+
+    def _take(self):
+        text = ''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        self._tail = ''
+        return text
+
+    async def _expect(self, expected, timeout):
+        """
+        Wait until the output ends with the expected pattern or a "--(more)--" page marker.
+        :return: (True if seen before the timeout, output received)
+        """
+        if isinstance(expected, list):
+            expected = '|'.join(expected)
+        regex = re.compile(r'{0}\s?$'.format(expected))
+        deadline = time.time() + timeout
+        while True:
+            if regex.search(self._tail) or self._tail.rstrip().endswith(MORE):
+                return True, self._take()
+            if self._size > MAX_OUTPUT:
+                self._take()
+                raise Exception(f'Output of device {self.host} exceeds {MAX_OUTPUT} bytes.')
+            remaining = deadline - time.time()
+            if self._eof or remaining <= 0:
+                return False, self._take()
+            self._data.clear()
+            try:
+                await asyncio.wait_for(self._data.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _setup(self):
+        await self.exec(command='set cli scripting-mode on')
+        await self.exec(command='set cli confirmation-prompt off')
+        await self.exec(command='set cli terminal width 500')
+        output = await self.exec(command='set cli terminal height 500')
+        self.prompt = output.response().rsplit(' ')[0]
+
+    async def execute(self, command, pattern=None, timeout=300, raw_output=False, no_response=False):
+        """
+        Same semantics as Handle.execute_command().
+        :return: Index of the matched pattern or -1.
+        """
+        pattern = pattern or self.prompt
+        if isinstance(pattern, str):
+            pattern = [pattern]
+        timeout = max(timeout, self.min_timeout)
+        started = time.time()
+        self.logger.info("Command: " + command + '\n')
+        self._take()
+        self.channel.sendall(command + '\n')
+        if no_response:
+            self.response = ''
+            return 1
+        output, resp = await self._expect(pattern, timeout)
+        response = ''
+        while MORE in resp:
+            response += re.sub('\n--\\(more\\)--', '', resp, 1)
+            self.channel.sendall('\r\n')
+            output, resp = await self._expect(pattern, timeout)
+        response += resp
+        found, response = parse_output(command, pattern, response, output, raw_output)
+        if not output:
+            self.logger.info(f"Sent '{command}' to {self.host}, expected '{','.join(pattern)}', "
+                             f"but received:\n'{response}'")
+        elif self.timings:
+            self.timings.record('command', 'cli', time.time() - started, started)
+        self.response = response
+        self.logger.info("Output: \n" + response + "\n")
+        return found
+
+    async def exec(self, command, timeout=None, **kwargs):
+        if not command:
+            raise Exception('Command for device not specified')
+        if timeout:
+            kwargs['timeout'] = timeout
+        if await self.execute(command, **kwargs) == -1:
+            raise Exception('Timeout seen while retrieving output')
+        return Output(response=self.response, status=True)
+
+    async def check_job(self, job_id, name='job'):
+        started = time.time()
+        output = (await self.exec(f'show jobs id {job_id}')).response()
+        if 'not found' in output:
+            raise Exception(f'Job with job id {job_id} not created.')
+        interval = JOB_INTERVAL
+        timeout = JOB_RETRY * JOB_INTERVAL + 10
+        if self.timings:
+            interval = self.timings.poll_interval('job', name, JOB_INTERVAL)
+            timeout = self.timings.timeout('job', name, timeout)
+        await asyncio.sleep(min(10, interval))
+        while time.time() - started <= timeout:
+            output = (await self.exec(f'show jobs id {job_id}')).response()
+            if 'FIN' in output:
+                self.logger.info(f'*** Job {job_id} complete. ***')
+                if self.timings:
+                    self.timings.record('job', name, time.time() - started, started)
+                await asyncio.sleep(10)
+                return True
+            elif 'PEND' in output:
+                self.logger.info(f'Job {job_id} is incomplete. Waiting for {int(interval)} seconds before retrying.')
+                await asyncio.sleep(interval)
+            else:
+                break
+        raise Exception(f'Unable to complete job with job id {job_id}')
+
+    async def restart_system(self):
+        try:
+            await self.exec(command='request restart system', pattern=['NOW!', 'Broadcast message from root'])
+        except Exception as e:
+            if 'Timeout seen while retrieving output' in str(e):
+                self.logger.info('Device is now rebooting.')
+                await self.close()
+            else:
+                raise Exception('Failed to reboot device.')
+        self.logger.info("Waiting for the device to restart...")
+        await self._wait_for_reboot('restart')
+
+    async def _wait_for_reboot(self, name):
+        """
+        Same waits as PanosDevice._wait_for_reboot(), without blocking the event loop.
+        """
+        started = time.time()
+        timeout = RESTART + RETRY * 2
+        first_wait = RESTART
+        interval = RETRY
+        if self.timings:
+            timeout = self.timings.timeout('reboot', name, timeout)
+        if self.boot_signal and \
+                await asyncio.get_event_loop().run_in_executor(None, self.boot_signal, timeout) is not None:
+            first_wait = 0
+            interval = SIGNAL_RETRY
+        elif self.timings and self.timings.percentile('reboot', name, 10) is not None:
+            first_wait = self.timings.percentile('reboot', name, 10) * 0.75
+            interval = self.timings.poll_interval('reboot', name, RETRY / 4)
+            self.logger.info(f'Expecting the device back in {int(first_wait)}s, giving up after {int(timeout)}s.')
+        await asyncio.sleep(first_wait)
+        while True:
+            try:
+                await self.connect()
+                break
+            except Exception:
+                if time.time() - started > timeout + RETRY:
+                    raise
+                self.logger.info(f'Device not back yet. Waiting {int(interval)}s before retrying.')
+                await asyncio.sleep(interval)
+        if self.timings:
+            self.timings.record('reboot', name, time.time() - started, started)
+
+    async def close(self):
+        if self.channel is not None:
+            if not self._eof:
+                asyncio.get_event_loop().remove_reader(self.channel.fileno())
+            self.channel.close()
+        if self.client is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self.client.close)
+        self.connected = 0
+        return True
+
+
+async def connect_all(devices, concurrency=CONNECT_CONCURRENCY):
+    """
+    Connect many devices, with at most "concurrency" SSH handshakes at once.
+    :return: List of results in the order of the devices: the device, or the exception raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect(device):
+        async with semaphore:
+            return await device.connect()
+    return await asyncio.gather(*[connect(device) for device in devices], return_exceptions=True)
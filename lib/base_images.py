@@ -0,0 +1,104 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import time
+
+from lib.release_watcher import version_key
+
+DEFAULT_SKU = 'byol'
+# Marketplace listings change a few times a month
+CACHE_TTL = 6 * 3600
+# Stages with nothing to do when the base image already runs the target PanOS version
+UPGRADE_STAGES = ['upgrade_panos']
+
+
+class BaseImageCache(object):
+    def __init__(self, logger, path, ttl=CACHE_TTL):
+        """
+        Marketplace image listings cached in a JSON file, shared by the builds of a machine.
+        :param str path: Cache file, created when missing
+        :param int ttl: Seconds a listing is used before it is fetched again
+        """
+        self.logger = logger
+        self.path = path
+        self.ttl = ttl
+
+    def _load(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        # Replaced at once, concurrent builds never read a partial file. The temporary file is unique to the
+        # call: the builds of the daemon are threads of one process.
+        directory, name = os.path.split(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix=f'{name}.', suffix='.tmp', delete=False) as file:
+            try:
+                json.dump(entries, file, indent=1)
+            except BaseException:
+                file.close()
+                os.remove(file.name)
+                raise
+        os.replace(file.name, self.path)
+
+    def get(self, key, fetch):
+        """
+        :param str key: Listing name, e.g. "aws/us-west-1/byol"
+        :param fetch: Callable returning the listing when the cached one is missing or expired
+        :return: List of images: {'id', 'version', 'name', 'created'}
+        """
+        entries = self._load()
+        entry = entries.get(key)
+        if entry and time.time() - entry['fetched'] < self.ttl:
+            self.logger.info(f'Using the cached marketplace images of {key} '
+                             f'({int((time.time() - entry["fetched"]) / 60)} min old).')
+            return entry['images']
+        try:
+            images = fetch()
+        except Exception as e:
+            if not entry:
+                raise
+            self.logger.warning(f'Unable to list the marketplace images of {key}, using an expired listing: {e}')
+            return entry['images']
+        entries[key] = {'fetched': time.time(), 'images': images}
+        try:
+            self._save(entries)
+        except OSError as e:
+            self.logger.warning(f'Unable to save the marketplace images cache {self.path}: {e}')
+        return images
+
+
+def select_base_image(images, target):
+    """
+    Newest image whose PanOS version is the closest to the target without being above it: PanOS is only
+    upgraded by the build. The plugin ships with PanOS, the closest PanOS has the closest plugin.
+    :param str target: PanOS version, e.g. "10.0.3"
+    :return: Image or None when every image runs a newer PanOS
+    """
+    eligible = [image for image in images if version_key(image['version']) <= version_key(target)]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda image: (version_key(image['version']), image.get('created') or ''))
+
+
+def skipped_stages(base_version, target):
+    """
+    :return: Stages with nothing to do when starting from base_version
+    """
+    return list(UPGRADE_STAGES) if version_key(base_version) == version_key(target) else []
@@ -0,0 +1,192 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = 'builds.db'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FIELDS = ('id', 'spec', 'spec_hash', 'provider', 'region', 'priority', 'state', 'submitted', 'started',
+          'finished', 'error', 'result', 'cancel_requested', 'resources')
+
+
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def spec_location(spec):
+    """
+    Provider and region a build spec (a config.yaml mapping) runs in.
+    """
+    provider = str(spec.get('cloud-provider', '')).lower()
+    region = spec.get({'aws': 'region', 'gcp': 'zone'}.get(provider, 'location'))
+    return provider, str(region or '')
+
+
+def build_name(build):
+    """
+    Build id a queued build runs with, naming its cloud resources, e.g. "q12".
+    """
+    return f'q{build["id"]}'
+
+
+class BuildQueue(object):
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        Persistent build queue
+        :param str path: sqlite database file
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS builds ('
+                            'id INTEGER PRIMARY KEY AUTOINCREMENT, spec TEXT, spec_hash TEXT, provider TEXT, '
+                            'region TEXT, priority INTEGER, state TEXT, submitted REAL, started REAL, '
+                            'finished REAL, error TEXT, result TEXT, cancel_requested INTEGER DEFAULT 0, '
+                            'resources TEXT)')
+            columns = [row['name'] for row in self.db.execute('PRAGMA table_info(builds)')]
+            if 'resources' not in columns:
+                # Queue created before the cloud resources of running builds were recorded
+                self.db.execute('ALTER TABLE builds ADD COLUMN resources TEXT')
+            self.db.execute('CREATE INDEX IF NOT EXISTS builds_state ON builds (state, priority)')
+
+    def _row(self, row):
+        if row is None:
+            return None
+        build = {field: row[field] for field in FIELDS}
+        build['spec'] = json.loads(build['spec'])
+        build['result'] = json.loads(build['result']) if build['result'] else None
+        build['resources'] = json.loads(build['resources']) if build['resources'] else []
+        return build
+
+    def submit(self, spec, priority=0):
+        """
+        Queue a build. An identical spec that is still queued is not queued twice.
+        :return: (build id, True if an existing queued build was returned)
+        """
+        digest = spec_hash(spec)
+        provider, region = spec_location(spec)
+        with self.lock, self.db:
+            row = self.db.execute('SELECT id, priority FROM builds WHERE spec_hash = ? AND state = ?',
+                                  [digest, QUEUED]).fetchone()
+            if row:
+                if priority > row['priority']:
+                    self.db.execute('UPDATE builds SET priority = ? WHERE id = ?', [priority, row['id']])
+                return row['id'], True
+            cursor = self.db.execute('INSERT INTO builds (spec, spec_hash, provider, region, priority, state, '
+                                     'submitted) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     [json.dumps(spec, sort_keys=True), digest, provider, region, priority,
+                                      QUEUED, time.time()])
+            return cursor.lastrowid, False
+
+    def get(self, build_id):
+        with self.lock:
+            return self._row(self.db.execute('SELECT * FROM builds WHERE id = ?', [build_id]).fetchone())
+
+    def list(self, states=None, limit=100):
+        query = 'SELECT * FROM builds'
+        params = []
+        if states:
+            query += f' WHERE state IN ({", ".join("?" * len(states))})'
+            params.extend(states)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        with self.lock:
+            return [self._row(row) for row in self.db.execute(query, params)]
+
+    def claim(self, allowed):
+        """
+        Mark the highest priority queued build accepted by allowed(provider, region) as running.
+        :return: Build dict or None.
+        """
+        with self.lock, self.db:
+            rows = self.db.execute('SELECT * FROM builds WHERE state = ? ORDER BY priority DESC, id',
+                                   [QUEUED]).fetchall()
+            for row in rows:
+                if allowed(row['provider'], row['region']):
+                    self.db.execute('UPDATE builds SET state = ?, started = ? WHERE id = ?',
+                                    [RUNNING, time.time(), row['id']])
+                    return self._row(row)
+        return None
+
+    def finish(self, build_id, state, error=None, result=None):
+        with self.lock, self.db:
+            self.db.execute('UPDATE builds SET state = ?, finished = ?, error = ?, result = ? WHERE id = ?',
+                            [state, time.time(), error, json.dumps(result) if result is not None else None,
+                             build_id])
+
+    def cancel(self, build_id):
+        """
+        Cancel a queued build, or ask a running build to stop before its next stage.
+        :return: New state of the build or None if it does not exist.
+        """
+        with self.lock, self.db:
+            row = self.db.execute('SELECT state FROM builds WHERE id = ?', [build_id]).fetchone()
+            if row is None:
+                return None
+            if row['state'] == QUEUED:
+                self.db.execute('UPDATE builds SET state = ?, finished = ? WHERE id = ?',
+                                [CANCELLED, time.time(), build_id])
+                return CANCELLED
+            if row['state'] == RUNNING:
+                self.db.execute('UPDATE builds SET cancel_requested = 1 WHERE id = ?', [build_id])
+            return row['state']
+
+    def cancel_requested(self, build_id):
+        with self.lock:
+            row = self.db.execute('SELECT cancel_requested FROM builds WHERE id = ?', [build_id]).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def track(self, build_id, resource):
+        """
+        Record a cloud resource created by a running build, so that it is deleted if the daemon stops first.
+        :param dict resource: Resource reported by the cloud client
+        """
+        with self.lock, self.db:
+            row = self.db.execute('SELECT resources FROM builds WHERE id = ?', [build_id]).fetchone()
+            resources = json.loads(row['resources']) if row and row['resources'] else []
+            if resource not in resources:
+                resources.append(resource)
+                self.db.execute('UPDATE builds SET resources = ? WHERE id = ?', [json.dumps(resources), build_id])
+
+    def recover(self, cleanup=None):
+        """
+        Requeue builds left running by a previous daemon process, once the cloud resources they created are
+        deleted.
+        :param cleanup: Callable(build) deleting build['resources']
+        :return: Number of requeued builds.
+        """
+        with self.lock:
+            interrupted = [self._row(row) for row in self.db.execute('SELECT * FROM builds WHERE state = ?',
+                                                                     [RUNNING])]
+        for build in interrupted:
+            if build['resources'] and cleanup:
+                cleanup(build)
+        with self.lock, self.db:
+            cursor = self.db.execute('UPDATE builds SET state = ?, started = NULL, resources = NULL WHERE state = ? '
+                                     'AND cancel_requested = 0', [QUEUED, RUNNING])
+            self.db.execute('UPDATE builds SET state = ?, finished = ? WHERE state = ?',
+                            [CANCELLED, time.time(), RUNNING])
+            return cursor.rowcount
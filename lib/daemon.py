@@ -0,0 +1,245 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import re
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from lib.build_queue import SUCCEEDED, FAILED, CANCELLED, build_name
+from lib.script_logger import Logger
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8770
+POLL = 5
+SECRET_KEYS = ('secret-key-id', 'secret-access-key', 'client-secret', 'auth-code', 'delicensing-api-key',
+               'bootstrap-storage')
+
+
+def redact(build):
+    if build is None:
+        return None
+    build = dict(build)
+    build['spec'] = {key: ('***' if key in SECRET_KEYS and value else value)
+                     for key, value in build['spec'].items()}
+    return build
+
+
+class ImageFactory(object):
+    def __init__(self, logger, queue, workers=2, provider_limits=None, region_limits=None, poll=POLL):
+        """
+        Long-running builder draining a BuildQueue
+        :param logger: Daemon logger. Every build gets its own log file.
+        :param BuildQueue queue: Persistent build queue
+        :param int workers: Number of builds running at once
+        :param dict provider_limits: Maximum running builds per cloud provider, e.g. {"azure": 1}
+        :param dict region_limits: Maximum running builds per region/location, e.g. {"us-west-1": 2}
+        :param int poll: Seconds an idle worker waits before looking at the queue again
+        """
+        self.logger = logger
+        self.queue = queue
+        self.workers = workers
+        self.provider_limits = provider_limits or {}
+        self.region_limits = region_limits or {}
+        self.poll = poll
+        self.lock = threading.Lock()
+        self.running = {}
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def _allowed(self, provider, region):
+        providers = [build['provider'] for build in self.running.values()]
+        regions = [(build['provider'], build['region']) for build in self.running.values()]
+        if provider in self.provider_limits and providers.count(provider) >= self.provider_limits[provider]:
+            return False
+        if region in self.region_limits and regions.count((provider, region)) >= self.region_limits[region]:
+            return False
+        return True
+
+    def _worker(self):
+        while not self.stopping.is_set():
+            with self.lock:
+                build = self.queue.claim(self._allowed)
+                if build:
+                    self.running[build['id']] = build
+            if not build:
+                self.stopping.wait(self.poll)
+                continue
+            try:
+                self._run(build)
+            finally:
+                with self.lock:
+                    self.running.pop(build['id'], None)
+
+    def _run(self, build):
+        logger = Logger(name=f'build-{build["id"]}', level='DEBUG', suffix=f'build-{build["id"]}')
+        try:
+            self._build(build, logger)
+        finally:
+            # One log file per build, a long-running daemon would run out of file descriptors
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+
+    def _build(self, build, logger):
+        build_id = build['id']
+        self.logger.info(f'*** Starting build {build_id} ({build["provider"]}/{build["region"]}), '
+                         f'log: {logger.get_log_location()} ***')
+        spec = self._spec(build)
+        result = {'log': logger.get_log_location()}
+        try:
+            # Imported here so "start.py --help" and the CLI client do not load the cloud SDKs
+            from lib.utils import CustomImage
+
+            lib = CustomImage(logger, None, spec, cancelled=lambda: self.queue.cancel_requested(build_id),
+                              track=lambda resource: self.queue.track(build_id, resource))
+            succeeded = lib.build()
+            error = lib.error
+            result.update(lib.result)
+        except Exception as e:
+            succeeded = False
+            error = str(e)
+        if succeeded:
+            state = SUCCEEDED
+        elif self.queue.cancel_requested(build_id):
+            state = CANCELLED
+        else:
+            state = FAILED
+        self.queue.finish(build_id, state, error=error, result=result)
+        self.logger.info(f'*** Build {build_id} {state} ***')
+
+    def _spec(self, build):
+        spec = dict(build['spec'])
+        spec['build-id'] = build_name(build)
+        return spec
+
+    def _cleanup(self, build):
+        """
+        Delete the instances, networks and fork images of a build interrupted by the previous daemon run.
+        """
+        self.logger.info(f'*** Deleting {len(build["resources"])} cloud resource(s) of interrupted build '
+                         f'{build["id"]} ***')
+        try:
+            from lib.utils import CustomImage
+
+            CustomImage(self.logger, None, self._spec(build)).delete_resources(build['resources'])
+        except Exception as e:
+            self.logger.error(f'Unable to delete the cloud resources of build {build["id"]}: {e}')
+
+    def start(self):
+        requeued = self.queue.recover(self._cleanup)
+        if requeued:
+            self.logger.info(f'Requeued {requeued} build(s) interrupted by the previous daemon run.')
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.logger.info(f'*** Image factory started with {self.workers} worker slot(s) ***')
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+    def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = FactoryServer((host, port), FactoryRequestHandler)
+        server.factory = self
+        self.start()
+        self.logger.info(f'*** Listening on http://{host}:{port} ***')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.logger.info('*** Shutting down. Running builds finish first; queued builds are kept. ***')
+        finally:
+            server.server_close()
+            self.stop()
+
+
+class FactoryServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FactoryRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST   /builds       {"spec": {config.yaml keys}, "priority": 0}
+    GET    /builds       ?state=queued
+    GET    /builds/<id>
+    DELETE /builds/<id>
+    """
+
+    def _reply(self, status, body):
+        data = json.dumps(body, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _build_id(self):
+        match = re.match(r'^/builds/(\d+)$', self.path)
+        return int(match.group(1)) if match else None
+
+    def do_POST(self):
+        if self.path != '/builds':
+            return self._reply(404, {'error': 'Not found'})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            spec = body['spec']
+            priority = int(body.get('priority', 0))
+        except Exception as e:
+            return self._reply(400, {'error': f'Invalid request: {e}'})
+        from lib.preflight import validate_schema
+
+        problems = validate_schema(spec)
+        if problems:
+            return self._reply(400, {'error': 'Invalid spec', 'problems': problems})
+        build_id, duplicate = self.server.factory.queue.submit(spec, priority)
+        self._reply(200 if duplicate else 201, {'id': build_id, 'duplicate': duplicate})
+
+    def do_GET(self):
+        queue = self.server.factory.queue
+        if self.path.startswith('/builds?state=') or self.path == '/builds':
+            states = self.path.split('=', 1)[1].split(',') if '=' in self.path else None
+            return self._reply(200, [redact(build) for build in queue.list(states)])
+        build_id = self._build_id()
+        build = queue.get(build_id) if build_id else None
+        if build is None:
+            return self._reply(404, {'error': 'Not found'})
+        self._reply(200, redact(build))
+
+    def do_DELETE(self):
+        build_id = self._build_id()
+        state = self.server.factory.queue.cancel(build_id) if build_id else None
+        if state is None:
+            return self._reply(404, {'error': 'Not found'})
+        self._reply(200, {'id': build_id, 'state': state})
+
+    def log_message(self, format, *args):
+        self.server.factory.logger.debug('API: ' + format % args)
+
+
+def request(url, method='GET', body=None):
+    """
+    Minimal client for the image factory API, used by the start.py sub-commands.
+    """
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
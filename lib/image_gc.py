@@ -0,0 +1,144 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudclient.throttle import TokenBucket
+
+KEEP_LAST = 3
+# Leftovers of failed builds, deleted whatever their age once no build can still be using them
+LEFTOVER_KINDS = ('disk', 'nic', 'public ip')
+# Leftovers younger than this may belong to a build started outside the daemon
+LEFTOVER_MIN_AGE = 6 * 3600
+WORKERS = 8
+# Delete calls per second, cloud APIs throttle bulk deletes
+RATE = 5
+DAY = 86400
+
+
+def owned(image, builds):
+    """
+    Whether a leftover belongs to one of builds, including its variants, e.g. "q12-ha" of build "q12".
+    """
+    build_id = str(image.get('build_id') or '')
+    return any(build_id == str(build) or build_id.startswith(f'{build}-') for build in builds)
+
+
+def select(images, keep_last=KEEP_LAST, max_age_days=None, keep=(), now=None, builds=()):
+    """
+    Apply the retention policy. Per region and group (PanOS version and SKU), the newest keep_last
+    images are kept, unless older than max_age_days. Images in use or listed in keep are always kept.
+    Leftover disks and network resources are deleted once older than LEFTOVER_MIN_AGE, unless a queued or
+    running build owns them.
+    :param list builds: Build ids of the queued and running builds
+    :return: List of (image, reason kept or None if deleted).
+    """
+    now = now or time.time()
+    keep = set(keep)
+    groups = {}
+    for image in images:
+        groups.setdefault((image['region'], image['group']), []).append(image)
+    decisions = []
+    for (region, group), members in sorted(groups.items()):
+        # Images without a known creation time are ranked oldest and never deleted for their age
+        members.sort(key=lambda image: image['created'] or 0, reverse=True)
+        for rank, image in enumerate(members):
+            age = (now - image['created']) / DAY if image['created'] else None
+            if image['in_use']:
+                reason = 'in use'
+            elif image['id'] in keep or image['name'] in keep:
+                reason = 'kept explicitly'
+            elif image['kind'] in LEFTOVER_KINDS and owned(image, builds):
+                reason = 'build in progress'
+            elif image['kind'] in LEFTOVER_KINDS and image['created'] and now - image['created'] < LEFTOVER_MIN_AGE:
+                reason = 'recent'
+            elif image['kind'] in LEFTOVER_KINDS:
+                reason = None
+            elif max_age_days is not None and age is not None and age > max_age_days:
+                reason = None
+            elif rank < keep_last:
+                reason = f'newest {keep_last}'
+            else:
+                reason = None
+            decisions.append((image, reason))
+    return decisions
+
+
+class ImageGC(object):
+    def __init__(self, logger, cloud_client, regions, keep_last=KEEP_LAST, max_age_days=None, keep=(),
+                 dry_run=False, workers=WORKERS, rate=RATE, builds=()):
+        """
+        Delete old custom images and their snapshots or disks.
+        :param cloud_client: CloudAws or CloudAzure
+        :param list regions: Regions (AWS) or locations to clean up
+        :param bool dry_run: Only report what would be deleted
+        :param list builds: Build ids of the queued and running builds, whose leftovers are kept
+        """
+        self.logger = logger
+        self.cloud_client = cloud_client
+        self.regions = regions
+        self.keep_last = keep_last
+        self.max_age_days = max_age_days
+        self.keep = keep
+        self.dry_run = dry_run
+        self.builds = builds
+        self.workers = workers
+        # Evenly spaced deletions, no burst
+        self.limiter = TokenBucket(rate, burst=1)
+
+    def _list(self):
+        if self.cloud_client.name in ('azure', 'gcp'):
+            # Azure managed images live in the resource group and GCP images are global, whatever the location
+            return self.cloud_client.custom_images(None)
+        with ThreadPoolExecutor(max_workers=max(len(self.regions), 1)) as executor:
+            results = list(executor.map(self.cloud_client.custom_images, self.regions))
+        return [image for images in results for image in images]
+
+    def _delete(self, image):
+        self.limiter.acquire()
+        try:
+            self.cloud_client.delete_custom_image(image)
+            return None
+        except Exception as e:
+            self.logger.error(f'Unable to delete {image["name"]} ({image["id"]}) in {image["region"]}: {e}')
+            return str(e)
+
+    def run(self):
+        """
+        :return: (number of images deleted, GB reclaimed)
+        """
+        self.logger.info(f'*** Collecting Custom Images in {", ".join(self.regions)} ***')
+        decisions = select(self._list(), self.keep_last, self.max_age_days, self.keep, builds=self.builds)
+        doomed = [image for image, reason in decisions if reason is None]
+        errors = {}
+        if doomed and not self.dry_run:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                errors = dict(zip([image['id'] for image in doomed], executor.map(self._delete, doomed)))
+
+        action = 'would delete' if self.dry_run else 'deleted'
+        self.logger.info(f'{"REGION":<16} {"GROUP":<20} {"NAME":<48} {"SIZE":>6}  ACTION')
+        for image, reason in decisions:
+            if reason:
+                outcome = f'keep ({reason})'
+            else:
+                outcome = 'FAILED' if errors.get(image['id']) else action
+            self.logger.info(f'{image["region"]:<16} {image["group"]:<20} {image["name"]:<48} '
+                             f'{image["size_gb"]:>4}GB  {outcome}')
+        removed = [image for image in doomed if not errors.get(image['id'])]
+        reclaimed = sum(image['size_gb'] for image in removed)
+        self.logger.info(f'*** {len(removed)} image(s) {action}, {reclaimed} GB of storage reclaimed ***')
+        if any(errors.values()):
+            raise Exception(f'{len([error for error in errors.values() if error])} deletion(s) failed.')
+        return len(removed), reclaimed
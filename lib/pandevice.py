@@ -23,6 +23,79 @@ import paramiko
 
 RESTART = 660
 RETRY = 120
+JOB_RETRY = 25
+JOB_INTERVAL = 30
+MIN_TIMEOUT = 100
+SIGNAL_RETRY = 15
+BOOTSTRAP_RETRY = 10
+BOOTSTRAP_INTERVAL = 30
+# Configure mode commands pasted at once by load_config(), and the output of the rejected ones
+CONFIG_BATCH = 100
+COMMIT_TIMEOUT = 900
+CONFIG_ERRORS = ('Invalid syntax', 'Unknown command', 'Server error', 'Validation Error')
+
+
+def config_commands(path):
+    """
+    Configure mode commands of a file, one per line. Blank lines and "#" comments are ignored.
+    """
+    with open(path) as file:
+        lines = [line.strip() for line in file]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+# Configure mode keywords followed by a secret value, e.g. "set mgt-config users admin phash <hash>"
+SECRET_KEYWORDS = ('password', 'phash', 'passphrase', 'secret', 'shared-secret', 'key', 'auth-key', 'api-key',
+                   'bind-password', 'community-string', 'snmp-community-string', 'private-key')
+SECRET_VALUE = re.compile(r'(?<!\S)(?:' + '|'.join(re.escape(keyword) for keyword in SECRET_KEYWORDS) +
+                          r')\s+("[^"]*"|\S+)')
+
+
+def config_secrets(commands):
+    """
+    Secret values of configure mode commands, masked in transcripts.
+    """
+    secrets = set()
+    for command in commands:
+        for match in SECRET_VALUE.finditer(command):
+            secrets.add(match.group(1).strip('"'))
+    return sorted(secret for secret in secrets if secret)
+
+
+def cleanup_pattern(cmd):
+    """
+    Regex matching the echo of a command in the device output.
+    """
+    cmd_cleanup = cmd + '\s?\r{1,2}\n'
+    cmd_cleanup = re.sub('\$', '\\$', cmd_cleanup)
+    cmd_cleanup = re.sub('\|', '\\|', cmd_cleanup)
+    cmd_cleanup = re.sub('-', '\-', cmd_cleanup)
+    return cmd_cleanup
+
+
+def parse_output(cmd, pattern, response, output, raw_output=False):
+    """
+    Match and clean up the output of a command.
+    :param str cmd: Command sent
+    :param list pattern: Expected patterns
+    :param str response: Output received, pages joined
+    :param bool output: Whether one of the patterns was seen before the timeout
+    :param bool raw_output: Keep the command echo and the prompt
+    :return: (index of the matched pattern or -1, response)
+    """
+    found = -1
+    if not raw_output:
+        response = re.sub(cleanup_pattern(cmd), '', response)
+    if output:
+        for pat in pattern:
+            found += 1
+            if re.search(pat, response):
+                break
+    if not raw_output:
+        for pat in pattern:
+            response = re.sub('\n.*' + pat, '', response)
+        response = re.sub('\r\n$', '', response)
+    return found, response
 
 
 class PanosDevice(object):
@@ -31,6 +104,12 @@ class PanosDevice(object):
         self.host = kwargs.get('host')
         self.connected = 0
         self.logger = logger
+        self.timings = kwargs.get('timings', None)
+        # Callable(timeout) waiting for a cloud-side boot-complete signal, see CloudAws.wait_for_boot()
+        self.boot_signal = kwargs.get('boot_signal', None)
+        self.min_timeout = MIN_TIMEOUT
+        if self.timings:
+            self.min_timeout = self.timings.timeout('command', 'cli', MIN_TIMEOUT, pct=99, margin=3, floor=30)
         pkey = kwargs.get('ssh_key_file', None)
         password = kwargs.get('password', None)
         try:
@@ -38,13 +117,19 @@ class PanosDevice(object):
             if pkey:
                 self.handle = Handle(logger,
                                      host=self.host,
+                                     port=kwargs.get('port', 22),
                                      user=kwargs['user'],
-                                     ssh_key_file=pkey)
+                                     ssh_key_file=pkey,
+                                     recorder=kwargs.get('recorder'),
+                                     replay=kwargs.get('replay'))
             else:
                 self.handle = Handle(logger,
                                      host=self.host,
+                                     port=kwargs.get('port', 22),
                                      user=kwargs['user'],
-                                     password=password)
+                                     password=password,
+                                     recorder=kwargs.get('recorder'),
+                                     replay=kwargs.get('replay'))
         except ConnectionError:
             raise Exception("Cannot connect to Device %s" % self.host)
         self.connected = 1
@@ -69,7 +154,60 @@ class PanosDevice(object):
             raise Exception('"command" is mandatory for PanosDevice.execute()')
         kwargs['device'] = self
         kwargs['cmd'] = kwargs.pop('command')
-        return self.handle.execute_command(**kwargs)
+        kwargs.setdefault('min_timeout', self.min_timeout)
+        started = time.time()
+        found = self.handle.execute_command(**kwargs)
+        if self.timings and found != -1:
+            self.timings.record('command', 'cli', time.time() - started, started)
+        return found
+
+    def _wait_for_reboot(self, name):
+        """
+        Wait for the device to come back after a reboot and reconnect.
+        With a cloud-side boot signal, reconnect as soon as the console shows the boot finished.
+        Otherwise, without history this is the static RESTART wait plus one RETRY. With history
+        the first attempt is made before the fastest recorded reboots and then polled.
+        """
+        started = time.time()
+        timeout = RESTART + RETRY * 2
+        if self.timings:
+            timeout = self.timings.timeout('reboot', name, timeout)
+        if self.boot_signal and self.boot_signal(timeout) is not None:
+            # Booted (or the signal timed out): the management plane may still need a few seconds
+            while True:
+                try:
+                    self.__init__(self.logger, **self._kwargs)
+                    break
+                except:
+                    if time.time() - started > timeout + RETRY:
+                        raise
+                    self.logger.info(f'Device not back yet. Waiting {SIGNAL_RETRY}s before retrying.')
+                    time.sleep(SIGNAL_RETRY)
+        elif not self.timings or self.timings.percentile('reboot', name, 10) is None:
+            time.sleep(RESTART)
+            try:
+                self.__init__(self.logger, **self._kwargs)
+            except:
+                self.logger.error(f'Unable to connect via ssh. Waiting for {RETRY}s before retrying.')
+                time.sleep(RETRY)
+                self.__init__(self.logger, **self._kwargs)
+        else:
+            first_wait = self.timings.percentile('reboot', name, 10) * 0.75
+            interval = self.timings.poll_interval('reboot', name, RETRY / 4)
+            timeout = self.timings.timeout('reboot', name, RESTART + RETRY)
+            self.logger.info(f'Expecting the device back in {int(first_wait)}s, giving up after {int(timeout)}s.')
+            time.sleep(first_wait)
+            while True:
+                try:
+                    self.__init__(self.logger, **self._kwargs)
+                    break
+                except:
+                    if time.time() - started > timeout:
+                        raise
+                    self.logger.info(f'Device not back yet. Waiting {int(interval)}s before retrying.')
+                    time.sleep(interval)
+        if self.timings:
+            self.timings.record('reboot', name, time.time() - started, started)
 
     def exec(self, *args, **kwargs):
         if not kwargs and not args:
@@ -100,13 +238,7 @@ class PanosDevice(object):
             else:
                 raise Exception('Failed to reboot device.')
         self.logger.info("Waiting for the device to restart...")
-        time.sleep(RESTART)
-        try:
-            self.__init__(self.logger, **self._kwargs)
-        except:
-            self.logger.error('Unable to connect via ssh. Waiting for 2 minutes before retrying.')
-            time.sleep(RETRY)
-            self.__init__(self.logger, **self._kwargs)
+        self._wait_for_reboot('restart')
 
     def license(self, auth_code):
         if auth_code != '':
@@ -120,6 +252,25 @@ class PanosDevice(object):
         else:
             self.logger.info('*** No Auth-code provided. Licensing skipped ***')
 
+    def bootstrap_status(self):
+        """
+        Phases of the first boot bootstrap, as reported by "show system bootstrap status".
+        :return: Dict of phase name to status, e.g. {'Output Licenses': 'Success'}.
+        """
+        for _ in range(BOOTSTRAP_RETRY):
+            output = self.exec('show system bootstrap status').response()
+            status = {}
+            for line in output.splitlines():
+                columns = re.split(r'\s{2,}', line.strip())
+                if len(columns) < 2 or set(columns[0]) <= {'='} or columns[0] == 'Bootstrap Phase':
+                    continue
+                status[columns[0]] = columns[1]
+            if not any(state.lower() in ('in progress', 'pending') for state in status.values()):
+                return status
+            self.logger.info('Bootstrap is still in progress...')
+            time.sleep(BOOTSTRAP_INTERVAL)
+        raise Exception('Bootstrap did not complete.')
+
     def delicense(self, api_key):
         if api_key != '':
             self.logger.info('*** Delicensing VM-Series ***')
@@ -139,20 +290,16 @@ class PanosDevice(object):
             else:
                 raise Exception('Failed to reboot device.')
         self.logger.info("Waiting for the device to restart...")
-        time.sleep(RESTART)
-        try:
-            if cloud_provider.lower() == "azure":
-                time.sleep(RETRY)
-            else:
-                self.__init__(self.logger, **self._kwargs)
-        except:
-            self.logger.info('Unable to connect via ssh. Waiting for 2 minutes before retrying.')
-            time.sleep(RETRY)
-            if cloud_provider.lower() == "azure":
-                self.logger.info("*** Reboot after Private Data Reset Complete ***")
-                return
-            else:
-                self.__init__(self.logger, **self._kwargs)
+        if cloud_provider.lower() == "azure":
+            # The admin credentials are reset, so the device cannot be reconnected to
+            started = time.time()
+            if not self.boot_signal or self.boot_signal(RESTART + RETRY * 2) is None:
+                time.sleep(RESTART + RETRY)
+            if self.timings:
+                self.timings.record('reboot', 'private-data-reset', time.time() - started, started)
+            self.logger.info("*** Reboot after Private Data Reset Complete ***")
+            return
+        self._wait_for_reboot('private-data-reset')
 
     def config(self, **kwargs):
         exec_prompt = self.prompt
@@ -179,6 +326,45 @@ class PanosDevice(object):
         if get_prompt == -1:
             raise Exception('Unable to switch to op mode')
 
+    def load_config(self, commands, batch=CONFIG_BATCH):
+        """
+        Apply configure mode "set" commands with a single commit. Commands are pasted by batches, one round trip
+        per batch instead of one per command. The candidate configuration is compared with the running one
+        before and after the commit.
+        :param list commands: Configure mode commands
+        :return: {'commands', 'changes', 'commit_seconds'}
+        """
+        exec_prompt = self.prompt
+        self.prompt = self.prompt[:-1] + "#"
+        if self.execute(command='configure') == -1:
+            raise Exception('Unable to switch to configure mode')
+        try:
+            for index in range(0, len(commands), batch):
+                rejected = self.handle.send_batch(commands[index:index + batch], self.prompt, self.min_timeout)
+                if rejected:
+                    raise Exception(f'{len(rejected)} configuration command(s) rejected: ' + '; '.join(rejected))
+            if self.execute(command='show config diff') == -1:
+                raise Exception('Unable to compare the candidate configuration.')
+            changes = len([line for line in self.response.splitlines() if line[:1] in ('+', '-')])
+            if not changes:
+                self.logger.warning('The configuration commands change nothing.')
+            started = time.time()
+            if self.execute(command='commit', timeout=COMMIT_TIMEOUT) == -1 or \
+                    'Configuration committed successfully' not in self.response:
+                raise Exception('Unable to commit the configuration. ERROR: ' + self.response)
+            commit_seconds = time.time() - started
+            if self.timings:
+                self.timings.record('command', 'commit', commit_seconds, started)
+            if self.execute(command='show config diff') == -1 or \
+                    [line for line in self.response.splitlines() if line[:1] in ('+', '-')]:
+                raise Exception('The running configuration differs from the candidate after the commit.')
+        finally:
+            self.prompt = exec_prompt
+            self.execute(command='exit')
+        self.logger.info(f'*** {len(commands)} configuration command(s), {changes} change(s), '
+                         f'committed in {int(commit_seconds)}s ***')
+        return {'commands': len(commands), 'changes': changes, 'commit_seconds': round(commit_seconds, 1)}
+
     def verify_system(self):
         try:
             output = yaml.safe_load(self.exec('show system info').response())
@@ -191,6 +377,23 @@ class PanosDevice(object):
         self.logger.info('*** System Check Passed ***')
         return True
 
+    def versions(self):
+        """
+        Installed PanOS, plugin and content versions, as reported by "show system info".
+        """
+        try:
+            output = yaml.safe_load(self.exec('show system info').response())
+        except:
+            raise Exception('Unable to fetch system info.')
+        return {
+            'panos': output.get('sw-version'),
+            'plugin': output.get('vm_series'),
+            'content': output.get('app-version'),
+            'antivirus': output.get('av-version'),
+            'wildfire': output.get('wildfire-version'),
+            'gp-cvpn': output.get('global-protect-clientless-vpn-version'),
+        }
+
     def verify_versions(self, sw, plugin):
         try:
             output = yaml.safe_load(self.exec('show system info').response())
@@ -204,21 +407,27 @@ class PanosDevice(object):
         self.logger.info('*** Version Check Passed ***')
         return True
 
-    def check_job(self, job_id):
+    def check_job(self, job_id, name='job'):
+        started = time.time()
         output = self.exec(f'show jobs id {job_id}').response()
         if 'not found' in output:
             raise Exception(f'Job with job id {job_id} not created.')
-        time.sleep(10)
-        retry = 25
-        interval = 30
-        while retry >= 0:
+        interval = JOB_INTERVAL
+        timeout = JOB_RETRY * JOB_INTERVAL + 10
+        if self.timings:
+            interval = self.timings.poll_interval('job', name, JOB_INTERVAL)
+            timeout = self.timings.timeout('job', name, timeout)
+        time.sleep(min(10, interval))
+        while time.time() - started <= timeout:
             output = self.exec(f'show jobs id {job_id}').response()
             if 'FIN' in output:
                 self.logger.info(f'*** Job {job_id} complete. ***')
+                if self.timings:
+                    self.timings.record('job', name, time.time() - started, started)
                 time.sleep(10)
                 return True
             elif 'PEND' in output:
-                self.logger.info(f'Job {job_id} is incomplete. Waiting for {str(interval)} seconds before retrying.')
+                self.logger.info(f'Job {job_id} is incomplete. Waiting for {int(interval)} seconds before retrying.')
                 time.sleep(interval)
             else:
                 break
@@ -238,16 +447,25 @@ class Handle(paramiko.client.SSHClient):
         self.logger = logger
         host = kwargs.get('host')
         user = kwargs.get('user')
+        port = kwargs.get('port', 22)
         ssh_key_file = kwargs.get('ssh_key_file', None)
         password = kwargs.get('password', None)
+        # TranscriptRecorder recording the session, or Replay replaying a recorded session instead of connecting
+        recorder = kwargs.get('recorder', None)
+        replay = kwargs.get('replay', None)
         try:
             super(Handle, self).__init__()
-            self.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            if ssh_key_file:
-                self.connect(hostname=host, username=user, key_filename=ssh_key_file)
+            if replay:
+                ssh_h = replay.channel()
             else:
-                self.connect(hostname=host, username=user, password=password)
-            ssh_h = self.invoke_shell(width=160)
+                self.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                if ssh_key_file:
+                    self.connect(hostname=host, port=port, username=user, key_filename=ssh_key_file)
+                else:
+                    self.connect(hostname=host, port=port, username=user, password=password)
+                ssh_h = self.invoke_shell(width=160)
+                if recorder:
+                    ssh_h = recorder.channel(ssh_h, host)
             self.client = ssh_h
             all_data = []
             while True:
@@ -269,8 +487,9 @@ class Handle(paramiko.client.SSHClient):
         pattern = kwargs.get('pattern')
         device = kwargs['device']
         timeout = kwargs.get('timeout', 300)
-        if timeout < 100:
-            timeout = 100
+        min_timeout = kwargs.get('min_timeout', MIN_TIMEOUT)
+        if timeout < min_timeout:
+            timeout = min_timeout
         raw_output = kwargs.get('raw_output', False)
         if isinstance(pattern, str):
             pattern = [pattern]
@@ -282,10 +501,6 @@ class Handle(paramiko.client.SSHClient):
         cmd_send = cmd + '\n'
         if not hasattr(device, 'shelltype'):
             device.shelltype = 'sh'
-        cmd_cleanup = cmd + '\s?\r{1,2}\n'
-        cmd_cleanup = re.sub('\$', '\\$', cmd_cleanup)
-        cmd_cleanup = re.sub('\|', '\\|', cmd_cleanup)
-        cmd_cleanup = re.sub('-', '\-', cmd_cleanup)
         self.logger.info("Command: " + cmd_send)
         ssh_h.send(cmd_send)
         found = -1
@@ -304,27 +519,41 @@ class Handle(paramiko.client.SSHClient):
                                                     shell=device.shelltype,
                                                     timeout=timeout)
             response += resp
-            if not raw_output:
-                response = re.sub(cmd_cleanup, '', response)
+            found, response = parse_output(cmd, pattern, response, output, raw_output)
             if not output:
                 self.logger.info("Sent '%s' to %s, expected '%s', "
                                  "but received:\n'%s'" % (cmd, device.host,
                                                           pattern_new,
                                                           response))
-                found = -1
-            else:
-                for pat in pattern:
-                    found += 1
-                    if re.search(pat, response):
-                        break
-            if not raw_output:
-                for pat in pattern:
-                    response = re.sub('\n.*' + pat, '', response)
-                response = re.sub('\r\n$', '', response)
             device.response = response
             self.logger.info("Output: \n" + response + "\n")
         return found
 
+    def send_batch(self, commands, prompt, timeout):
+        """
+        Send commands at once and wait for one prompt per command.
+        :return: Commands whose output is an error, with the error
+        """
+        ssh_h = self.client
+        self.logger.info(f'Sending {len(commands)} command(s).')
+        ssh_h.send(''.join(command + '\n' for command in commands))
+        all_data = ''
+        started = time.time()
+        while all_data.count(prompt) < len(commands):
+            if time.time() - started > timeout:
+                raise Exception(f'Timeout seen while applying {len(commands)} command(s), '
+                                f'{all_data.count(prompt)} acknowledged.')
+            read, write, error = select([ssh_h], [], [], 1)
+            if read:
+                data = ssh_h.recv(65536)
+                if not data:
+                    raise Exception('Connection closed while applying the commands.')
+                all_data += data.decode('utf-8', 'replace')
+        # The output of every command ends with a prompt
+        outputs = all_data.split(prompt)[:len(commands)]
+        return [f'{command}: {" ".join(output.replace(command, "", 1).split())}'
+                for command, output in zip(commands, outputs) if any(error in output for error in CONFIG_ERRORS)]
+
     def expect_output(self, expected='\s\$', timeout=60, shell='sh'):
         time.sleep(0.5)
         timeout -= 2
@@ -352,6 +581,9 @@ class Handle(paramiko.client.SSHClient):
             sys.stdout.flush()
             if re.search(r'{0}\s?$'.format(expected), all_data):
                 break
+            # Paginated output does not end with the prompt, execute_command() requests the next page
+            if all_data.rstrip().endswith('--(more)--'):
+                break
             time_out += (end_time - start_time)
             if int(time_out) > timeout:
                 timeout_count = 1
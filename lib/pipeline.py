@@ -0,0 +1,238 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+MAX_WORKERS = 4
+
+
+class Stage(object):
+    def __init__(self, name, run, requires=(), locks=(), retries=0, retry_delay=30, optional=False,
+                 enabled=True, always=False):
+        """
+        Pipeline stage
+        :param str name: Stage name, also used for the timing history
+        :param run: Callable doing the work
+        :param requires: Names of the stages that must be finished first
+        :param locks: Resources used exclusively while running, e.g. "device" for the firewall CLI session
+        :param int retries: Extra attempts after a failure
+        :param int retry_delay: Seconds between attempts
+        :param bool optional: A failure is logged but does not fail the build or skip dependent stages
+        :param bool enabled: Disabled stages are treated as done without running
+        :param bool always: Run once the required stages finished, even if they failed (cleanup)
+        """
+        self.name = name
+        self.run = run
+        self.requires = list(requires)
+        self.locks = list(locks)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.optional = optional
+        self.enabled = enabled
+        self.always = always
+        self.state = PENDING if enabled else DONE
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return 0
+        return self.finished - self.started
+
+
+class Pipeline(object):
+    def __init__(self, logger, stages, context=None, max_workers=MAX_WORKERS):
+        """
+        Run stages concurrently as soon as their requirements are met and their locks are free.
+        :param logger: Logger
+        :param list stages: Stage objects
+        :param context: Callable(name) returning a context manager wrapped around every attempt
+        :param int max_workers: Stages running at once
+        """
+        self.logger = logger
+        self.stages = {stage.name: stage for stage in stages}
+        self.context = context or (lambda name: _no_context())
+        self.max_workers = max_workers
+        for stage in stages:
+            for required in stage.requires:
+                if required not in self.stages:
+                    raise Exception(f'Stage "{stage.name}" requires unknown stage "{required}".')
+
+    def _finished(self, stage):
+        return stage.state in (DONE, FAILED, SKIPPED)
+
+    def _satisfied(self, stage):
+        required = [self.stages[name] for name in stage.requires]
+        if stage.always:
+            return all(self._finished(requirement) for requirement in required)
+        return all(requirement.state == DONE or (requirement.state == FAILED and requirement.optional)
+                   for requirement in required)
+
+    def _blocked(self, stage):
+        return any(self.stages[name].state == SKIPPED or
+                   (self.stages[name].state == FAILED and not self.stages[name].optional)
+                   for name in stage.requires)
+
+    def _attempt(self, stage):
+        for attempt in range(stage.retries + 1):
+            try:
+                with self.context(stage.name):
+                    stage.run()
+                return
+            except Exception as e:
+                if attempt == stage.retries:
+                    raise
+                self.logger.warning(f'Stage {stage.name} failed ({e}). Retrying in {stage.retry_delay}s...')
+                time.sleep(stage.retry_delay)
+
+    def _execute(self, stage):
+        stage.started = time.time()
+        try:
+            self._attempt(stage)
+            stage.state = DONE
+        except Exception as e:
+            stage.error = str(e)
+            stage.state = FAILED
+        stage.finished = time.time()
+        return stage
+
+    def run(self):
+        """
+        :return: True when no mandatory stage failed.
+        """
+        failed = False
+        held = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                changed = False
+                for stage in self.stages.values():
+                    if stage.state != PENDING:
+                        continue
+                    if not stage.always and (failed or self._blocked(stage)):
+                        stage.state = SKIPPED
+                        changed = True
+                        continue
+                    if not self._satisfied(stage) or held.intersection(stage.locks):
+                        continue
+                    if len(running) >= self.max_workers:
+                        break
+                    stage.state = RUNNING
+                    held.update(stage.locks)
+                    running[executor.submit(self._execute, stage)] = stage
+                if not running:
+                    if changed:
+                        continue
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    held.difference_update(stage.locks)
+                    if stage.state == FAILED:
+                        self.logger.error(f'Stage {stage.name} failed: {stage.error}')
+                        if not stage.optional:
+                            failed = True
+        return not failed
+
+    @property
+    def error(self):
+        for stage in sorted(self.stages.values(), key=lambda stage: stage.started or 0):
+            if stage.state == FAILED and not stage.optional:
+                return f'{stage.name}: {stage.error}'
+        return None
+
+    def critical_path(self):
+        """
+        Critical path and slack computed from the measured durations of the stages that ran.
+        :return: (critical path stage names, total seconds, {stage name: slack seconds})
+        """
+        ran = [stage for stage in self.stages.values() if stage.started is not None]
+        names = {stage.name for stage in ran}
+        order = sorted(ran, key=lambda stage: stage.started)
+        earliest_finish = {}
+        for stage in order:
+            start = max([earliest_finish[name] for name in stage.requires if name in names] or [0])
+            earliest_finish[stage.name] = start + stage.duration
+        total = max(earliest_finish.values() or [0])
+        latest_finish = {}
+        for stage in reversed(order):
+            dependents = [other for other in ran if stage.name in other.requires]
+            latest_finish[stage.name] = min([latest_finish[other.name] - other.duration for other in dependents] or
+                                            [total])
+        slack = {stage.name: max(0, latest_finish[stage.name] - earliest_finish[stage.name]) for stage in ran}
+        path = [stage.name for stage in order if slack[stage.name] < 1]
+        return path, total, slack
+
+    def report(self):
+        path, total, slack = self.critical_path()
+        self.logger.info(f'*** Critical path: {int(total / 60)} min ***')
+        self.logger.info(' -> '.join(path))
+        self.logger.info(f'{"STAGE":<26} {"STATE":<8} {"DURATION":>9} {"SLACK":>7}')
+        for stage in sorted(self.stages.values(), key=lambda stage: stage.started or float('inf')):
+            if not stage.enabled:
+                continue
+            duration = f'{int(stage.duration)}s' if stage.started is not None else '-'
+            stage_slack = f'{int(slack[stage.name])}s' if stage.name in slack else '-'
+            self.logger.info(f'{stage.name:<26} {stage.state:<8} {duration:>9} {stage_slack:>7}')
+
+
+def ancestors(stages, name):
+    """
+    :return: Names of the stage and of all the stages it requires, directly or not.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    found = set()
+    pending = [name]
+    while pending:
+        current = pending.pop()
+        if current not in found:
+            found.add(current)
+            pending.extend(by_name[current].requires)
+    return found
+
+
+def subset(stages, names):
+    """
+    Keep the named stages, in the same order. A requirement on a dropped stage is replaced by the
+    requirements of that stage, so that the kept stages still run in the same order.
+    """
+    by_name = {stage.name: stage for stage in stages}
+
+    def kept(name):
+        if name in names:
+            return [name]
+        return [required for requirement in by_name[name].requires for required in kept(requirement)]
+
+    selected = [stage for stage in stages if stage.name in names]
+    for stage in selected:
+        requires = []
+        for requirement in stage.requires:
+            requires.extend(name for name in kept(requirement) if name not in requires)
+        stage.requires = requires
+    return selected
+
+
+@contextmanager
+def _no_context():
+    yield
@@ -0,0 +1,206 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudclient.cloud_client import provider_name, plugin_providers
+from cloudclient.storage import AZURE_DISK_TYPES, GCP_DISK_TYPES
+from lib.pandevice import config_commands
+
+SUPPORTED_PROVIDERS = ('aws', 'azure', 'gcp')
+
+REQUIRED_KEYS = {
+    'common': ['cloud-provider', 'software-version'],
+    'aws': ['secret-key-id', 'secret-access-key', 'region', 'ami-id', 'mgmt-subnet-id',
+            'sg-id', 'instance-type', 'key-pair-name', 'instance-pkey'],
+    'azure': ['subscription-id', 'tenant-id', 'client-id', 'client-secret', 'location',
+              'rg-name', 'vm-size', 'image-sku', 'image-version'],
+    'gcp': ['gcp-project', 'zone', 'machine-type', 'source-image', 'subnetworks', 'instance-pkey'],
+}
+
+BOOLEAN_KEYS = ['content-upgrade', 'antivirus-upgrade', 'global-protect-cvpn-upgrade', 'wildfire-upgrade',
+                'bootstrap', 'spot']
+
+# Stages a build matrix can fork after: the instance is licensed and not reset yet
+FORK_POINTS = ('verify_system', 'upgrade_content', 'upgrade_antivirus', 'upgrade_gp_cvpn', 'upgrade_wildfire',
+               'upgrade_plugin', 'upgrade_panos', 'verify_upgrades_before')
+# Keys a variant of a build matrix may override, and the stage applying them. Stages before the fork
+# point applying an overridden key run in every variant instead.
+VARIANT_KEYS = {
+    'content-upgrade': 'upgrade_content',
+    'antivirus-upgrade': 'upgrade_antivirus',
+    'global-protect-cvpn-upgrade': 'upgrade_gp_cvpn',
+    'wildfire-upgrade': 'upgrade_wildfire',
+    'vm-series-plugin-version': 'upgrade_plugin',
+    'software-version': 'upgrade_panos',
+    'runtime-volume-type': 'create_custom_image',
+    'replicate-regions': 'replicate_image',
+    'fast-snapshot-restore': 'fast_snapshot_restore',
+    'verify-image': 'verify_images',
+    'baseline-config': 'bake_config',
+}
+
+# Commands of a baseline configuration, the build enters configure mode and commits
+CONFIG_VERBS = ('set', 'delete')
+
+MAX_WORKERS = 8
+
+
+def validate_schema(config):
+    """
+    Validate the raw config.yaml content.
+    :param dict config: Parsed config.yaml
+    :return: List of problems found. Empty when the configuration is valid.
+    """
+    if not isinstance(config, dict):
+        return ['Configuration file is empty or is not a mapping.']
+    problems = []
+    for key in REQUIRED_KEYS['common']:
+        if not config.get(key):
+            problems.append(f'"{key}" is mandatory.')
+    provider = str(config.get('cloud-provider') or '').lower()
+    provider = provider_name(provider) or provider
+    if provider and provider not in SUPPORTED_PROVIDERS and provider not in plugin_providers():
+        problems.append(f'"cloud-provider" must be one of {", ".join(SUPPORTED_PROVIDERS)}, got "{provider}".')
+    for key in REQUIRED_KEYS.get(provider, []):
+        if config.get(key) in (None, ''):
+            problems.append(f'"{key}" is mandatory for cloud-provider "{provider}".')
+    for key in BOOLEAN_KEYS:
+        if key in config and not isinstance(config[key], bool):
+            problems.append(f'"{key}" must be true or false, got "{config[key]}".')
+    sw_version = config.get('software-version')
+    if sw_version and 'vm-' not in str(sw_version):
+        problems.append(f'"software-version" must look like "PanOS_vm-10.0.3", got "{sw_version}".')
+    if provider == 'azure' and not (config.get('nic-id') or config.get('subnet-id')):
+        problems.append('"subnet-id" or "nic-id" is mandatory for cloud-provider "azure".')
+    if provider == 'azure' and config.get('nic-id') and len(str(config['nic-id']).split('/')) < 9:
+        problems.append(f'"nic-id" is not a valid Network Interface resource ID.')
+    if provider == 'azure' and config.get('subnet-id') and len(str(config['subnet-id']).split('/')) < 11:
+        problems.append(f'"subnet-id" is not a valid Subnet resource ID.')
+    if provider == 'azure' and config.get('nsg-id') and len(str(config['nsg-id']).split('/')) < 9:
+        problems.append(f'"nsg-id" is not a valid Network Security Group resource ID.')
+    if config.get('bootstrap') and not (config.get('auth-code') or config.get('bootstrap-bucket') or
+                                        config.get('bootstrap-storage')):
+        problems.append('"bootstrap" needs an "auth-code" or a bootstrap package.')
+    if provider == 'gcp' and config.get('bootstrap'):
+        problems.append('"bootstrap" is not supported on GCP.')
+    if provider == 'gcp' and config.get('subnetworks') and not isinstance(config['subnetworks'], list):
+        problems.append(f'"subnetworks" must be a list, got "{config["subnetworks"]}".')
+    if provider == 'gcp' and config.get('runtime-volume-type'):
+        # The disk type is chosen when launching an instance of the image
+        problems.append('"runtime-volume-type" is not supported on GCP.')
+    for key in ('instance-type', 'vm-size', 'machine-type'):
+        if str(config.get(key)).lower() == 'auto':
+            problems.append(f'"{key}" is the runtime size and cannot be "auto", use "build-{key}: auto".')
+    volume_types = {'azure': AZURE_DISK_TYPES, 'gcp': GCP_DISK_TYPES}.get(provider)
+    for key in ('build-volume-type', 'runtime-volume-type'):
+        if volume_types and config.get(key) and config[key] not in volume_types:
+            problems.append(f'"{key}" must be one of {", ".join(volume_types)}, got "{config[key]}".')
+    for key in ('fallback-sizes', 'fallback-placements'):
+        if config.get(key) and not isinstance(config[key], list):
+            problems.append(f'"{key}" must be a list, got "{config[key]}".')
+    for key in ('build-volume-iops', 'build-volume-throughput', 'base-image-cache-ttl'):
+        if config.get(key) and not isinstance(config[key], int):
+            problems.append(f'"{key}" must be a number, got "{config[key]}".')
+    baseline = config.get('baseline-config')
+    if baseline and provider == 'azure':
+        # The admin credentials are reset with the private data, the device is not reconnected to
+        problems.append('"baseline-config" is not supported on Azure.')
+    elif baseline and not os.path.isfile(str(baseline)):
+        problems.append(f'"baseline-config" file {baseline} not found.')
+    elif baseline:
+        invalid = [line for line in config_commands(baseline) if line.split()[0] not in CONFIG_VERBS]
+        if invalid:
+            problems.append(f'"baseline-config" may only hold {"/".join(CONFIG_VERBS)} commands, got "{invalid[0]}".')
+    fast_restore = config.get('fast-snapshot-restore')
+    if fast_restore and provider != 'aws':
+        problems.append('"fast-snapshot-restore" is only supported on AWS.')
+    elif fast_restore and not isinstance(fast_restore, dict):
+        problems.append(f'"fast-snapshot-restore" must map regions to zones, got "{fast_restore}".')
+    elif fast_restore:
+        regions = [config.get('region')] + list(config.get('replicate-regions') or [])
+        for region, zones in fast_restore.items():
+            if region not in regions:
+                problems.append(f'"fast-snapshot-restore" region "{region}" is not region or a replicate-region.')
+            if not isinstance(zones, (list, int)) or isinstance(zones, bool):
+                problems.append(f'"fast-snapshot-restore" for "{region}" must be a list of zones or a number.')
+    if config.get('fork-after') and config['fork-after'] not in FORK_POINTS:
+        problems.append(f'"fork-after" must be one of {", ".join(FORK_POINTS)}, got "{config["fork-after"]}".')
+    variants = config.get('variants')
+    if variants and (not isinstance(variants, list) or
+                     not all(isinstance(variant, dict) and variant.get('name') for variant in variants)):
+        problems.append('"variants" must be a list of mappings with a "name".')
+    elif variants:
+        names = [str(variant['name']) for variant in variants]
+        for name in sorted(set(name for name in names if names.count(name) > 1)):
+            problems.append(f'Variant name "{name}" is used more than once.')
+        for variant in variants:
+            if not re.match(r'^[A-Za-z0-9-]+$', str(variant['name'])):
+                problems.append(f'Variant name "{variant["name"]}" may only contain letters, digits and "-".')
+            for key in variant:
+                if key != 'name' and key not in VARIANT_KEYS:
+                    problems.append(f'Variant "{variant["name"]}" cannot override "{key}".')
+    candidates = config.get('build-size-candidates')
+    if candidates is not None and not isinstance(candidates, list):
+        problems.append(f'"build-size-candidates" must be a list, got "{candidates}".')
+    return problems
+
+
+def check_private_key(path):
+    if not path or not os.path.isfile(path):
+        raise Exception(f'Private key file "{path}" does not exist.')
+    if not os.access(path, os.R_OK):
+        raise Exception(f'Private key file "{path}" is not readable.')
+    mode = os.stat(path).st_mode & 0o777
+    if mode & 0o077:
+        raise Exception(f'Private key file "{path}" permissions {oct(mode)} are too open. Run "chmod 400 {path}".')
+    with open(path) as key_file:
+        if 'PRIVATE KEY' not in key_file.readline():
+            raise Exception(f'Private key file "{path}" is not a PEM private key.')
+
+
+class Preflight(object):
+    def __init__(self, logger, config, cloud_client):
+        self.logger = logger
+        self.config = config
+        self.cloud_client = cloud_client
+
+    def checks(self):
+        checks = {}
+        if self.config['cloud_provider'] in ('aws', 'gcp'):
+            checks['private key'] = lambda: check_private_key(self.config['pkey'])
+        checks.update(self.cloud_client.preflight_checks())
+        return checks
+
+    def run(self, only=None):
+        checks = self.checks()
+        if only:
+            checks = {name: check for name, check in checks.items() if name in only}
+        self.logger.info(f'*** Running {len(checks)} Preflight Checks ***')
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {name: executor.submit(check) for name, check in checks.items()}
+        problems = []
+        for name, future in futures.items():
+            error = future.exception()
+            if error:
+                problems.append(f'{name}: {error}')
+                self.logger.error(f'Preflight check "{name}" failed: {error}')
+            else:
+                self.logger.info(f'Preflight check "{name}" passed.')
+        if problems:
+            raise Exception('Preflight checks failed:\n  ' + '\n  '.join(problems))
+        self.logger.info('*** Preflight Checks Passed ***')
+        return True
@@ -0,0 +1,238 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import sqlite3
+import time
+import urllib.request
+
+import yaml
+
+from lib.build_queue import QUEUED, RUNNING, SUCCEEDED
+
+INTERVAL = 3600
+DEBOUNCE = 1800
+MIN_REBUILD_INTERVAL = 6 * 3600
+
+# Watched dimension -> config.yaml key that opts a build into it
+DIMENSIONS = {
+    'content': 'content-upgrade',
+    'antivirus': 'antivirus-upgrade',
+    'wildfire': 'wildfire-upgrade',
+    'gp-cvpn': 'global-protect-cvpn-upgrade',
+    'plugin': 'vm-series-plugin-version',
+}
+
+PROBE_COMMANDS = {
+    'content': 'request content upgrade check',
+    'antivirus': 'request anti-virus upgrade check',
+    'wildfire': 'request wildfire upgrade check',
+    'gp-cvpn': 'request global-protect-clientless-vpn upgrade check',
+}
+
+
+def version_key(version):
+    return tuple(int(number) for number in re.findall(r'\d+', str(version)))
+
+
+def latest(versions):
+    versions = list(versions)
+    return max(versions, key=version_key) if versions else None
+
+
+class FeedSource(object):
+    def __init__(self, location):
+        """
+        Update feed stand-in: a YAML/JSON document, local or over HTTP(S), mapping
+        dimensions to their latest version, e.g. {"content": "8390-6607", "plugin": "vm_series-2.0.4"}
+        """
+        self.location = location
+
+    def versions(self):
+        if re.match(r'^https?://', self.location):
+            with urllib.request.urlopen(self.location) as response:
+                feed = yaml.safe_load(response.read())
+        else:
+            with open(self.location) as file:
+                feed = yaml.safe_load(file)
+        return {name: str(version) for name, version in (feed or {}).items() if name in DIMENSIONS}
+
+
+class ProbeSource(object):
+    def __init__(self, logger, **kwargs):
+        """
+        Lightweight, long-lived licensed firewall asked for its available updates.
+        :param kwargs: PanosDevice connection arguments (host, user, password or ssh_key_file)
+        """
+        self.logger = logger
+        self.kwargs = kwargs
+
+    def versions(self):
+        from lib.pandevice import PanosDevice
+
+        device = PanosDevice(self.logger, **self.kwargs)
+        try:
+            versions = {}
+            for name, command in PROBE_COMMANDS.items():
+                output = device.exec(command).response()
+                versions[name] = latest(re.findall(r'^\s*(\d+-\d+)\s', output, re.MULTILINE))
+            device.exec('request plugins check')
+            output = device.exec('show plugins packages').response()
+            versions['plugin'] = latest(set(re.findall(r'(vm_series-[\d.]+(?:-h\d+)?)', output)))
+        finally:
+            device.close()
+        return {name: version for name, version in versions.items() if version}
+
+
+class ReleaseWatcher(object):
+    def __init__(self, logger, queue, source, builds, interval=INTERVAL, debounce=DEBOUNCE,
+                 min_rebuild_interval=MIN_REBUILD_INTERVAL):
+        """
+        Queue rebuilds only when a watched version changed since the last built image.
+        :param logger: Logger
+        :param BuildQueue queue: Build queue drained by the image factory daemon
+        :param source: FeedSource or ProbeSource
+        :param list builds: Watched builds, dicts with "name", "spec" (config.yaml mapping) and "priority"
+        :param int interval: Seconds between version checks
+        :param int debounce: Seconds a new version must stay the latest before it triggers a rebuild
+        :param int min_rebuild_interval: Minimum seconds between two rebuilds of the same build
+        """
+        self.logger = logger
+        self.queue = queue
+        self.source = source
+        self.builds = builds
+        self.interval = interval
+        self.debounce = debounce
+        self.min_rebuild_interval = min_rebuild_interval
+        self.db = sqlite3.connect(queue.path)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS release_sightings ('
+                            'name TEXT, dimension TEXT, version TEXT, first_seen REAL, '
+                            'PRIMARY KEY (name, dimension))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS release_triggers ('
+                            'name TEXT, build_id INTEGER, dimensions TEXT, triggered REAL)')
+
+    def _watched(self, spec):
+        return [name for name, key in DIMENSIONS.items() if spec.get(key)]
+
+    def _builds(self, name):
+        return [build for build in self.queue.list(limit=1000) if build['spec'].get('watch-name') == name]
+
+    def _last_built(self, name):
+        for build in self._builds(name):
+            if build['state'] == SUCCEEDED and build['result'] and build['result'].get('versions'):
+                return build['result']['versions']
+        return {}
+
+    def _debounced(self, name, dimension, version, now):
+        row = self.db.execute('SELECT version, first_seen FROM release_sightings WHERE name = ? AND dimension = ?',
+                              [name, dimension]).fetchone()
+        if row is None or row[0] != version:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO release_sightings VALUES (?, ?, ?, ?)',
+                                [name, dimension, version, now])
+            return self.debounce <= 0
+        return now - row[1] >= self.debounce
+
+    def _rate_limited(self, name, now):
+        row = self.db.execute('SELECT MAX(triggered) FROM release_triggers WHERE name = ?', [name]).fetchone()
+        return row[0] is not None and now - row[0] < self.min_rebuild_interval
+
+    def changes(self, build, available, now):
+        """
+        Dimensions of a watched build whose available version differs from the last built image
+        and has been stable for the debounce period.
+        """
+        last_built = self._last_built(build['name'])
+        changed = {}
+        for dimension in self._watched(build['spec']):
+            version = available.get(dimension)
+            if not version or version_key(version) == version_key(last_built.get(dimension) or ''):
+                continue
+            if dimension == 'plugin' and build['spec'][DIMENSIONS['plugin']] != 'latest':
+                continue
+            if self._debounced(build['name'], dimension, version, now):
+                changed[dimension] = version
+        return changed
+
+    def check(self):
+        now = time.time()
+        available = self.source.versions()
+        self.logger.info(f'Available versions: {available}')
+        queued = []
+        for build in self.builds:
+            name = build['name']
+            changed = self.changes(build, available, now)
+            if not changed:
+                self.logger.info(f'{name}: no new versions.')
+                continue
+            if any(existing['state'] in (QUEUED, RUNNING) for existing in self._builds(name)):
+                self.logger.info(f'{name}: {", ".join(changed)} changed, a build is already queued or running.')
+                continue
+            if self._rate_limited(name, now):
+                self.logger.info(f'{name}: {", ".join(changed)} changed, rebuild postponed by the rate limit.')
+                continue
+            spec = dict(build['spec'])
+            spec['watch-name'] = name
+            if 'plugin' in changed:
+                spec[DIMENSIONS['plugin']] = changed['plugin']
+            elif spec.get(DIMENSIONS['plugin']) == 'latest':
+                spec[DIMENSIONS['plugin']] = self._last_built(name).get('plugin') or available.get('plugin')
+            build_id, _ = self.queue.submit(spec, build.get('priority', 0))
+            with self.db:
+                self.db.execute('INSERT INTO release_triggers VALUES (?, ?, ?, ?)',
+                                [name, build_id, ','.join(sorted(changed)), now])
+            self.logger.info(f'{name}: queued build {build_id} for {", ".join(f"{d} {v}" for d, v in changed.items())}.')
+            queued.append(build_id)
+        return queued
+
+    def run(self):
+        self.logger.info(f'*** Watching releases for {len(self.builds)} build(s) every {self.interval}s ***')
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error(f'Unable to check for new releases: {e}')
+            time.sleep(self.interval)
+
+
+def load_watcher(logger, queue, filename):
+    """
+    Build a ReleaseWatcher from a watcher YAML file:
+        interval: 3600
+        debounce: 1800
+        min-rebuild-interval: 21600
+        feed: versions.yaml                 # or probe: {host: ..., user: admin, ssh-key-file: ...}
+        builds:
+          - name: aws-byol
+            config: config.yaml
+            priority: 0
+    """
+    with open(filename) as file:
+        watch = yaml.safe_load(file)
+    if watch.get('probe'):
+        probe = {key.replace('-', '_'): value for key, value in watch['probe'].items()}
+        source = ProbeSource(logger, **probe)
+    else:
+        source = FeedSource(watch['feed'])
+    builds = []
+    for build in watch['builds']:
+        with open(build['config']) as file:
+            spec = yaml.load(file, Loader=yaml.FullLoader)
+        builds.append({'name': build.get('name', build['config']), 'spec': spec,
+                       'priority': build.get('priority', 0)})
+    return ReleaseWatcher(logger, queue, source, builds,
+                          interval=watch.get('interval', INTERVAL),
+                          debounce=watch.get('debounce', DEBOUNCE),
+                          min_rebuild_interval=watch.get('min-rebuild-interval', MIN_REBUILD_INTERVAL))
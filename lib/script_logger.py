@@ -22,12 +22,13 @@ import logging
 
 class Logger(logging.Logger):
 
-    def __init__(self, name=False, console=False, level='INFO'):
+    def __init__(self, name=False, console=False, level='INFO', suffix=''):
         """
         Setup Logging for panAF
         :param str name: Filename. Default is picked up by the running script name.
         :param bool console: Print to console
         :param level: Logging level. Default: "INFO"
+        :param str suffix: Appended to the log file name, for several loggers in one process.
         """
         self.absolute_location = os.path.abspath(os.path.dirname(__file__))
         if '/' not in inspect.stack()[1]:
@@ -42,7 +43,10 @@ class Logger(logging.Logger):
         if not name:
             name = self.filename
 
-        log_filename = self.time.strftime("%Y-%m-%d-%H:%M:%S") + "-" + str(self.pid) + ".log"
+        log_filename = self.time.strftime("%Y-%m-%d-%H:%M:%S") + "-" + str(self.pid)
+        if suffix:
+            log_filename += "-" + suffix
+        log_filename += ".log"
         log_directory = self.directory + "/logs/"
         if not os.path.exists(log_directory):
             os.makedirs(log_directory)
@@ -0,0 +1,97 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+AUTO = 'auto'
+# Storage profile of the builds using the volume type of the image
+DEFAULT_LABEL = 'default'
+# Build sizes tried by "auto", in order of preference when there is no timing history
+DEFAULT_CANDIDATES = {
+    'aws': ['c5.2xlarge', 'm5.2xlarge', 'c5.xlarge', 'm5.xlarge'],
+    'azure': ['Standard_D8s_v3', 'Standard_DS4_v2', 'Standard_D4s_v3', 'Standard_DS3_v2'],
+    'gcp': ['n2-standard-8', 'n1-standard-8', 'n2-standard-4', 'n1-standard-4'],
+}
+# Config key of the build size, per provider
+SIZE_KEYS = ('instance_type', 'vm_size', 'machine_type')
+
+
+def size_key(config):
+    return next((key for key in SIZE_KEYS if key in config), SIZE_KEYS[0])
+
+
+def compare(timings, provider=None, sizes=None, column='size'):
+    """
+    Median stage durations per build size, or per storage profile. Totals only add up the stages every
+    compared size has history for, so that sizes are compared on the same work.
+    :param timings: TimingStore
+    :param list sizes: Only compare these sizes
+    :param str column: Timing key compared, "size" or "storage"
+    :return: ({size: {'stages': {name: (median, samples)}, 'total': seconds}}, common stage names)
+    """
+    medians = timings.by_key(column, 'stage', provider)
+    if column == 'size':
+        # Durations recorded before the size was part of the timing key
+        medians.pop('', None)
+    else:
+        medians = {value or DEFAULT_LABEL: stages for value, stages in medians.items()}
+    if sizes is not None:
+        medians = {size: stages for size, stages in medians.items() if size in sizes}
+    if not medians:
+        return {}, set()
+    common = set.intersection(*[set(stages) for stages in medians.values()])
+    return {size: {'stages': stages, 'total': sum(stages[name][0] for name in common)}
+            for size, stages in medians.items()}, common
+
+
+def select_build_size(logger, timings, provider, candidates):
+    """
+    Fastest available candidate according to the stage timing history, or the first available
+    candidate when none of them was used for a build yet.
+    :param list candidates: Sizes offered in the region, in order of preference
+    """
+    if not candidates:
+        raise Exception('None of the build size candidates is available.')
+    comparison, common = compare(timings, provider, candidates)
+    measured = [size for size in candidates if size in comparison]
+    if not measured or not common:
+        logger.info(f'No timing history for {", ".join(candidates)}, using {candidates[0]}.')
+        return candidates[0]
+    size = min(measured, key=lambda name: comparison[name]['total'])
+    logger.info(f'{size} is the fastest build size: {comparison[size]["total"]:.0f}s for '
+                f'{len(common)} stage(s), {len(measured)} size(s) compared.')
+    return size
+
+
+def report(logger, timings, provider=None, order=None, column='size'):
+    """
+    Log a table of median stage durations, one column per build size or storage profile.
+    :param list order: Stage names in pipeline order, the others are listed after them
+    """
+    comparison, common = compare(timings, provider, column=column)
+    if not comparison:
+        logger.info('*** No stage timing history ***')
+        return comparison
+    sizes = sorted(comparison, key=lambda size: comparison[size]['total'] if common else size)
+    names = set(name for entry in comparison.values() for name in entry['stages'])
+    ordered = [name for name in order or [] if name in names]
+    ordered += sorted(names - set(ordered))
+    logger.info(f'{"STAGE":<24}' + ''.join(f' {size:>16}' for size in sizes))
+    for name in ordered:
+        cells = []
+        for size in sizes:
+            median, samples = comparison[size]['stages'].get(name, (None, 0))
+            cells.append(f' {median:>10.0f}s ({samples:>2})' if samples else f' {"-":>16}')
+        logger.info(f'{name:<24}' + ''.join(cells))
+    logger.info(f'{"TOTAL (common stages)":<24}' + ''.join(f' {comparison[size]["total"]:>15.0f}s'
+                                                          for size in sizes))
+    return comparison
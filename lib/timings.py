@@ -0,0 +1,204 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_PATH = 'timings.db'
+# Columns a duration is keyed by, from the most to the least significant.
+KEY_COLUMNS = ('provider', 'size', 'storage', 'region', 'versions')
+MIN_SAMPLES = 3
+
+
+def percentile(values, pct):
+    """
+    Linear interpolation percentile.
+    :param list values: Samples
+    :param float pct: Percentile between 0 and 100
+    :return: Percentile value or None if there are no samples.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class TimingStore(object):
+    def __init__(self, logger, path=DEFAULT_PATH, key=None, build=None):
+        """
+        Local history of stage, job, reboot, command and cloud operation durations
+        :param logger: Logger
+        :param str path: sqlite database file
+        :param dict key: Values for KEY_COLUMNS describing the current build
+        :param build: Build identifier the recorded durations belong to
+        """
+        self.logger = logger
+        self.key = {column: str((key or {}).get(column, '')) for column in KEY_COLUMNS}
+        self.build = str(build if build is not None else '')
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS timings ('
+                            'id INTEGER PRIMARY KEY AUTOINCREMENT, build TEXT, kind TEXT, name TEXT, '
+                            'started REAL, duration REAL, success INTEGER)')
+            self._migrate()
+            self.db.execute('CREATE INDEX IF NOT EXISTS timings_name ON timings (kind, name)')
+
+    def _migrate(self):
+        existing = [row[1] for row in self.db.execute('PRAGMA table_info(timings)')]
+        for column in KEY_COLUMNS:
+            if column not in existing:
+                self.db.execute(f'ALTER TABLE timings ADD COLUMN {column} TEXT')
+                # Earlier durations were recorded with the default, e.g. the image default storage
+                self.db.execute(f"UPDATE timings SET {column} = ''")
+
+    def record(self, kind, name, duration, started=None, success=True):
+        started = started if started is not None else time.time() - duration
+        columns = ', '.join(KEY_COLUMNS)
+        placeholders = ', '.join('?' * len(KEY_COLUMNS))
+        with self.lock, self.db:
+            self.db.execute(f'INSERT INTO timings (build, kind, name, started, duration, success, {columns}) '
+                            f'VALUES (?, ?, ?, ?, ?, ?, {placeholders})',
+                            [self.build, kind, name, started, duration, int(success)] +
+                            [self.key[column] for column in KEY_COLUMNS])
+
+    @contextmanager
+    def measure(self, kind, name):
+        started = time.time()
+        try:
+            yield
+        except BaseException:
+            self.record(kind, name, time.time() - started, started, success=False)
+            raise
+        self.record(kind, name, time.time() - started, started)
+
+    def durations(self, kind, name, exclude_build=False):
+        """
+        Successful durations for kind/name. The key is relaxed column by column,
+        starting with the least significant, until MIN_SAMPLES durations are found. The provider is
+        never relaxed: durations of other clouds are no estimate, callers fall back to their default.
+        """
+        rows = []
+        for depth in range(len(KEY_COLUMNS), 0, -1):
+            columns = KEY_COLUMNS[:depth]
+            query = 'SELECT duration FROM timings WHERE kind = ? AND name = ? AND success = 1'
+            params = [kind, name]
+            for column in columns:
+                query += f' AND {column} = ?'
+                params.append(self.key[column])
+            if exclude_build:
+                query += ' AND build != ?'
+                params.append(self.build)
+            with self.lock:
+                rows = [row[0] for row in self.db.execute(query, params)]
+            if len(rows) >= MIN_SAMPLES:
+                break
+        return rows
+
+    def percentile(self, kind, name, pct, default=None):
+        value = percentile(self.durations(kind, name), pct)
+        return default if value is None else value
+
+    def timeout(self, kind, name, default, pct=95, margin=1.5, floor=0):
+        """
+        Timeout derived from history: percentile * margin, never below floor.
+        Falls back to the static default until enough samples exist.
+        """
+        samples = self.durations(kind, name)
+        if len(samples) < MIN_SAMPLES:
+            return default
+        return max(floor, percentile(samples, pct) * margin)
+
+    def poll_interval(self, kind, name, default, divisor=10, minimum=5):
+        """
+        Poll interval derived from the median duration, capped by the static default.
+        """
+        samples = self.durations(kind, name)
+        if len(samples) < MIN_SAMPLES:
+            return default
+        return min(default, max(minimum, percentile(samples, 50) / divisor))
+
+    def eta(self, remaining, kind='stage'):
+        """
+        Estimated seconds left for the given stage names, using median durations.
+        :return: (seconds, number of stages without history)
+        """
+        seconds = 0
+        unknown = 0
+        for name in remaining:
+            value = self.percentile(kind, name, 50)
+            if value is None:
+                unknown += 1
+            else:
+                seconds += value
+        return seconds, unknown
+
+    def by_key(self, column, kind='stage', provider=None):
+        """
+        Median successful duration of every name, per value of a key column, e.g. per instance size.
+        :param str column: One of KEY_COLUMNS
+        :param str provider: Only durations of this cloud provider
+        :return: {value: {name: (median, samples)}}
+        """
+        if column not in KEY_COLUMNS:
+            raise Exception(f'Unknown timing key "{column}".')
+        query = f'SELECT {column}, name, duration FROM timings WHERE kind = ? AND success = 1'
+        params = [kind]
+        if provider:
+            query += ' AND provider = ?'
+            params.append(provider)
+        with self.lock:
+            rows = list(self.db.execute(query, params))
+        samples = {}
+        for value, name, duration in rows:
+            if value is not None:
+                samples.setdefault(value, {}).setdefault(name, []).append(duration)
+        return {value: {name: (percentile(values, 50), len(values)) for name, values in names.items()}
+                for value, names in samples.items()}
+
+    def regressions(self, threshold=1.25):
+        """
+        Compare the durations recorded for this build with the median of earlier builds.
+        :param float threshold: Ratio above which a duration counts as a regression
+        :return: List of dicts with kind, name, duration, baseline and ratio.
+        """
+        with self.lock:
+            rows = list(self.db.execute('SELECT kind, name, SUM(duration) FROM timings '
+                                        'WHERE build = ? AND success = 1 AND kind != ? GROUP BY kind, name',
+                                        [self.build, 'command']))
+        report = []
+        for kind, name, duration in rows:
+            baseline = percentile(self.durations(kind, name, exclude_build=True), 50)
+            if baseline and duration > baseline * threshold:
+                report.append({'kind': kind, 'name': name, 'duration': duration,
+                               'baseline': baseline, 'ratio': duration / baseline})
+        return sorted(report, key=lambda entry: entry['ratio'], reverse=True)
+
+    def report_regressions(self, threshold=1.25):
+        report = self.regressions(threshold)
+        if not report:
+            self.logger.info('*** No stage regressions against timing history ***')
+        for entry in report:
+            self.logger.warning(f'Regression: {entry["kind"]} "{entry["name"]}" took {entry["duration"]:.0f}s, '
+                                f'median is {entry["baseline"]:.0f}s ({entry["ratio"]:.2f}x).')
+        return report
+
+    def close(self):
+        with self.lock:
+            self.db.close()
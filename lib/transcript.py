@@ -0,0 +1,261 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SSH session transcripts of the firewall CLI. A transcript file holds one or more sessions (one per connection,
+e.g. before and after a reboot). Every session is a header line followed by one line per send or recv:
+
+    {"version":1,"host":"1.2.3.4","started":1610000000.0}
+    [0.412,"r","Welcome admin.\\r\\nadmin@PA-VM> "]
+    [0.95,"s","set cli scripting-mode on\\n"]
+
+Times are seconds since the start of the session. Received bytes are stored as latin-1 text, which
+round-trips any byte. Files ending with ".gz" are compressed.
+"""
+
+import gzip
+import json
+import queue
+import re
+import socket
+import threading
+import time
+
+FORMAT = 1
+SEND = 's'
+RECV = 'r'
+# Regex-safe, replayed commands are used in regular expressions, e.g. to strip their echo
+MASK = '<masked>'
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def load(path):
+    """
+    :return: List of sessions: {'header': dict, 'events': [(seconds, direction, text)]}
+    """
+    sessions = []
+    with _open(path, 'r') as file:
+        for line in file:
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                sessions.append({'header': entry, 'events': []})
+            elif sessions:
+                sessions[-1]['events'].append(tuple(entry))
+    return sessions
+
+
+def _matches(data, expected):
+    # Masked secrets match anything
+    if MASK not in expected:
+        return data == expected
+    return re.match('^' + '.+'.join(re.escape(part) for part in expected.split(MASK)) + '$', data, re.S) is not None
+
+
+class TranscriptRecorder(object):
+    def __init__(self, path, secrets=()):
+        """
+        Append the CLI sessions of a device to a transcript file.
+        :param str path: Transcript file, compressed if it ends with ".gz"
+        :param secrets: Strings replaced by MASK in the transcript, e.g. the auth-code, the API key and the
+        passwords of the baseline configuration
+        """
+        self.path = path
+        # Longest first, a secret containing another one is masked whole
+        self.secrets = sorted(set(str(secret) for secret in secrets if secret), key=len, reverse=True)
+        self.lock = threading.Lock()
+        self.file = _open(path, 'a')
+        self.started = time.time()
+        self.channels = []
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        # Flushed for every event, the transcript of a failed build is the interesting one
+        self.file.flush()
+
+    def channel(self, channel, host=None):
+        """
+        Start a session.
+        :param channel: paramiko Channel
+        :return: Channel recording every send and recv
+        """
+        self.flush()
+        with self.lock:
+            self.started = time.time()
+            self._write({'version': FORMAT, 'host': host, 'started': self.started})
+            recording = RecordingChannel(channel, self)
+            self.channels.append(recording)
+        return recording
+
+    def mask(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('latin-1')
+        for secret in self.secrets:
+            data = data.replace(secret, MASK)
+        return data
+
+    def held(self, data):
+        """
+        Length of the end of data that may be the beginning of a secret, completed by the next chunk.
+        """
+        held = 0
+        for secret in self.secrets:
+            for length in range(min(len(secret) - 1, len(data)), held, -1):
+                if data.endswith(secret[:length]):
+                    held = length
+                    break
+        return held
+
+    def record(self, direction, data):
+        data = self.mask(data)
+        with self.lock:
+            self._write([round(time.time() - self.started, 3), direction, data])
+
+    def flush(self):
+        with self.lock:
+            channels = list(self.channels)
+        for channel in channels:
+            channel.flush()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.file.close()
+
+
+class RecordingChannel(object):
+    def __init__(self, channel, recorder):
+        self.channel = channel
+        self.recorder = recorder
+        # Received text not recorded yet: a secret echoed by the device may be split across recv chunks
+        self.pending = ''
+
+    def flush(self):
+        pending, self.pending = self.pending, ''
+        if pending:
+            self.recorder.record(RECV, pending)
+
+    def send(self, data):
+        # Received before this send
+        self.flush()
+        self.recorder.record(SEND, data)
+        return self.channel.send(data)
+
+    def recv(self, size):
+        data = self.channel.recv(size)
+        if not data:
+            self.flush()
+            return data
+        text = self.recorder.mask(self.pending + data.decode('latin-1'))
+        held = self.recorder.held(text)
+        self.pending = text[len(text) - held:] if held else ''
+        if len(text) > held:
+            self.recorder.record(RECV, text[:len(text) - held])
+        return data
+
+    def close(self):
+        self.flush()
+        return self.channel.close()
+
+    def __getattr__(self, name):
+        # fileno() for select(), close(), ...
+        return getattr(self.channel, name)
+
+
+class Replay(object):
+    def __init__(self, path, speed=None, strict=True):
+        """
+        Transport replaying a transcript instead of connecting to a device. Every connection, including the
+        reconnections after a reboot, replays the next session of the transcript.
+        :param float speed: 1 for the recorded speed, 10 for ten times faster, None for as fast as possible
+        :param bool strict: Fail when the client sends something else than the recorded session
+        """
+        self.path = path
+        self.sessions = load(path)
+        self.speed = speed
+        self.strict = strict
+
+    def channel(self):
+        if not self.sessions:
+            raise Exception(f'No session left to replay in {self.path}.')
+        return ReplayChannel(self.sessions.pop(0), self.speed, self.strict)
+
+
+class ReplayChannel(object):
+    def __init__(self, session, speed=None, strict=True):
+        """
+        paramiko Channel stand-in over a socketpair, so that select() works. The output recorded after a send
+        is written back when the same data is sent.
+        """
+        self.events = list(session['events'])
+        self.speed = speed
+        self.strict = strict
+        self.local, self.remote = socket.socketpair()
+        self.pending = queue.Queue()
+        self.writer = threading.Thread(target=self._write, daemon=True)
+        self.writer.start()
+        # Banner and prompt received before the first command
+        self._play(time.time(), 0)
+
+    def _play(self, now, since):
+        while self.events and self.events[0][1] == RECV:
+            seconds, _, text = self.events.pop(0)
+            delay = (seconds - since) / self.speed if self.speed else 0
+            self.pending.put((now + delay, text.encode('latin-1')))
+
+    def _write(self):
+        while True:
+            due, data = self.pending.get()
+            if data is None:
+                return
+            if due > time.time():
+                time.sleep(due - time.time())
+            try:
+                self.remote.sendall(data)
+            except OSError:
+                return
+
+    def fileno(self):
+        return self.local.fileno()
+
+    def commands(self):
+        """
+        :return: Commands left to send in the session, without the page requests
+        """
+        return [text.rstrip('\r\n') for _, direction, text in self.events if direction == SEND and text.strip()]
+
+    def send(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('latin-1')
+        if not self.events:
+            if self.strict:
+                raise Exception(f'Replay diverged: sent {data!r} after the end of the session.')
+            return len(data)
+        seconds, _, expected = self.events.pop(0)
+        if self.strict and not _matches(data, expected):
+            raise Exception(f'Replay diverged: sent {data!r}, the transcript has {expected!r}.')
+        self._play(time.time(), seconds)
+        return len(data)
+
+    def recv(self, size):
+        return self.local.recv(size)
+
+    def close(self):
+        self.pending.put((0, None))
+        self.local.close()
+        self.remote.close()
@@ -12,70 +12,245 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import yaml
 import time
-
-from cloudclient.cloud_client import CloudProvider
-from lib.pandevice import PanosDevice
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from cloudclient.client_pool import POOL
+from cloudclient.cloud_client import CloudProvider, provider_name
+from cloudclient.images import image_name
+from cloudclient.storage import storage_profile
+from cloudclient.throttle import THROTTLE
+from lib.base_images import CACHE_TTL, DEFAULT_SKU, BaseImageCache, select_base_image, skipped_stages
+from lib.pandevice import PanosDevice, config_commands, config_secrets
+from lib.pipeline import Pipeline, Stage, PENDING, ancestors, subset
+from lib.preflight import Preflight, VARIANT_KEYS, validate_schema
+from lib.sizing import AUTO, DEFAULT_CANDIDATES, select_build_size, size_key
+from lib.timings import TimingStore
+from lib.transcript import TranscriptRecorder
+from lib.verification import ImageVerifier
 
 FIRST_WAIT = 660
 INTERVAL = 120
+TRIES = 6
+SIGNAL_INTERVAL = 15
+
+# Stage a build matrix forks after, unless set with fork-after
+FORK_AFTER = 'upgrade_panos'
+# Stages every variant of a build matrix starts with, on its copy of the fork image
+VARIANT_START = ['create_instance', 'connect_to_vmseries', 'license_firewall']
+# Preflight checks that do not depend on the base image, run for the replication regions
+REGION_CHECKS = ['aws subnet', 'aws security group', 'aws key pair', 'aws instance type']
 
 
 class CustomImage(object):
-    def __init__(self, logger, filename):
+    def __init__(self, logger, filename, raw_config=None, cancelled=None, track=None):
         self.logger = logger
         self.config = {}
-        # Fetch Inputs From Config File
-        self.config = self.fetch_config_yaml(filename)
+        # Fetch Inputs From Config File (or from an already parsed config.yaml mapping)
+        self.config = self.fetch_config_yaml(filename, raw_config)
+        # Callable polled before every stage; a build is aborted when it returns True
+        self.cancelled = cancelled
+        # Callable(resource) recording the cloud resources of the build as soon as they exist
+        self.track = track
+        # Unique per run, also naming the cloud resources: process ids are reused and would merge the timing
+        # history of unrelated runs
+        self.build_id = self.config.setdefault('build_id', uuid.uuid4().hex[:12])
+        # Stage duration history
+        self.timings = TimingStore(self.logger, self.config['timings_db'], build=self.build_id, key={
+            'provider': self.config['cloud_provider'],
+            'size': self.config.get(size_key(self.config)),
+            'storage': storage_profile(self.config),
+            'region': self.config.get('region', self.config.get('location')),
+            'versions': f'{self.config["sw_version"]}/{self.config["plugin"]}',
+        })
+        self.pipeline = None
+        # Outcome of the build, reported by the image factory daemon
+        self.result = {}
         # Connect to the public Cloud
         self.cloud_client = CloudProvider(self.logger, self.config["cloud_provider"], self.config)
+        self.cloud_client.on_resource = track
+        if self.config.get(size_key(self.config)) == AUTO:
+            self.resolve_build_size()
+        if self.config.get('ami_id', self.config.get('image_version')) == AUTO:
+            self.resolve_base_image()
         self.handler =None
-
-    def fetch_config_yaml(self, filename):
-        self.logger.info(f'Reading configuration file {filename}.')
-        with open(filename) as file:
-            config = yaml.load(file, Loader=yaml.FullLoader)
+        self.bootstrapped = False
+        # Image of the base instance the variants of a build matrix are launched from
+        self.fork = None
+        # CLI session transcripts per instance
+        self.recorders = {}
+
+    def resolve_build_size(self):
+        """
+        Replace an "auto" build size by the fastest size available in the region. The image does not
+        depend on the build size, only the install, commit and reboot times do.
+        """
+        provider = self.config['cloud_provider']
+        candidates = self.config['build_size_candidates'] or DEFAULT_CANDIDATES.get(provider, [])
+        try:
+            available = self.cloud_client.available_sizes(candidates)
+        except Exception as e:
+            self.logger.warning(f'Unable to list the available build sizes: {e}')
+            available = []
+        if not available:
+            self.logger.warning(f'No build size candidate available, using {self.config["runtime_size"]}.')
+            size = self.config['runtime_size']
+        else:
+            size = select_build_size(self.logger, self.timings, provider, available)
+            if not self.config['fallback_sizes']:
+                # The other available candidates, when the fastest one is short of capacity
+                self.config['fallback_sizes'] = [candidate for candidate in available if candidate != size]
+        self.logger.info(f'*** Build size: {size}, runtime size: {self.config["runtime_size"]} ***')
+        self.config[size_key(self.config)] = size
+        self.timings.key['size'] = size
+
+    def resolve_base_image(self):
+        """
+        Replace an "auto" base image by the marketplace image of the SKU closest to software-version, so that
+        the build downloads and installs as little as possible.
+        """
+        provider = self.config['cloud_provider']
+        region = self.config.get('region', self.config.get('location'))
+        base_key = 'ami_id' if 'ami_id' in self.config else 'image_version'
+        sku = self.config.get('image_sku') or DEFAULT_SKU
+        cache = BaseImageCache(self.logger, self.config['base_image_cache'], self.config['base_image_cache_ttl'])
+        images = cache.get(f'{provider}/{region}/{sku}', lambda: self.cloud_client.marketplace_images(sku))
+        image = select_base_image(images, self.config['version'])
+        if image is None:
+            raise Exception(f'No {sku} marketplace image in {region} runs PanOS {self.config["version"]} or older.')
+        self.logger.info(f'*** Base image: {image["name"]} ({image["id"]}), PanOS {image["version"]}, '
+                         f'{len(images)} {sku} image(s) listed ***')
+        skipped = skipped_stages(image['version'], self.config['version'])
+        if skipped:
+            seconds, unknown = self.timings.eta(skipped)
+            saved = f', about {int(seconds / 60)} min saved' if not unknown else ''
+            self.logger.info(f'Base image runs the target PanOS version: {", ".join(skipped)} skipped{saved}.')
+        else:
+            self.logger.info(f'Base image runs PanOS {image["version"]}, upgraded to {self.config["version"]}.')
+        self.config[base_key] = image['id']
+        self.result['base_image'] = image
+
+    @contextmanager
+    def stage(self, name):
+        cleanup = self.pipeline and self.pipeline.stages[name].always
+        if self.cancelled and self.cancelled() and not cleanup:
+            raise Exception(f'Build cancelled before stage {name}.')
+        with self.timings.measure('stage', name):
+            yield
+        remaining = [stage.name for stage in self.pipeline.stages.values() if stage.state == PENDING] \
+            if self.pipeline else []
+        if remaining:
+            seconds, unknown = self.timings.eta(remaining)
+            estimate = f'ETA: {int(seconds / 60)} min for {len(remaining)} remaining stages'
+            if unknown:
+                estimate += f' ({unknown} without history)'
+            self.logger.info(estimate)
+
+    def fetch_config_yaml(self, filename, config=None):
+        if config is None:
+            self.logger.info(f'Reading configuration file {filename}.')
+            with open(filename) as file:
+                config = yaml.load(file, Loader=yaml.FullLoader)
         if not config:
             self.logger.error(f'Unable to read configuration file {filename}.')
+        # Variant builds of a build matrix start from the same configuration
+        self.raw_config = config
+        problems = validate_schema(config)
+        if problems:
+            for problem in problems:
+                self.logger.error(f'Configuration file {filename}: {problem}')
+            raise Exception(f'Configuration file {filename} is broken: {len(problems)} problem(s) found.')
         output = {}
-        try:
-            if config["cloud-provider"].lower() == "aws":
-                output['ami_id'] = config['ami-id']
-                output['mgmt_subnet_id'] = config['mgmt-subnet-id']
-                output['sg_id'] = config['sg-id']
-                output['key_pair_name'] = config['key-pair-name']
-                output['instance_type'] = config['instance-type']
-
-                output['aws_access_key_id'] = config['secret-key-id']
-                output['aws_secret_access_key'] = config['secret-access-key']
-                output['region'] = config['region']
-                output['pkey'] = config['instance-pkey']
-
-            elif config["cloud-provider"].lower() == "azure":
-                output['subscription_id'] = config['subscription-id']
-                output['tenant_id'] = config['tenant-id']
-                output['client_id'] = config['client-id']
-                output['client_secret'] = config['client-secret']
-                output['location'] = config['location']
-                output['rg_name'] = config['rg-name']
-                output['vm_size'] = config['vm-size']
-                output['nic_id'] = config['nic-id']
-                output['image_sku'] = config['image-sku']
-                output['image_version'] = config['image-version']
-
-            output['plugin'] = config.get('vm-series-plugin-version', False)
-            output['content_upgrade'] = config.get('content-upgrade', False)
-            output['antivirus_upgrade'] = config.get('antivirus-upgrade', False)
-            output['gpcvpn_upgrade'] = config.get('global-protect-cvpn-upgrade', False)
-            output['wildfire_upgrade'] = config.get('wildfire-upgrade', False)
-            output['api_key'] = config.get('delicensing-api-key', False)
-            output['auth_code'] = config.get('auth-code', False)
-            output['sw_version'] = config['software-version']
-            output['version'] = output['sw_version'].split('vm-')[1]
-            output['cloud_provider'] = config["cloud-provider"].lower()
-        except Exception as e:
-            self.logger.error(f'Configuration file {filename} is broken. {str(e)}')
+        provider = provider_name(config["cloud-provider"])
+        if provider == "aws":
+            output['ami_id'] = config['ami-id']
+            output['mgmt_subnet_id'] = config['mgmt-subnet-id']
+            output['sg_id'] = config['sg-id']
+            output['key_pair_name'] = config['key-pair-name']
+            # Size of the build instance, the image is meant to run on instance-type
+            output['runtime_size'] = config['instance-type']
+            output['instance_type'] = config.get('build-instance-type') or config['instance-type']
+
+            output['aws_access_key_id'] = config['secret-key-id']
+            output['aws_secret_access_key'] = config['secret-access-key']
+            output['region'] = config['region']
+            output['pkey'] = config['instance-pkey']
+            # SKU of the marketplace image picked by "ami-id: auto"
+            output['image_sku'] = config.get('image-sku') or ''
+
+        elif provider == "azure":
+            output['subscription_id'] = config['subscription-id']
+            output['tenant_id'] = config['tenant-id']
+            output['client_id'] = config['client-id']
+            output['client_secret'] = config['client-secret']
+            output['location'] = config['location']
+            output['rg_name'] = config['rg-name']
+            output['runtime_size'] = config['vm-size']
+            output['vm_size'] = config.get('build-vm-size') or config['vm-size']
+            output['nic_id'] = config.get('nic-id') or ''
+            output['subnet_id'] = config.get('subnet-id') or ''
+            output['nsg_id'] = config.get('nsg-id') or ''
+            output['image_sku'] = config['image-sku']
+            output['image_version'] = config['image-version']
+
+        elif provider == "gcp":
+            output['project'] = config['gcp-project']
+            output['gcp_credentials'] = config.get('gcp-credentials') or ''
+            output['gcp_endpoint'] = config.get('gcp-endpoint') or ''
+            output['zone'] = config['zone']
+            output['region'] = config['zone'].rsplit('-', 1)[0]
+            output['source_image'] = config['source-image']
+            output['subnetworks'] = config['subnetworks']
+            output['image_family'] = config.get('image-family') or ''
+            output['runtime_size'] = config['machine-type']
+            output['machine_type'] = config.get('build-machine-type') or config['machine-type']
+            output['pkey'] = config['instance-pkey']
+
+        else:
+            # Provider registered through an entry point, gets every key
+            output.update({key.replace('-', '_'): value for key, value in config.items()})
+            output['runtime_size'] = output.get(size_key(output))
+
+        output['plugin'] = config.get('vm-series-plugin-version', False)
+        output['content_upgrade'] = config.get('content-upgrade', False)
+        output['antivirus_upgrade'] = config.get('antivirus-upgrade', False)
+        output['gpcvpn_upgrade'] = config.get('global-protect-cvpn-upgrade', False)
+        output['wildfire_upgrade'] = config.get('wildfire-upgrade', False)
+        output['api_key'] = config.get('delicensing-api-key', False)
+        output['auth_code'] = config.get('auth-code', False)
+        output['sw_version'] = config['software-version']
+        output['version'] = output['sw_version'].split('vm-')[1]
+        output['cloud_provider'] = provider
+        output['timings_db'] = config.get('timings-db', 'timings.db')
+        output['replicate_regions'] = config.get('replicate-regions') or []
+        output['verify_image'] = config.get('verify-image', False)
+        output['verify_network'] = config.get('verify-network') or {}
+        output['bootstrap'] = config.get('bootstrap', False)
+        output['build_size_candidates'] = config.get('build-size-candidates') or []
+        output['build_volume_type'] = config.get('build-volume-type') or ''
+        output['build_volume_iops'] = config.get('build-volume-iops') or 0
+        output['build_volume_throughput'] = config.get('build-volume-throughput') or 0
+        output['runtime_volume_type'] = config.get('runtime-volume-type') or ''
+        output['fast_snapshot_restore'] = config.get('fast-snapshot-restore') or {}
+        output['api_rate_limit'] = config.get('api-rate-limit') or 0
+        output['variants'] = config.get('variants') or []
+        output['record_transcripts'] = config.get('record-transcripts') or ''
+        output['baseline_config'] = config.get('baseline-config') or ''
+        output['fallback_sizes'] = config.get('fallback-sizes') or []
+        output['fallback_placements'] = config.get('fallback-placements') or []
+        output['spot'] = config.get('spot', False)
+        output['base_image_cache'] = config.get('base-image-cache') or 'base_images.json'
+        output['base_image_cache_ttl'] = config.get('base-image-cache-ttl') or CACHE_TTL
+        output['fork_after'] = config.get('fork-after') or FORK_AFTER
+        output['bootstrap_bucket'] = config.get('bootstrap-bucket', '')
+        output['bootstrap_instance_profile'] = config.get('bootstrap-instance-profile', '')
+        output['bootstrap_storage'] = config.get('bootstrap-storage') or {}
+        if config.get('build-id'):
+            output['build_id'] = str(config['build-id'])
         self.logger.info(f'*** Custom Image with the following versions will be created: ***')
         self.logger.info(f'PanOS: {output["sw_version"]}')
         self.logger.info(f'Plugin: {output["plugin"]}')
@@ -85,44 +260,373 @@ class CustomImage(object):
         self.logger.info(f'Latest Wildfire: {output["wildfire_upgrade"]}')
         return output
 
-    def connect_to_vmseries(self):
-        tries = 6
-        host = self.cloud_client.public_ip
+    def stages(self):
+        """
+        Build stages with their dependencies. Stages sharing a lock never run at the same time:
+        "device" is the firewall CLI session, "instance" the base cloud instance.
+        """
+        device = ['device']
+        instance = ['instance']
+        return [
+            # Validate config and cloud resources before launching anything
+            Stage('preflight', self.preflight),
+            # Check the replication regions while the base instance boots
+            Stage('precheck_regions', self.precheck_regions, requires=['preflight'],
+                  enabled=bool(self.config['replicate_regions'])),
+            # Create a base Instance
+            Stage('create_instance', self.create_instance, requires=['preflight'], locks=instance),
+            # Connect to FW Instance
+            Stage('connect_to_vmseries', self.connect_to_vmseries, requires=['create_instance'], locks=device),
+            # License the FW
+            Stage('license_firewall', self.license_firewall, requires=['connect_to_vmseries'], locks=device),
+            # Verify System
+            Stage('verify_system', self.verify_system, requires=['license_firewall'], locks=device),
+            # Upgrade Content
+            Stage('upgrade_content', self.upgrade_content, requires=['verify_system'], locks=device),
+            # Upgrade Anti-virus
+            Stage('upgrade_antivirus', self.upgrade_antivirus, requires=['upgrade_content'], locks=device,
+                  optional=True),
+            # Upgrade Global-Protect Clientless VPN
+            Stage('upgrade_gp_cvpn', self.upgrade_gp_cvpn, requires=['upgrade_antivirus'], locks=device,
+                  optional=True),
+            # Upgrade Wildfire
+            Stage('upgrade_wildfire', self.upgrade_wildfire, requires=['upgrade_gp_cvpn'], locks=device,
+                  optional=True),
+            # Upgrade VM Series Plugin
+            Stage('upgrade_plugin', self.upgrade_plugin, requires=['upgrade_wildfire'], locks=device),
+            # Upgrade PanOS
+            Stage('upgrade_panos', self.upgrade_panos, requires=['upgrade_plugin'], locks=device),
+            # Verify Upgrades
+            Stage('verify_upgrades_before', lambda: self.verify_upgrades(when="before"),
+                  requires=['upgrade_panos'], locks=device),
+            # Perform Private Data Reset
+            Stage('private_data_reset', self.private_data_reset, requires=['verify_upgrades_before'], locks=device),
+            # Apply the baseline configuration, after the reset that restores the default configuration
+            Stage('bake_config', self.bake_config, requires=['private_data_reset'], locks=device),
+            # Verify Upgrades after Private Data Reset
+            Stage('verify_upgrades_after', lambda: self.verify_upgrades(when="after"),
+                  requires=['bake_config'], locks=device),
+            # Create Custom Image
+            Stage('create_custom_image', self.create_custom_image, requires=['verify_upgrades_after'],
+                  locks=device + instance),
+            # Copy the Custom Image to other regions while the base instance is terminated
+            Stage('replicate_image', self.replicate_image, requires=['create_custom_image', 'precheck_regions'],
+                  retries=1, enabled=bool(self.config['replicate_regions'])),
+            # Pre-warm the snapshots of the produced images for fast first boots
+            Stage('fast_snapshot_restore', self.fast_snapshot_restore, requires=['replicate_image'],
+                  enabled=bool(self.config['fast_snapshot_restore'])),
+            # Cleanup, also after a failure
+            Stage('terminate_instance', self.terminate_instance, requires=['create_custom_image'], locks=instance,
+                  retries=2, always=True),
+            # Boot a test instance from every produced image
+            Stage('verify_images', self.verify_images, requires=['replicate_image', 'terminate_instance'],
+                  enabled=bool(self.config['verify_image'])),
+        ]
+
+    def fork_point(self):
+        """
+        Split the stages of a build matrix at the fork point. The stages applying a key overridden by a
+        variant run in every variant, even when they come before the fork point.
+        :return: (names of the stages run once on the base instance, names of the stages run by every variant)
+        """
+        stages = self.stages()
+        deferred = set(VARIANT_KEYS[key] for variant in self.config['variants'] for key in variant
+                       if key in VARIANT_KEYS)
+        shared = ancestors(stages, self.config['fork_after']) - deferred
+        variant = VARIANT_START + [stage.name for stage in stages
+                                   if stage.name not in shared and stage.name not in VARIANT_START + ['preflight']]
+        return shared, variant
+
+    def fork_stages(self):
+        """
+        Build matrix stages: the shared stages run once, then the variants are built from a fork image
+        of the base instance.
+        """
+        device = ['device']
+        instance = ['instance']
+        shared, _ = self.fork_point()
+        stages = subset(self.stages(), shared)
+        last = [stage.name for stage in stages if not any(stage.name in other.requires for other in stages)]
+        # Azure variants reuse the network interface of the base instance
+        variants_after = ['create_fork_image'] + (['terminate_instance'] if self.config['cloud_provider'] == 'azure'
+                                                  else [])
+        return stages + [
+            # Image of the upgraded base instance
+            Stage('create_fork_image', self.create_fork_image, requires=last, locks=device + instance),
+            # Cleanup, also after a failure
+            Stage('terminate_instance', self.terminate_instance, requires=['create_fork_image'], locks=instance,
+                  retries=2, always=True),
+            # Launch every variant from the fork image
+            Stage('build_variants', self.build_variants, requires=variants_after),
+            Stage('delete_fork_image', self.delete_fork_image, requires=['build_variants'], retries=2, always=True),
+        ]
+
+    def create_fork_image(self):
+        if self.config['api_key']:
+            # Variants license their own instance, the license of the base instance is released
+            self.handler.delicense(self.config['api_key'])
+        elif self.config['auth_code']:
+            self.logger.warning('*** De-licensing API Key not provided. The base instance license is not released. ***')
+        if self.handler and self.handler.connected:
+            self.handler.close()
+
+        self.logger.info(f'*** Stopping Instance ***')
+        with self.timings.measure('cloud', 'stop_instance'):
+            if not self.cloud_client.stop_instance():
+                raise Exception('Unable to stop the base instance.')
+        self.logger.info(f'*** Creating Fork Image ***')
+        with self.timings.measure('cloud', 'create_fork_image'):
+            self.fork = self.cloud_client.create_fork_image(f'PanOS-Fork-{self.build_id}')
+        self.result['fork'] = dict(self.fork)
+        self.logger.info(f'*** Fork Image Creation Complete ***')
+
+    def build_variant(self, variant, names):
+        """
+        Build one variant from the fork image, running only its own stages.
+        :return: (variant name, build result)
+        """
+        config = {key: value for key, value in self.raw_config.items() if key not in ('variants', 'fork-after')}
+        config.update({key: value for key, value in variant.items() if key != 'name'})
+        config['build-id'] = f'{self.build_id}-{variant["name"]}'
+        # The fork image is past its first boot
+        config['bootstrap'] = False
+        self.logger.info(f'*** Building Variant {variant["name"]} ***')
+        try:
+            lib = CustomImage(self.logger, None, config, cancelled=self.cancelled, track=self.track)
+            lib.config.update(self.fork)
+            succeeded = lib.build(names)
+            result = dict(lib.result, success=succeeded, error=None if succeeded else lib.error)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        self.logger.info(f'*** Variant {variant["name"]} {"Complete" if result["success"] else "Failed"} ***')
+        return variant['name'], result
+
+    def build_variants(self):
+        _, names = self.fork_point()
+        variants = self.config['variants']
+        # Azure variants share the network interface of the configuration file, unless they create their own
+        parallel = self.config['cloud_provider'] != 'azure' or self.config.get('subnet_id')
+        workers = len(variants) if parallel else 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda variant: self.build_variant(variant, names), variants))
+        self.result['variants'] = dict(results)
+        failed = [name for name, result in results if not result['success']]
+        if failed:
+            raise Exception(f'Variant build(s) failed: {", ".join(failed)}.')
+
+    def delete_fork_image(self):
+        if not self.fork:
+            self.logger.info('*** No Fork Image to delete ***')
+            return
+        self.logger.info('*** Deleting Fork Image ***')
+        self.cloud_client.delete_fork_image(self.fork)
+        self.logger.info('*** Fork Image Deleted ***')
+
+    def delete_resources(self, resources):
+        """
+        Delete the cloud resources recorded by an interrupted run of this build, newest first: the variant
+        instances before the fork image they were launched from.
+        :param list resources: Resources reported by the cloud client, see report_resource()
+        """
+        for resource in reversed(resources):
+            resource = dict(resource)
+            kind = resource.pop('kind')
+            region = resource.pop('region', None)
+            try:
+                client = self.cloud_client
+                if region and region != self.config.get('region'):
+                    # Verification instance in a replication region
+                    client = CloudProvider(self.logger, self.config['cloud_provider'], dict(self.config, region=region))
+                if kind == 'fork':
+                    self.logger.info(f'*** Deleting Fork Image {resource["fork"]} ***')
+                    client.delete_fork_image(resource['fork'])
+                else:
+                    for name, value in resource.items():
+                        setattr(client, name, value)
+                    self.logger.info(f'*** Terminating Instance {resource} ***')
+                    client.terminate_instance()
+            except Exception as e:
+                self.logger.error(f'Unable to delete {kind} {resource}: {e}')
+
+    def build(self, names=None):
+        """
+        Run the custom image pipeline. The base instance is always terminated.
+        :param names: Only run these stages, e.g. the stages of a variant of a build matrix
+        :return: True if the custom image was created.
+        """
+        if names is not None:
+            stages = subset(self.stages(), names)
+        elif self.config['variants']:
+            stages = self.fork_stages()
+        else:
+            stages = self.stages()
+        self.pipeline = Pipeline(self.logger, stages, context=self.stage)
+        succeeded = self.pipeline.run()
+        self.error = self.pipeline.error
+        if not succeeded:
+            # Failed
+            self.logger.error(f'*** Failed to Create Custom Image ***')
+            self.logger.error(f'TRACEBACK: {self.error}')
+        # Show where the time went
+        self.pipeline.report()
+        POOL.report(self.logger)
+        THROTTLE.report(self.logger)
+        for recorder in self.recorders.values():
+            recorder.close()
+            self.logger.info(f'CLI transcript: {recorder.path}')
+        if succeeded:
+            # Compare stage durations with earlier builds
+            self.timings.report_regressions()
+        return succeeded
+
+    def precheck_regions(self):
+        """
+        Check the network settings of the replication regions that are verified.
+        """
+        if self.config['cloud_provider'] != 'aws':
+            return
+        for region in self.config['replicate_regions']:
+            network = self.config['verify_network'].get(region)
+            if not network or not self.config['verify_image']:
+                continue
+            config = dict(self.config)
+            config.update({'region': region, 'mgmt_subnet_id': network.get('mgmt-subnet-id'),
+                           'sg_id': network.get('sg-id'), 'key_pair_name': network.get('key-pair-name')})
+            client = CloudProvider(self.logger, config['cloud_provider'], config)
+            Preflight(self.logger, config, client).run(only=REGION_CHECKS)
+
+    def terminate_instance(self):
+        if not (getattr(self.cloud_client, 'instance_id', None) or getattr(self.cloud_client, 'instance_name', None)):
+            self.logger.info('*** No Base Instance to terminate ***')
+            return
+        self.logger.info('*** Terminating Base Instance ***')
+        self.cloud_client.terminate_instance()
+        self.logger.info('*** Termination Complete ***')
+
+    def preflight(self):
+        return Preflight(self.logger, self.config, self.cloud_client).run()
+
+    def _recorder(self, cloud_client):
+        """
+        Transcript of the CLI sessions of an instance, when record-transcripts is set.
+        """
+        if not self.config['record_transcripts']:
+            return None
+        name = getattr(cloud_client, 'id', self.build_id)
+        if name not in self.recorders:
+            os.makedirs(self.config['record_transcripts'], exist_ok=True)
+            path = os.path.join(self.config['record_transcripts'], f'{name}.jsonl.gz')
+            secrets = [self.config['auth_code'], self.config['api_key']]
+            if self.config['baseline_config']:
+                secrets += config_secrets(config_commands(self.config['baseline_config']))
+            self.recorders[name] = TranscriptRecorder(path, secrets=secrets)
+        return self.recorders[name]
+
+    def _open_device(self, cloud_client):
+        if self.config['cloud_provider'] in ('aws', 'gcp'):
+            return PanosDevice(self.logger, host=cloud_client.public_ip,
+                               user=cloud_client.config["username"],
+                               ssh_key_file=cloud_client.config["pkey"],
+                               timings=self.timings,
+                               recorder=self._recorder(cloud_client),
+                               boot_signal=lambda timeout: cloud_client.wait_for_boot(timeout, reboot=True))
+        elif self.config['cloud_provider'] == 'azure':
+            return PanosDevice(self.logger, host=cloud_client.public_ip,
+                               user=cloud_client.config["username"],
+                               password=cloud_client.config["password"],
+                               timings=self.timings,
+                               recorder=self._recorder(cloud_client),
+                               boot_signal=lambda timeout: cloud_client.wait_for_boot(timeout, reboot=True))
+
+    def wait_for_device(self, cloud_client):
+        """
+        Wait for a freshly launched instance to boot and open a CLI session to it.
+        :return: PanosDevice
+        """
+        first_wait, interval, tries = FIRST_WAIT, INTERVAL, TRIES
+        history = self.timings.percentile('stage', 'connect_to_vmseries', 10)
+        if history is not None:
+            first_wait = history * 0.75
+            interval = self.timings.poll_interval('stage', 'connect_to_vmseries', INTERVAL)
+            timeout = self.timings.timeout('stage', 'connect_to_vmseries', FIRST_WAIT + TRIES * INTERVAL)
+            tries = int((timeout - first_wait) / interval) + 1
         try:
-            if self.config['cloud_provider'] == 'aws':
-                handler = PanosDevice(self.logger, host=host,
-                                      user=self.cloud_client.config["username"],
-                                      ssh_key_file=self.cloud_client.config["pkey"])
-            elif self.config['cloud_provider'] == 'azure':
-                handler = PanosDevice(self.logger, host=host,
-                                      user=self.cloud_client.config["username"],
-                                      password=self.cloud_client.config["password"])
+            handler = self._open_device(cloud_client)
         except Exception as e:
             self.logger.info(f'{e}')
-            self.logger.info(f'Device not ready. Waiting {FIRST_WAIT}s for device to boot...')
-            time.sleep(FIRST_WAIT)
+            if cloud_client.wait_for_boot(FIRST_WAIT + TRIES * INTERVAL) is not None:
+                # Booted according to the cloud provider: only the management plane may still be starting
+                interval = min(interval, SIGNAL_INTERVAL)
+                tries = max(tries, int(INTERVAL * 2 / interval))
+            else:
+                self.logger.info(f'Device not ready. Waiting {int(first_wait)}s for device to boot...')
+                time.sleep(first_wait)
             while tries != 0:
                 handler = None
                 try:
-                    if self.config['cloud_provider'] == 'aws':
-                        handler = PanosDevice(self.logger, host=host,
-                                              user=self.cloud_client.config["username"],
-                                              ssh_key_file=self.cloud_client.config["pkey"])
-                    elif self.config['cloud_provider'] == 'azure':
-                        handler = PanosDevice(self.logger, host=host,
-                                              user=self.cloud_client.config["username"],
-                                              password=self.cloud_client.config["password"])
+                    handler = self._open_device(cloud_client)
                     break
                 except:
-                    self.logger.info(f'Management Plane not Ready. Waiting {INTERVAL}s to retry...')
-                    time.sleep(INTERVAL)
+                    self.logger.info(f'Management Plane not Ready. Waiting {int(interval)}s to retry...')
+                    time.sleep(interval)
                     tries -= 1
+        if handler is None:
+            raise Exception(f'VM-Series instance {cloud_client.public_ip} did not become reachable.')
         self.logger.info('*** VM-Series Instance is up and running ***')
-        self.handler = handler
+        return handler
+
+    def create_instance(self):
+        """
+        Launch the base instance, falling back to other sizes, placements or markets when capacity is short.
+        The latency of every launch attempt is recorded.
+        """
+        try:
+            return self.cloud_client.create_instance()
+        finally:
+            launches = getattr(self.cloud_client, 'launches', [])
+            for attempt in launches:
+                name = f'{attempt["size"]}/spot' if attempt['spot'] else attempt['size']
+                self.timings.record('launch', name, attempt['seconds'], attempt['started'],
+                                    success=attempt['error'] is None)
+            self.result['launches'] = [{key: attempt[key] for key in ('size', 'placement', 'spot', 'seconds', 'error')}
+                                       for attempt in launches]
+            size = self.config.get(size_key(self.config))
+            if size != self.timings.key['size']:
+                # Fallback size, the stage durations are recorded for the size actually used
+                self.logger.info(f'*** Build size: {size} ***')
+                self.timings.key['size'] = size
+
+    def connect_to_vmseries(self):
+        self.handler = self.wait_for_device(self.cloud_client)
+        if self.config['bootstrap']:
+            self.bootstrapped = self.verify_bootstrap()
         return self.handler
 
+    def verify_bootstrap(self):
+        """
+        Check that the firewall was licensed by the bootstrap init-cfg on first boot.
+        :return: True if the firewall is licensed.
+        """
+        self.logger.info('*** Verifying Bootstrap ***')
+        try:
+            status = self.handler.bootstrap_status()
+            for phase, state in status.items():
+                self.logger.info(f'{phase}: {state}')
+            self.result['bootstrap'] = status
+            self.handler.verify_system()
+        except Exception as e:
+            self.logger.warning(f'Bootstrap verification failed: {e}')
+            return False
+        self.logger.info('*** Firewall was licensed by Bootstrap ***')
+        return True
+
     def license_firewall(self):
-        if self.config['auth_code']:
+        if self.bootstrapped:
+            self.logger.info(f'*** Licensed by Bootstrap. Skipping Licensing Step. ***')
+        elif self.config['bootstrap'] and self.config['auth_code']:
+            self.logger.warning(f'*** Bootstrap did not license the Firewall. Licensing over SSH. ***')
+            self.handler.license(self.config['auth_code'])
+        elif self.config['auth_code']:
             self.handler.license(self.config['auth_code'])
         else:
             self.logger.info(f'*** License Auth-code not provided. Skipping Licensing Step. ***')
@@ -139,13 +643,13 @@ class CustomImage(object):
                 self.logger.info(f'*** Downloading {self.config["plugin"]} ***')
                 plugin_job = self.handler.exec(
                     f'request plugins download file {self.config["plugin"]}').job_id()
-                self.handler.check_job(plugin_job)
+                self.handler.check_job(plugin_job, 'plugin-download')
                 self.logger.info(f'*** {self.config["plugin"]} Download Complete ***')
 
                 self.logger.info(f'*** Installing {self.config["plugin"]} ***')
                 plugin_job = self.handler.exec(
                     f'request plugins install {self.config["plugin"]}').job_id()
-                self.handler.check_job(plugin_job)
+                self.handler.check_job(plugin_job, 'plugin-install')
                 self.logger.info(f'*** {self.config["plugin"]} Installation Complete ***')
             except Exception as e:
                 self.logger.error(f'Plugin upgrade failed!')
@@ -163,13 +667,13 @@ class CustomImage(object):
                 self.logger.info(f'*** Downloading Latest Content ***')
                 content_job = self.handler.exec(
                     f'request content upgrade download latest').job_id()
-                self.handler.check_job(content_job)
+                self.handler.check_job(content_job, 'content-download')
                 self.logger.info(f'*** Content Download Complete ***')
 
                 self.logger.info(f'*** Installing Latest Content ***')
                 content_job = self.handler.exec(
                     f'request content upgrade install version latest').job_id()
-                self.handler.check_job(content_job)
+                self.handler.check_job(content_job, 'content-install')
                 self.logger.info(f'*** Content Installation Complete ***')
             except Exception as e:
                 self.logger.error(f'Content upgrade failed!')
@@ -188,14 +692,14 @@ class CustomImage(object):
                 av_job = self.handler.exec(
                     f'request anti-virus upgrade download latest').job_id()
 
-                self.handler.check_job(av_job)
+                self.handler.check_job(av_job, 'antivirus-download')
                 self.logger.info(f'*** Antivirus Download Complete ***')
 
                 self.logger.info(f'*** Installing Latest Antivirus ***')
                 av_job = self.handler.exec(
                     f'request anti-virus upgrade install version latest').job_id()
 
-                self.handler.check_job(av_job)
+                self.handler.check_job(av_job, 'antivirus-install')
                 self.logger.info(f'*** Antivirus Installation Complete ***')
             else:
                 self.logger.info(f'*** Antivirus Upgrade not requested. Skipping Step. ***')
@@ -213,14 +717,14 @@ class CustomImage(object):
                 gp_job = self.handler.exec(
                     f'request global-protect-clientless-vpn upgrade download latest').job_id()
 
-                self.handler.check_job(gp_job)
+                self.handler.check_job(gp_job, 'gp-cvpn-download')
                 self.logger.info(f'*** Global-Protect Clientless-VPN Download Complete ***')
 
                 self.logger.info(f'*** Installing Latest Global-Protect Clientless-VPN ***')
                 gp_job = self.handler.exec(
                     f'request global-protect-clientless-vpn upgrade install version latest').job_id()
 
-                self.handler.check_job(gp_job)
+                self.handler.check_job(gp_job, 'gp-cvpn-install')
                 self.logger.info(f'*** Global-Protect Clientless-VPN Installation Complete ***')
             else:
                 self.logger.info(f'*** Global-Protect Clientless-VPN Upgrade not requested. Skipping Step. ***')
@@ -238,14 +742,14 @@ class CustomImage(object):
                 wf_job = self.handler.exec(
                     f'request wildfire upgrade download latest').job_id()
 
-                self.handler.check_job(wf_job)
+                self.handler.check_job(wf_job, 'wildfire-download')
                 self.logger.info(f'*** Wildfire Download Complete ***')
 
                 self.logger.info(f'*** Installing Latest Wildfire ***')
                 wf_job = self.handler.exec(
                     f'request wildfire upgrade install version latest').job_id()
 
-                self.handler.check_job(wf_job)
+                self.handler.check_job(wf_job, 'wildfire-install')
                 self.logger.info(f'*** Wildfire Installation Complete ***')
             else:
                 self.logger.info(f'*** Wildfire Upgrade not requested. Skipping Step. ***')
@@ -255,6 +759,10 @@ class CustomImage(object):
 
     def upgrade_panos(self):
         if self.config["sw_version"]:
+            installed = self.handler.versions()['panos']
+            if installed == self.config["version"]:
+                self.logger.info(f'*** PanOS {installed} already installed. Skipping Step. ***')
+                return
             try:
                 self.logger.info(f'*** Checking for Available PANOS Versions ***')
                 self.handler.exec('request system software check')
@@ -262,13 +770,13 @@ class CustomImage(object):
                 self.logger.info(f'*** Downloading {self.config["sw_version"]} ***')
                 sw_dw_job = self.handler.exec(
                     f'request system software download file {self.config["sw_version"]}').job_id()
-                self.handler.check_job(sw_dw_job)
+                self.handler.check_job(sw_dw_job, 'panos-download')
                 self.logger.info(f'*** {self.config["sw_version"]} Download Complete ***')
 
                 self.logger.info(f'*** Installing {self.config["sw_version"]} ***')
                 sw_dw_job = self.handler.exec(
                     f'request system software install version {self.config["version"]}').job_id()
-                self.handler.check_job(sw_dw_job)
+                self.handler.check_job(sw_dw_job, 'panos-install')
                 self.logger.info(f'*** {self.config["sw_version"]} Installation Complete ***')
 
             except Exception as e:
@@ -293,6 +801,10 @@ class CustomImage(object):
         else:
             self.handler.verify_versions(sw=self.config["version"],
                                          plugin=self.config["plugin"])
+            if when == "before":
+                # Recorded so the release watcher can tell which versions this image carries
+                self.result['versions'] = {name: str(version) if version is not None else None
+                                           for name, version in self.handler.versions().items()}
 
     def private_data_reset(self):
         if self.config['api_key']:
@@ -301,11 +813,48 @@ class CustomImage(object):
             self.logger.info(f'*** De-licensing API Key not provided. Skipping De-licensing Step. ***')
         self.handler.private_data_reset(self.config["cloud_provider"])
 
+    def bake_config(self):
+        if not self.config['baseline_config']:
+            self.logger.info(f'*** Baseline Configuration not requested. Skipping Step. ***')
+            return
+        commands = config_commands(self.config['baseline_config'])
+        self.logger.info(f'*** Applying Baseline Configuration {self.config["baseline_config"]} ***')
+        self.result['baseline_config'] = self.handler.load_config(commands)
+
     def create_custom_image(self):
+        # Close connection to the Firewall
+        if self.handler and self.handler.connected:
+            self.handler.close()
+
         self.logger.info(f'*** Stopping Instance ***')
-        self.cloud_client.stop_instance()
+        with self.timings.measure('cloud', 'stop_instance'):
+            self.cloud_client.stop_instance()
         self.logger.info(f'*** Instance Stopped ***')
 
         self.logger.info(f'*** Creating Custom Image ***')
-        self.cloud_client.create_image(name=f'PanOS-{self.config["version"]}-CustomImage')
+        with self.timings.measure('cloud', 'create_image'):
+            created = self.cloud_client.create_image(name=image_name(self.config["version"]))
+        if not created:
+            raise Exception('Custom Image creation failed!')
+        self.result['image_name'] = self.cloud_client.image_name
+        self.result['runtime_size'] = self.config['runtime_size']
+        self.result['images'] = dict(self.cloud_client.images)
         self.logger.info(f'*** Custom Image Creation Complete ***')
+
+    def fast_snapshot_restore(self):
+        self.logger.info(f'*** Enabling Fast Snapshot Restore ***')
+        try:
+            self.cloud_client.enable_fast_restore(self.config['fast_snapshot_restore'])
+        finally:
+            # Zones of the regions that succeeded, also after a partial failure
+            self.result['fast_restore'] = dict(self.cloud_client.fast_restore)
+        self.logger.info(f'*** Fast Snapshot Restore Enabled ***')
+
+    def replicate_image(self):
+        self.logger.info(f'*** Replicating Custom Image to {", ".join(self.config["replicate_regions"])} ***')
+        self.cloud_client.replicate_image(self.config['replicate_regions'])
+        self.result['images'] = dict(self.cloud_client.images)
+        self.logger.info(f'*** Custom Image Replication Complete ***')
+
+    def verify_images(self):
+        ImageVerifier(self).run()
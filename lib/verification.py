@@ -0,0 +1,118 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudclient.cloud_client import CloudProvider
+from lib.sizing import size_key
+
+PASSED = 'PASS'
+FAILED = 'FAIL'
+SKIPPED = 'SKIP'
+
+
+class ImageVerifier(object):
+    def __init__(self, custom_image):
+        """
+        Smoke test produced images: boot one instance per image and region, check versions, tear down.
+        :param CustomImage custom_image: Build that produced the images
+        """
+        self.lib = custom_image
+        self.logger = custom_image.logger
+        self.config = custom_image.config
+
+    def _client_config(self, region, image_id):
+        config = dict(self.config)
+        config['build_id'] = f'{self.lib.build_id}-verify-{region}'
+        # Do not consume a license for a test instance
+        config['bootstrap'] = False
+        # Test the image on the size it is meant to run on, not on the build size
+        config[size_key(config)] = config['runtime_size']
+        config['build_volume_type'] = ''
+        config['fallback_sizes'] = []
+        # Subnets of the build region
+        config['fallback_placements'] = []
+        if self.config['cloud_provider'] == 'aws':
+            network = self.config['verify_network'].get(region, {})
+            if region != self.config['region'] and not network:
+                return None
+            config['region'] = region
+            config['ami_id'] = image_id
+            config['mgmt_subnet_id'] = network.get('mgmt-subnet-id', config['mgmt_subnet_id'])
+            config['sg_id'] = network.get('sg-id', config['sg_id'])
+            config['key_pair_name'] = network.get('key-pair-name', config['key_pair_name'])
+        else:
+            config['image_id'] = image_id
+        return config
+
+    def _verify(self, region, image_id, clients):
+        entry = {'region': region, 'image': image_id, 'result': FAILED, 'time_to_ready': None, 'detail': ''}
+        config = self._client_config(region, image_id)
+        if config is None:
+            entry['result'] = SKIPPED
+            entry['detail'] = f'no verify-network settings for {region}'
+            return entry
+        started = time.time()
+        try:
+            client = CloudProvider(self.logger, config['cloud_provider'], config)
+            client.on_resource = self.lib.track
+            clients.append(client)
+            client.create_instance()
+            handler = self.lib.wait_for_device(client)
+            entry['time_to_ready'] = round(time.time() - started)
+            self.lib.timings.record('verify', 'time_to_ready', time.time() - started, started)
+            try:
+                # Images are delicensed and reset, a BYOL test instance has no license nor serial
+                handler.verify_versions(sw=self.config['version'], plugin=self.config['plugin'])
+            finally:
+                handler.close()
+            entry['result'] = PASSED
+        except Exception as e:
+            entry['detail'] = str(e)
+            self.logger.error(f'Verification of {image_id} in {region} failed: {e}')
+        return entry
+
+    def _teardown(self, client):
+        try:
+            client.terminate_instance()
+        except Exception as e:
+            self.logger.error(f'Unable to terminate verification instance: {e}')
+
+    def run(self):
+        """
+        :return: Pass/fail matrix, one dict per image and region.
+        :raises Exception: when any produced image failed verification
+        """
+        images = self.lib.cloud_client.images
+        self.logger.info(f'*** Verifying {len(images)} Custom Image(s) ***')
+        clients = []
+        with ThreadPoolExecutor(max_workers=len(images)) as executor:
+            futures = [executor.submit(self._verify, region, image_id, clients)
+                       for region, image_id in images.items()]
+        matrix = [future.result() for future in futures]
+        with ThreadPoolExecutor(max_workers=max(len(clients), 1)) as executor:
+            list(executor.map(self._teardown, clients))
+
+        self.logger.info(f'{"REGION":<20} {"IMAGE":<60} {"RESULT":<6} {"READY":>6}  DETAIL')
+        for entry in matrix:
+            ready = f'{entry["time_to_ready"]}s' if entry['time_to_ready'] is not None else '-'
+            self.logger.info(f'{entry["region"]:<20} {entry["image"]:<60} {entry["result"]:<6} {ready:>6}  '
+                             f'{entry["detail"]}')
+        self.lib.result['verification'] = matrix
+        failed = [entry for entry in matrix if entry['result'] == FAILED]
+        if failed:
+            raise Exception(f'{len(failed)} of {len(matrix)} Custom Image verification(s) failed.')
+        self.logger.info('*** Custom Image Verification Passed ***')
+        return matrix
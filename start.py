@@ -12,81 +12,169 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import json
+import os
+
+import yaml
+
 from lib.script_logger import Logger
-from lib.utils import CustomImage
 
 
 CONFIG_FILE = "config.yaml"
+QUEUE_FILE = "builds.db"
 
 
 def main():
+    # Imported here so the daemon client sub-commands do not load the cloud SDKs
+    from lib.utils import CustomImage
 
     # Custom Image library Initialization
     lib = CustomImage(logger, CONFIG_FILE)
 
-    # Create a base Instance
-    lib.cloud_client.create_instance()
+    # Run all the stages and terminate the base instance
+    lib.build()
+
+
+def daemon(args):
+    from lib.build_queue import BuildQueue
+    from lib.daemon import ImageFactory
+
+    factory = ImageFactory(logger, BuildQueue(args.db), workers=args.workers,
+                           provider_limits=parse_limits(args.provider_limit),
+                           region_limits=parse_limits(args.region_limit))
+    factory.serve(args.host, args.port)
+
+
+def watch(args):
+    from lib.build_queue import BuildQueue
+    from lib.release_watcher import load_watcher
+
+    watcher = load_watcher(logger, BuildQueue(args.db), args.watch_config)
+    if args.once:
+        watcher.check()
+    else:
+        watcher.run()
+
+
+def gc(args):
+    from lib.image_gc import ImageGC
+    from lib.utils import CustomImage
 
-    try:
-        # Connect to FW Instance
-        lib.connect_to_vmseries()
+    lib = CustomImage(logger, args.config)
+    config = lib.config
+    regions = args.region or [config.get('region', config.get('location'))] + list(config['replicate_regions'])
+    builds = []
+    if os.path.exists(args.db):
+        from lib.build_queue import BuildQueue, QUEUED, RUNNING, build_name
 
-        # License the FW
-        lib.license_firewall()
+        # Leftovers of the builds of a daemon running alongside are still in use
+        builds = [build_name(build) for build in BuildQueue(args.db).list([QUEUED, RUNNING], limit=-1)]
+    ImageGC(logger, lib.cloud_client, regions, keep_last=args.keep_last, max_age_days=args.max_age_days,
+            keep=args.keep or [], dry_run=args.dry_run, workers=args.workers, rate=args.rate, builds=builds).run()
 
-        # Verify System
-        lib.verify_system()
 
-        # Upgrade Content
-        lib.upgrade_content()
+def sizes(args):
+    from lib.sizing import report
+    from lib.timings import TimingStore
 
-        # Upgrade Anti-virus
-        lib.upgrade_antivirus()
+    timings = TimingStore(logger, args.db)
+    report(logger, timings, provider=args.provider, column=args.by)
+    timings.close()
 
-        # Upgrade Global-Protect Clientless VPN
-        lib.upgrade_gp_cvpn()
 
-        # Upgrade Wildfire
-        lib.upgrade_wildfire()
+def parse_limits(limits):
+    return {name: int(value) for name, value in (limit.split('=', 1) for limit in limits or [])}
 
-        # Upgrade VM Series Plugin
-        lib.upgrade_plugin()
 
-        # Upgrade PanOS
-        lib.upgrade_panos()
+def client(args):
+    from lib.daemon import request
 
-        # Verify Upgrades
-        lib.verify_upgrades(when="before")
+    url = f'http://{args.host}:{args.port}/builds'
+    if args.command == 'submit':
+        with open(args.config) as file:
+            spec = yaml.load(file, Loader=yaml.FullLoader)
+        output = request(url, 'POST', {'spec': spec, 'priority': args.priority})
+    elif args.command == 'status':
+        output = request(f'{url}/{args.id}' if args.id else url)
+    else:
+        output = request(f'{url}/{args.id}', 'DELETE')
+    print(json.dumps(output, indent=2))
 
-        # Perform Private Data Reset
-        lib.private_data_reset()
 
-        # Verify Upgrades after Private Data Reset
-        lib.verify_upgrades(when="after")
+def parse_args():
+    parser = argparse.ArgumentParser(description='Create custom VM-Series images. '
+                                                 'Without a sub-command, builds one image from config.yaml.')
+    commands = parser.add_subparsers(dest='command')
 
-        # Close connection to the Firewall
-        lib.handler.close()
+    daemon_parser = commands.add_parser('daemon', help='Run the image factory daemon')
+    daemon_parser.add_argument('--db', default=QUEUE_FILE, help='Build queue database')
+    daemon_parser.add_argument('--workers', type=int, default=2, help='Builds running at once')
+    daemon_parser.add_argument('--provider-limit', action='append', metavar='PROVIDER=N',
+                               help='Maximum running builds for a cloud provider')
+    daemon_parser.add_argument('--region-limit', action='append', metavar='REGION=N',
+                               help='Maximum running builds in a region/location')
 
-        # Create Custom Image
-        lib.create_custom_image()
+    watch_parser = commands.add_parser('watch', help='Queue rebuilds when new content/AV/WildFire/plugin '
+                                                     'versions are released')
+    watch_parser.add_argument('watch_config', help='Release watcher configuration file')
+    watch_parser.add_argument('--db', default=QUEUE_FILE, help='Build queue database of the daemon')
+    watch_parser.add_argument('--once', action='store_true', help='Check once and exit')
 
-        # # Cleanup
-        logger.info('*** Terminating Base Instance ***')
-        lib.cloud_client.terminate_instance()
-        logger.info('*** Termination Complete ***')
+    gc_parser = commands.add_parser('gc', help='Delete old custom images and their snapshots or disks')
+    gc_parser.add_argument('config', nargs='?', default=CONFIG_FILE, help='Configuration file with the credentials')
+    gc_parser.add_argument('--region', action='append', help='Region to clean up, default: region and '
+                                                               'replicate-regions of the configuration file')
+    gc_parser.add_argument('--keep-last', type=int, default=3, help='Images kept per region, version and SKU')
+    gc_parser.add_argument('--max-age-days', type=int, help='Delete images older than this, even the newest ones')
+    gc_parser.add_argument('--keep', action='append', metavar='ID', help='Image ID or name never deleted')
+    gc_parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+    gc_parser.add_argument('--workers', type=int, default=8, help='Deletions running at once')
+    gc_parser.add_argument('--rate', type=float, default=5, help='Maximum delete calls per second')
+    gc_parser.add_argument('--db', default=QUEUE_FILE, help='Build queue database of the daemon, the leftovers '
+                                                             'of its queued and running builds are kept')
 
-    except Exception as e:
-        # Failed
-        logger.error(f'*** Failed to Create Custom Image ***')
-        logger.error(f'TRACEBACK: {str(e)}')
-        # Terminating created Instance
-        logger.info('*** Terminating Base Instance ***')
-        lib.cloud_client.terminate_instance()
-        logger.info('*** Termination Complete ***')
+    sizes_parser = commands.add_parser('sizes', help='Compare stage durations across build instance sizes '
+                                                     'or storage profiles')
+    sizes_parser.add_argument('--by', choices=['size', 'storage'], default='size', help='Compared build setting')
+    sizes_parser.add_argument('--db', default='timings.db', help='Stage timing history database')
+    sizes_parser.add_argument('--provider', help='Only builds on this cloud provider')
+
+    submit_parser = commands.add_parser('submit', help='Queue a build on the daemon')
+    submit_parser.add_argument('config', nargs='?', default=CONFIG_FILE, help='Build configuration file')
+    submit_parser.add_argument('--priority', type=int, default=0, help='Higher runs first')
+
+    status_parser = commands.add_parser('status', help='Show queued, running and finished builds')
+    status_parser.add_argument('id', nargs='?', type=int, help='Build id')
+
+    cancel_parser = commands.add_parser('cancel', help='Cancel a queued or running build')
+    cancel_parser.add_argument('id', type=int, help='Build id')
+
+    for sub_parser in (daemon_parser, submit_parser, status_parser, cancel_parser):
+        sub_parser.add_argument('--host', default='127.0.0.1', help='Daemon API address')
+        sub_parser.add_argument('--port', type=int, default=8770, help='Daemon API port')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    # Setup Logger
-    logger = Logger(console=True, level='DEBUG')
-    # Create Custom Image
-    main()
+    args = parse_args()
+    if args.command in ('submit', 'status', 'cancel'):
+        client(args)
+    else:
+        # Setup Logger
+        logger = Logger(console=True, level='DEBUG')
+        if args.command == 'daemon':
+            # Run the image factory
+            daemon(args)
+        elif args.command == 'watch':
+            # Queue builds for new releases
+            watch(args)
+        elif args.command == 'gc':
+            # Delete old custom images
+            gc(args)
+        elif args.command == 'sizes':
+            # Stage durations per build size
+            sizes(args)
+        else:
+            # Create Custom Image
+            main()
@@ -0,0 +1,68 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import lib.base_images
+from lib.base_images import UPGRADE_STAGES, BaseImageCache, select_base_image, skipped_stages
+
+IMAGES = [
+    {'id': 'ami-1', 'version': '9.1.4', 'name': 'PA-VM-AWS-9.1.4', 'created': '2020-10-01'},
+    {'id': 'ami-2', 'version': '10.0.2', 'name': 'PA-VM-AWS-10.0.2', 'created': '2020-11-01'},
+    {'id': 'ami-3', 'version': '10.0.2', 'name': 'PA-VM-AWS-10.0.2', 'created': '2020-12-01'},
+    {'id': 'ami-4', 'version': '10.0.10', 'name': 'PA-VM-AWS-10.0.10', 'created': '2021-03-01'},
+]
+
+
+def test_select_base_image():
+    # Numeric, not lexical, versions
+    assert select_base_image(IMAGES, '10.0.10')['id'] == 'ami-4'
+    # The newest image of the closest version below the target
+    assert select_base_image(IMAGES, '10.0.3')['id'] == 'ami-3'
+    assert select_base_image(IMAGES, '9.1.0') is None
+    assert skipped_stages('10.0.2', '10.0.2') == UPGRADE_STAGES
+    assert skipped_stages('10.0.2', '10.0.3') == []
+
+
+def test_cache_saved_by_concurrent_builds(tmp_path, monkeypatch):
+    path = str(tmp_path / 'base-images.json')
+    cache = BaseImageCache(logging.getLogger('test_base_images'), path)
+    # Both builds are writing the cache at the same time
+    writing = threading.Barrier(2, timeout=10)
+
+    def dump(entries, file, **kwargs):
+        writing.wait()
+        file.write(json.dumps(entries, **kwargs))
+    monkeypatch.setattr(lib.base_images.json, 'dump', dump)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(cache._save, [{'aws/us-west-1/byol': 1}, {'aws/us-east-1/byol': 2}]))
+    monkeypatch.undo()
+    with open(path) as file:
+        assert json.load(file) in ({'aws/us-west-1/byol': 1}, {'aws/us-east-1/byol': 2})
+    assert os.listdir(str(tmp_path)) == ['base-images.json']
+
+
+def test_cache_ttl(tmp_path):
+    cache = BaseImageCache(logging.getLogger('test_base_images'), str(tmp_path / 'base-images.json'))
+    assert cache.get('aws/us-west-1/byol', lambda: IMAGES) == IMAGES
+    # Fresh listing, not fetched again
+
+    def fail():
+        raise Exception('Not expected')
+    assert cache.get('aws/us-west-1/byol', fail) == IMAGES
@@ -0,0 +1,87 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+from cloudclient.boot_signals import boot_complete
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+LOGIN = 'PA-VM login: '
+
+
+def fixture(name):
+    """
+    Synthetic console log, written after the layout of PAN-OS VM-Series consoles, not captured from an instance.
+    The second boot repeats the messages and login prompt of the first one, only the kernel timestamps differ.
+    """
+    with open(os.path.join(FIXTURES, f'synthetic-{name}'), newline='') as f:
+        return f.read()
+
+
+def polls(log):
+    """
+    Console log as read by successive polls, one more line each time.
+    """
+    end = log.find('\n')
+    while end != -1:
+        yield log[:end + 1]
+        end = log.find('\n', end + 1)
+
+
+@pytest.mark.parametrize('provider', ['aws-console', 'azure-serial'])
+def test_first_boot(provider):
+    log = fixture(f'{provider}-first-boot.txt')
+    for partial in polls(log):
+        assert boot_complete(partial) == (LOGIN in partial)
+    assert boot_complete(log)
+
+
+@pytest.mark.parametrize('provider', ['aws-console', 'azure-serial'])
+def test_reboot_with_old_baseline(provider):
+    baseline = fixture(f'{provider}-first-boot.txt')
+    log = fixture(f'{provider}-reboot.txt')
+    assert not boot_complete(baseline, baseline, reboot=True)
+    second_login = log.rindex(LOGIN)
+    for partial in polls(log):
+        assert boot_complete(partial, baseline, reboot=True) == (len(partial) > second_login)
+    assert boot_complete(log, baseline, reboot=True)
+
+
+def test_reboot_with_truncated_log():
+    baseline = fixture('aws-console-first-boot.txt')
+    log = fixture('aws-console-truncated.txt')
+    second_login = log.rindex(LOGIN)
+    assert log.count(LOGIN) == 2
+    assert not boot_complete(log[:second_login], baseline, reboot=True)
+    assert boot_complete(log, baseline, reboot=True)
+    # The baseline itself may already be truncated, the latest output shifts with every line printed
+    assert not boot_complete(log[:second_login], baseline[200:], reboot=True)
+    assert boot_complete(log, baseline[200:], reboot=True)
+
+
+def test_reboot_with_rotated_log():
+    baseline = fixture('azure-serial-first-boot.txt')
+    log = fixture('azure-serial-rotated.txt')
+    assert 'Linux version' not in log
+    assert not boot_complete(log[:log.rindex(LOGIN)], baseline, reboot=True)
+    assert boot_complete(log, baseline, reboot=True)
+
+
+def test_stale_log():
+    baseline = fixture('aws-console-reboot.txt')
+    # An older, shorter read of the console after the baseline was captured
+    assert not boot_complete(baseline[:len(baseline) // 2], baseline, reboot=True)
+    assert not boot_complete('', baseline, reboot=True)
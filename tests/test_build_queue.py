@@ -0,0 +1,65 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from lib.build_queue import CANCELLED, QUEUED, RUNNING, SUCCEEDED, BuildQueue, build_name
+
+AWS = {'cloud-provider': 'aws', 'region': 'us-west-1', 'software-version': 'PanOS_vm-10.0.3'}
+AZURE = {'cloud-provider': 'azure', 'location': 'westus', 'software-version': 'PanOS_vm-10.0.3'}
+GCP = {'cloud-provider': 'gcp', 'zone': 'us-central1-a', 'software-version': 'PanOS_vm-10.0.3'}
+
+
+def test_identical_queued_spec_is_not_queued_twice(tmp_path):
+    queue = BuildQueue(str(tmp_path / 'builds.db'))
+    assert queue.submit(AWS) == (1, False)
+    # Key order does not matter, the higher priority is kept
+    assert queue.submit(dict(reversed(list(AWS.items()))), priority=5) == (1, True)
+    assert queue.get(1)['priority'] == 5
+    assert queue.submit(AWS, priority=1) == (1, True)
+    assert queue.get(1)['priority'] == 5
+    # Once running, the same spec is a new build
+    queue.claim(lambda provider, region: True)
+    assert queue.submit(AWS) == (2, False)
+
+
+def test_claim_by_priority_and_limits(tmp_path):
+    queue = BuildQueue(str(tmp_path / 'builds.db'))
+    queue.submit(AWS)
+    queue.submit(AZURE, priority=1)
+    queue.submit(GCP, priority=1)
+    build = queue.claim(lambda provider, region: provider != 'azure')
+    assert (build['id'], build['provider'], build['region']) == (3, 'gcp', 'us-central1-a')
+    assert build_name(build) == 'q3'
+    assert queue.get(3)['state'] == RUNNING
+    assert queue.claim(lambda provider, region: True)['id'] == 2
+    assert queue.claim(lambda provider, region: True)['id'] == 1
+    assert queue.claim(lambda provider, region: True) is None
+
+
+def test_recover_deletes_resources_and_requeues(tmp_path):
+    queue = BuildQueue(str(tmp_path / 'builds.db'))
+    for spec in (AWS, AZURE, GCP):
+        queue.submit(spec)
+    for _ in range(3):
+        queue.claim(lambda provider, region: True)
+    queue.track(1, {'type': 'instance', 'id': 'i-1'})
+    queue.track(1, {'type': 'instance', 'id': 'i-1'})
+    queue.finish(2, SUCCEEDED)
+    queue.track(3, {'type': 'instance', 'id': 'gcp-1'})
+    queue.cancel(3)
+
+    cleaned = []
+    assert queue.recover(lambda build: cleaned.append((build['id'], build['resources']))) == 1
+    assert cleaned == [(1, [{'type': 'instance', 'id': 'i-1'}]), (3, [{'type': 'instance', 'id': 'gcp-1'}])]
+    assert [queue.get(build_id)['state'] for build_id in (1, 2, 3)] == [QUEUED, SUCCEEDED, CANCELLED]
+    assert queue.get(1)['resources'] == []
@@ -0,0 +1,58 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import logging
+import threading
+
+import lib.daemon
+from lib.build_queue import FAILED, BuildQueue
+from lib.daemon import FactoryRequestHandler, FactoryServer, ImageFactory, request
+
+SPEC = {'cloud-provider': 'gcp', 'software-version': 'PanOS_vm-10.0.3', 'gcp-project': 'project',
+        'zone': 'us-central1-a', 'machine-type': 'n1-standard-4', 'source-image': 'vmseries-flex-byol-1003',
+        'subnetworks': ['mgmt'], 'instance-pkey': 'private_key.pem'}
+
+
+def test_submit_validates_the_spec(tmp_path):
+    factory = ImageFactory(logging.getLogger('test_daemon'), BuildQueue(str(tmp_path / 'builds.db')))
+    server = FactoryServer(('127.0.0.1', 0), FactoryRequestHandler)
+    server.factory = factory
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/builds'
+    try:
+        answer = request(url, 'POST', {'spec': {'cloud-provider': 'gcp'}})
+        assert answer['error'] == 'Invalid spec'
+        assert '"software-version" is mandatory.' in answer['problems']
+        assert factory.queue.list() == []
+        answer = request(url, 'POST', {'spec': SPEC})
+        assert answer == {'id': 1, 'duplicate': False}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_build_log_is_closed(tmp_path, monkeypatch):
+    stream = io.StringIO()
+    build_logger = logging.Logger('build-1')
+    build_logger.addHandler(logging.StreamHandler(stream))
+    monkeypatch.setattr(lib.daemon, 'Logger', lambda **kwargs: build_logger)
+    build_logger.get_log_location = lambda: 'build-1.log'
+
+    queue = BuildQueue(str(tmp_path / 'builds.db'))
+    queue.submit({'cloud-provider': 'gcp'})
+    factory = ImageFactory(logging.getLogger('test_daemon'), queue)
+    factory._run(queue.claim(lambda provider, region: True))
+    assert queue.get(1)['state'] == FAILED
+    assert build_logger.handlers == []
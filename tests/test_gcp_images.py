@@ -0,0 +1,47 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from benchmarks.fake_compute import PROJECT, ZONE, FakeCompute, serve
+from cloudclient.gcp_client import CloudGcp
+
+
+def _image(fake, name):
+    fake.images[name] = {'name': name, 'status': 'READY', 'diskSizeGb': '60',
+                         'labels': {'custom-imaging': 'true', 'panos-version': '10-0-3'},
+                         'selfLink': f'{fake.base}/projects/{PROJECT}/global/images/{name}'}
+    return f'projects/{PROJECT}/global/images/{name}'
+
+
+def test_custom_images_in_use():
+    fake = FakeCompute(operation_seconds=0)
+    server = serve(fake)
+    try:
+        # Disks of instances in several zones are listed over several pages
+        for number, zone in enumerate([ZONE, 'us-central1-b', 'us-east1-c']):
+            fake.instances[(zone, f'build-{number}')] = {'name': f'build-{number}', 'zone': zone,
+                                                         'sourceImage': _image(fake, f'image-{number}')}
+        fake.templates['firewalls'] = {'name': 'firewalls', 'properties': {'disks': [
+            {'boot': True, 'initializeParams': {'sourceImage': _image(fake, 'image-template')}}]}}
+        _image(fake, 'image-unused')
+
+        client = CloudGcp(logging.getLogger('test_gcp_images'),
+                          {'project': PROJECT, 'zone': ZONE, 'gcp_endpoint': fake.base})
+        in_use = {image['name']: image['in_use'] for image in client.custom_images('global')}
+    finally:
+        server.shutdown()
+    assert in_use == {'image-0': True, 'image-1': True, 'image-2': True, 'image-template': True,
+                      'image-unused': False}
+    assert fake.calls['GET aggregated/disks'] == 3
@@ -0,0 +1,51 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from lib.build_queue import QUEUED, RUNNING, BuildQueue, build_name
+from lib.image_gc import LEFTOVER_MIN_AGE, select
+
+NOW = 1800000000.0
+
+
+def _leftover(kind, build_id, age):
+    return {'kind': kind, 'id': f'/{kind}/PANW-CI-{build_id}', 'name': f'PANW-CI-{build_id}', 'region': 'eastus',
+            'group': 'leftover network', 'created': NOW - age if age is not None else None, 'size_gb': 0,
+            'in_use': False, 'build_id': build_id}
+
+
+def test_leftovers_of_running_builds_are_kept(tmp_path):
+    queue = BuildQueue(str(tmp_path / 'builds.db'))
+    running, _ = queue.submit({'cloud-provider': 'azure', 'location': 'eastus'})
+    queue.claim(lambda provider, region: True)
+    queued, _ = queue.submit({'cloud-provider': 'azure', 'location': 'westus'})
+    builds = [build_name(build) for build in queue.list([QUEUED, RUNNING], limit=-1)]
+    assert sorted(builds) == sorted([f'q{running}', f'q{queued}'])
+
+    old = LEFTOVER_MIN_AGE * 2
+    leftovers = [
+        _leftover('nic', f'q{running}', old),
+        _leftover('public ip', f'q{queued}-ha', old),
+        _leftover('nic', 'q1000', LEFTOVER_MIN_AGE / 2),
+        _leftover('public ip', 'q1000', old),
+        _leftover('nic', '4411', None),
+    ]
+    reasons = {(image['kind'], image['build_id']): reason for image, reason in select(leftovers, now=NOW,
+                                                                                     builds=builds)}
+    assert reasons == {
+        ('nic', f'q{running}'): 'build in progress',
+        ('public ip', f'q{queued}-ha'): 'build in progress',
+        ('nic', 'q1000'): 'recent',
+        ('public ip', 'q1000'): None,
+        ('nic', '4411'): None,
+    }
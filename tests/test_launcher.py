@@ -0,0 +1,62 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+import pytest
+
+from cloudclient.launcher import Launcher, gcp_capacity_error, launch_plan
+
+LOGGER = logging.getLogger('test_launcher')
+
+
+def test_plan_order():
+    plan = launch_plan(['m5.xlarge', 'c5.xlarge', 'm5.xlarge', None], ['subnet-a', 'subnet-b', 'subnet-a'],
+                       spot=True)
+    assert [(attempt['spot'], attempt['size'], attempt['placement']) for attempt in plan] == [
+        (True, 'm5.xlarge', 'subnet-a'), (True, 'm5.xlarge', 'subnet-b'),
+        (True, 'c5.xlarge', 'subnet-a'), (True, 'c5.xlarge', 'subnet-b'),
+        (False, 'm5.xlarge', 'subnet-a'), (False, 'm5.xlarge', 'subnet-b'),
+        (False, 'c5.xlarge', 'subnet-a'), (False, 'c5.xlarge', 'subnet-b')]
+    assert launch_plan(['n1-standard-4'], []) == [{'size': 'n1-standard-4', 'placement': None, 'spot': False}]
+
+
+def test_fallback_on_capacity_errors():
+    plan = launch_plan(['n2-standard-8', 'n1-standard-8'], ['us-central1-a', 'us-central1-b'])
+
+    def launch(attempt):
+        if attempt['size'] == 'n2-standard-8' or attempt['placement'] == 'us-central1-a':
+            raise Exception('(ZONE_RESOURCE_POOL_EXHAUSTED) No capacity')
+        return 'instance'
+    launcher = Launcher(LOGGER, plan, gcp_capacity_error, delay=0)
+    attempt, result = launcher.run(launch)
+    assert (attempt['size'], attempt['placement'], result) == ('n1-standard-8', 'us-central1-b', 'instance')
+    assert [entry['error'] is None for entry in launcher.attempts] == [False, False, False, True]
+
+
+def test_rounds_and_other_errors():
+    plan = launch_plan(['n2-standard-8'], ['us-central1-a'])
+
+    def exhausted(attempt):
+        raise Exception('(ZONE_RESOURCE_POOL_EXHAUSTED) No capacity')
+    launcher = Launcher(LOGGER, plan, gcp_capacity_error, rounds=3, delay=0)
+    with pytest.raises(Exception, match='after 3 attempt'):
+        launcher.run(exhausted)
+
+    def quota(attempt):
+        raise Exception('(QUOTA_EXCEEDED) Quota exceeded')
+    launcher = Launcher(LOGGER, plan, gcp_capacity_error, rounds=3, delay=0)
+    with pytest.raises(Exception, match='QUOTA_EXCEEDED'):
+        launcher.run(quota)
+    assert len(launcher.attempts) == 1
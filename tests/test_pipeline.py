@@ -0,0 +1,83 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+
+from lib.pipeline import DONE, FAILED, SKIPPED, Pipeline, Stage, ancestors, subset
+
+LOGGER = logging.getLogger('test_pipeline')
+
+
+def fail():
+    raise Exception('Broken')
+
+
+def test_stages_run_after_their_requirements():
+    order = []
+    lock = threading.Lock()
+
+    def step(name):
+        def run():
+            with lock:
+                order.append(name)
+        return run
+    stages = [Stage('commit', step('commit'), requires=['upgrade', 'content']),
+              Stage('upgrade', step('upgrade'), locks=['device']),
+              Stage('content', step('content'), locks=['device']),
+              Stage('disabled', fail, enabled=False)]
+    assert Pipeline(LOGGER, stages).run()
+    assert order[-1] == 'commit'
+    assert sorted(order) == ['commit', 'content', 'upgrade']
+    assert [stage.state for stage in stages] == [DONE, DONE, DONE, DONE]
+
+
+def test_failure_skips_dependent_stages():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise Exception('Not yet')
+    cleaned = []
+    stages = [Stage('launch', lambda: None),
+              Stage('license', flaky, requires=['launch'], retries=1, retry_delay=0),
+              Stage('content', fail, requires=['launch'], optional=True),
+              Stage('upgrade', fail, requires=['license', 'content']),
+              Stage('commit', lambda: None, requires=['upgrade']),
+              Stage('cleanup', lambda: cleaned.append(1), requires=['commit'], always=True)]
+    pipeline = Pipeline(LOGGER, stages)
+    assert not pipeline.run()
+    assert [stage.state for stage in stages] == [DONE, DONE, FAILED, FAILED, SKIPPED, DONE]
+    assert pipeline.error == 'upgrade: Broken'
+    assert cleaned == [1]
+
+
+def test_subset_keeps_the_order():
+    stages = [Stage('launch', None), Stage('license', None, requires=['launch']),
+              Stage('upgrade', None, requires=['license']), Stage('commit', None, requires=['upgrade'])]
+    assert ancestors(stages, 'upgrade') == {'launch', 'license', 'upgrade'}
+    selected = subset(stages, {'launch', 'commit'})
+    assert [(stage.name, stage.requires) for stage in selected] == [('launch', []), ('commit', ['launch'])]
+
+
+def test_critical_path():
+    stages = [Stage('launch', None), Stage('license', None, requires=['launch']),
+              Stage('content', None, requires=['launch']), Stage('commit', None, requires=['license', 'content'])]
+    for stage, (started, finished) in zip(stages, [(0, 100), (100, 400), (100, 150), (400, 500)]):
+        stage.started, stage.finished = started, finished
+    path, total, slack = Pipeline(LOGGER, stages).critical_path()
+    assert path == ['launch', 'license', 'commit']
+    assert total == 500
+    assert slack['content'] == 250
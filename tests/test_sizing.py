@@ -0,0 +1,47 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+import pytest
+
+from lib.sizing import select_build_size, size_key
+from lib.timings import TimingStore
+
+LOGGER = logging.getLogger('test_sizing')
+CANDIDATES = ['c5.2xlarge', 'm5.2xlarge', 'c5.xlarge']
+
+
+def record(tmp_path, size, durations, provider='aws'):
+    timings = TimingStore(LOGGER, str(tmp_path / 'timings.db'), key={'provider': provider, 'size': size})
+    for name, duration in durations.items():
+        timings.record('stage', name, duration)
+    return timings
+
+
+def test_first_candidate_without_history(tmp_path):
+    timings = record(tmp_path, 'm5.2xlarge', {'upgrade_panos': 100}, provider='azure')
+    assert select_build_size(LOGGER, timings, 'aws', CANDIDATES) == 'c5.2xlarge'
+    with pytest.raises(Exception):
+        select_build_size(LOGGER, timings, 'aws', [])
+
+
+def test_fastest_size_on_common_stages(tmp_path):
+    record(tmp_path, 'c5.2xlarge', {'upgrade_panos': 600, 'content': 300})
+    # Faster on the stages both sizes ran, the extra stage is not counted
+    record(tmp_path, 'm5.2xlarge', {'upgrade_panos': 500, 'content': 300, 'antivirus': 400})
+    # Not available in the region
+    timings = record(tmp_path, 'c5.4xlarge', {'upgrade_panos': 100, 'content': 100})
+    assert select_build_size(LOGGER, timings, 'aws', CANDIDATES) == 'm5.2xlarge'
+    assert size_key({'vm_size': 'Standard_D8s_v3'}) == 'vm_size'
@@ -0,0 +1,36 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from cloudclient.storage import BASELINE_IOPS, BASELINE_THROUGHPUT, build_block_devices, image_block_devices
+
+
+def test_build_volume():
+    config = {'build_volume_type': 'gp3', 'build_volume_iops': 6000, 'build_volume_throughput': 500}
+    ebs = build_block_devices(config)[0]['Ebs']
+    assert (ebs['VolumeType'], ebs['Iops'], ebs['Throughput']) == ('gp3', 6000, 500)
+    # Throughput is only provisioned on gp3
+    assert 'Throughput' not in build_block_devices(dict(config, build_volume_type='io2'))[0]['Ebs']
+
+
+def test_image_volume_is_reset_to_the_baseline():
+    assert image_block_devices({}) == []
+    assert image_block_devices({'build_volume_type': 'gp3'}) == []
+    ebs = image_block_devices({'build_volume_type': 'gp3', 'build_volume_iops': 16000,
+                               'build_volume_throughput': 1000})[0]['Ebs']
+    assert (ebs['VolumeType'], ebs['Iops'], ebs['Throughput']) == ('gp3', BASELINE_IOPS, BASELINE_THROUGHPUT)
+    ebs = image_block_devices({'build_volume_type': 'io2', 'build_volume_iops': 64000})[0]['Ebs']
+    assert (ebs['VolumeType'], ebs['Iops']) == ('io2', BASELINE_IOPS)
+    ebs = image_block_devices({'build_volume_type': 'io2', 'build_volume_iops': 64000,
+                               'runtime_volume_type': 'gp2'})[0]['Ebs']
+    assert ebs == {'DeleteOnTermination': True, 'VolumeType': 'gp2'}
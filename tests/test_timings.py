@@ -0,0 +1,64 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from lib.timings import TimingStore, percentile
+
+KEY = {'provider': 'aws', 'size': 'm5.xlarge', 'storage': '', 'region': 'us-west-1', 'versions': '10.0.3/'}
+
+
+def store(tmp_path, key=KEY, build='run-1'):
+    return TimingStore(logging.getLogger('test_timings'), str(tmp_path / 'timings.db'), key=key, build=build)
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([10, 30, 20], 50) == 20
+    assert percentile([0, 100], 95) == 95
+
+
+def test_key_is_relaxed_down_to_the_provider(tmp_path):
+    history = store(tmp_path, dict(KEY, size='m5.2xlarge', region='us-east-1'), build='run-0')
+    for duration in (100, 110, 120):
+        history.record('stage', 'upgrade_panos', duration)
+    history.record('stage', 'upgrade_panos', 999, success=False)
+    timings = store(tmp_path)
+    # Other sizes and regions of the provider
+    assert sorted(timings.durations('stage', 'upgrade_panos')) == [100, 110, 120]
+    assert timings.timeout('stage', 'upgrade_panos', default=600) == percentile([100, 110, 120], 95) * 1.5
+    # An exact match is preferred once it has enough samples
+    for duration in (10, 11, 12):
+        timings.record('stage', 'upgrade_panos', duration)
+    assert sorted(timings.durations('stage', 'upgrade_panos')) == [10, 11, 12]
+
+
+def test_other_providers_are_no_history(tmp_path):
+    azure = store(tmp_path, dict(KEY, provider='azure'), build='run-0')
+    for duration in (100, 110, 120):
+        azure.record('stage', 'upgrade_panos', duration)
+    timings = store(tmp_path)
+    assert timings.durations('stage', 'upgrade_panos') == []
+    assert timings.timeout('stage', 'upgrade_panos', default=600) == 600
+    assert timings.poll_interval('stage', 'upgrade_panos', default=30) == 30
+    assert timings.eta(['upgrade_panos']) == (0, 1)
+
+
+def test_regressions_compare_with_other_builds(tmp_path):
+    for number, duration in enumerate((100, 100, 100)):
+        store(tmp_path, build=f'run-{number}').record('stage', 'commit', duration)
+    timings = store(tmp_path, build='run-3')
+    timings.record('stage', 'commit', 200)
+    report = timings.regressions()
+    assert [(entry['name'], entry['ratio']) for entry in report] == [('commit', 2.0)]
@@ -0,0 +1,95 @@
+# Copyright 2019 Palo Alto Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+import threading
+
+from benchmarks.fake_server import serve
+from benchmarks.replay import replay
+from lib.pandevice import PanosDevice, config_secrets
+from lib.transcript import MASK, TranscriptRecorder, load
+
+AUTH_CODE = 'I7654321'
+COMMANDS = [f'request license fetch auth-code {AUTH_CODE}', 'show system info']
+
+
+def _fake_server():
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    ports = queue.Queue()
+    threading.Thread(target=serve, kwargs={'ready': ports.put}, daemon=True).start()
+    return ports.get(timeout=30)
+
+
+def test_record_and_replay_with_secrets(tmp_path):
+    logger = logging.getLogger('test_transcript')
+    path = str(tmp_path / 'build.jsonl.gz')
+    recorder = TranscriptRecorder(path, secrets=[AUTH_CODE])
+    device = PanosDevice(logger, host='127.0.0.1', port=_fake_server(), user='admin', password='admin',
+                         recorder=recorder)
+    for command in COMMANDS:
+        device.exec(command)
+    device.close()
+    recorder.close()
+
+    sends = [text for session in load(path) for _, direction, text in session['events'] if direction == 's']
+    assert not any(AUTH_CODE in text for text in sends)
+    assert any(f'auth-code {MASK}' in text for text in sends)
+
+    results = replay(path, timeout=5, logger=logger)
+    replayed = {command: response for _, command, _, response in results}
+    assert f'request license fetch auth-code {MASK}' in replayed
+    assert all(response is not None for response in replayed.values())
+    assert 'sw-version' in replayed['show system info']
+
+
+class _Channel(object):
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.sent = []
+
+    def recv(self, size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def test_secrets_split_across_chunks_are_masked(tmp_path):
+    password = 'Sup3r-S3cret'
+    commands = [f'set mgt-config users ops password {password}', 'set deviceconfig system hostname fw1']
+    secrets = config_secrets(commands)
+    assert secrets == [password]
+    path = str(tmp_path / 'build.jsonl')
+    recorder = TranscriptRecorder(path, secrets=[AUTH_CODE] + secrets)
+    channel = recorder.channel(_Channel([b'auth-code I765', b'4321 accepted\r\n', b'users ops password Sup3r',
+                                         b'-S3cret\r\nadmin@PA-VM# ']))
+    for _ in range(2):
+        channel.recv(1024)
+    channel.send(''.join(command + '\n' for command in commands))
+    while channel.recv(1024):
+        pass
+    recorder.close()
+
+    events = load(path)[0]['events']
+    text = ''.join(data for _, _, data in events)
+    assert AUTH_CODE not in text and password not in text
+    assert 'auth-code <masked> accepted' in text
+    assert f'password {MASK}\r\nadmin@PA-VM# ' in text
+    # The beginning of a possible secret is held back until the next chunk, never past a send
+    assert [direction for _, direction, _ in events] == ['r', 'r', 's', 'r', 'r']